@@ -20,6 +20,7 @@ Serpent handles several special Python types to make life easier:
  - Exception  --> dict with some fields of the exception (message, args)
  - collections module types  --> mostly equivalent primitive types or dict
  - enums --> the value of the enum
+ - numpy arrays --> (nested) lists, numpy scalars --> the equivalent python value (no dependency on numpy)
  - all other types  --> dict with  __getstate__  or vars() of the object
 
 Notes:
@@ -41,8 +42,17 @@ Software license: "MIT software license". See http://opensource.org/licenses/MIT
 """
 
 import ast
+import abc
+import re
+import os
+import stat
+import mmap
 import base64
+import binascii
 import sys
+import types
+import threading
+import functools
 import gc
 import decimal
 import datetime
@@ -51,51 +61,929 @@ import array
 import math
 import numbers
 import codecs
+import struct
+import zlib
+try:
+    import lzma
+except ImportError:
+    lzma = None     # python can be built without it
 import collections
+import itertools
 import enum
 from collections.abc import KeysView, ValuesView, ItemsView
+# asyncio, multiprocessing and concurrent.futures are imported where they're used: they take longer to import than serpent
 
 __version__ = "1.42"
-__all__ = ["dump", "dumps", "load", "loads", "register_class", "unregister_class", "tobytes"]
+__all__ = ["dump", "dump_into", "dumps", "dumps_many", "iter_dumps", "load", "loads", "iterload", "register_class",
+           "unregister_class", "tobytes", "extract", "make_zdict", "OutputTooLargeError", "FrameWriter", "FrameReader",
+           "IncrementalDecoder", "dump_async", "load_async", "SerpentArchive"]
 
 
-def dumps(obj, indent=False, module_in_classname=False, bytes_repr=False):
+def dumps(obj, indent=False, module_in_classname=False, bytes_repr=False, engine="recursive", memo_size=0, workers=None,
+          canonical=False, trusted=False, max_bytes=None, compress=None, zdict=None):
     """
     Serialize object tree to bytes.
     indent = indent the output over multiple lines (default=false)
     module_in_classname = include module prefix for class names or only use the class name itself
     bytes_repr = should the bytes literal value representation be used instead of base-64 encoding for bytes types?
+                 "adaptive" = per value, use whichever of the two is smaller
+    engine = "recursive" (default) or "iterative" (no nesting depth limit). Both produce identical output.
+    memo_size = reuse the serialized form of up to this many repeated immutable values and dict keys (0=off)
+    workers = serialize a large top-level list, tuple or dict in parallel with this many processes (default=None, don't)
+              The output is identical. See Serializer.serialize_parallel for details.
+    canonical = write dict keys and set elements in a fixed order, so that equal object trees give identical bytes
+    trusted = skip the checks for circular references and invalid dict keys, for data known to be free of them
+    max_bytes = raise OutputTooLargeError as soon as the output exceeds this many bytes (default=None, no limit)
+    compress = "zlib" or "lzma" to compress the output (default=None, don't). loads() recognises compressed data.
+    zdict = preset dictionary for zlib compression, see make_zdict(). Decompression needs the same one.
     """
-    return Serializer(indent, module_in_classname, bytes_repr).serialize(obj)
+    serializer = Serializer(indent, module_in_classname, bytes_repr, engine, memo_size, canonical, trusted, max_bytes,
+                            compress, zdict)
+    if workers and workers > 1:
+        return serializer.serialize_parallel(obj, workers)
+    return serializer.serialize(obj)
 
 
-def dump(obj, file, indent=False, module_in_classname=False, bytes_repr=False):
+def dumps_many(objs, indent=False, module_in_classname=False, bytes_repr=False, engine="recursive", memo_size=0, buffer=None,
+               canonical=False, trusted=False, max_bytes=None, compress=None, zdict=None):
+    """
+    Serialize every object tree from an iterable into its own message, doing the setup work only once.
+    Returns a list with the bytes of each message, identical to what dumps() returns for that object.
+    buffer = if given (a bytearray), the messages are appended to it one after another instead,
+             and a list of the (start, end) offsets of each message in the buffer is returned.
+    The other parameters are the same as for dumps().
+    """
+    return Serializer(indent, module_in_classname, bytes_repr, engine, memo_size, canonical, trusted,
+                      max_bytes, compress, zdict).serialize_many(objs, buffer)
+
+
+def iter_dumps(obj, indent=False, module_in_classname=False, bytes_repr=False, chunk_size=65536, memo_size=0,
+               canonical=False, trusted=False, max_bytes=None, compress=None, zdict=None):
+    """
+    Serialize object tree to a sequence of chunks of bytes (a generator).
+    The chunks are produced while the object tree is being serialized, and all are chunk_size bytes long,
+    except the last one. Joined together they are identical to what dumps() returns.
+    indent = indent the output over multiple lines (default=false)
+    module_in_classname = include module prefix for class names or only use the class name itself
+    bytes_repr = should the bytes literal value representation be used instead of base-64 encoding for bytes types?
+                 "adaptive" = per value, use whichever of the two is smaller
+    memo_size = reuse the serialized form of up to this many repeated immutable values and dict keys (0=off)
+    canonical = write dict keys and set elements in a fixed order, so that equal object trees give identical bytes
+    trusted = skip the checks for circular references and invalid dict keys, for data known to be free of them
+    max_bytes = raise OutputTooLargeError as soon as the output exceeds this many bytes (default=None, no limit)
+    compress = "zlib" or "lzma" to compress the output (default=None, don't). loads() recognises compressed data.
+    zdict = preset dictionary for zlib compression, see make_zdict(). Decompression needs the same one.
+    """
+    return Serializer(indent, module_in_classname, bytes_repr, memo_size=memo_size,
+                      canonical=canonical, trusted=trusted, max_bytes=max_bytes, compress=compress,
+                      zdict=zdict).iter_serialize(obj, chunk_size)
+
+
+def dump(obj, file, indent=False, module_in_classname=False, bytes_repr=False, chunk_size=65536, memo_size=0,
+         canonical=False, trusted=False, max_bytes=None, compress=None, zdict=None):
     """
     Serialize object tree to a file.
+    The data is written in chunks of chunk_size bytes while the object tree is being serialized.
     indent = indent the output over multiple lines (default=false)
     module_in_classname = include module prefix for class names or only use the class name itself
     bytes_repr = should the bytes literal value representation be used instead of base-64 encoding for bytes types?
+                 "adaptive" = per value, use whichever of the two is smaller
+    memo_size = reuse the serialized form of up to this many repeated immutable values and dict keys (0=off)
+    canonical = write dict keys and set elements in a fixed order, so that equal object trees give identical bytes
+    trusted = skip the checks for circular references and invalid dict keys, for data known to be free of them
+    max_bytes = raise OutputTooLargeError as soon as the output exceeds this many bytes (default=None, no limit)
+    compress = "zlib" or "lzma" to compress the output (default=None, don't). loads() recognises compressed data.
+    zdict = preset dictionary for zlib compression, see make_zdict(). Decompression needs the same one.
     """
-    file.write(dumps(obj, indent=indent, module_in_classname=module_in_classname, bytes_repr=bytes_repr))
+    for chunk in iter_dumps(obj, indent, module_in_classname, bytes_repr, chunk_size, memo_size, canonical, trusted,
+                            max_bytes, compress, zdict):
+        file.write(chunk)
 
 
-def loads(serialized_bytes):
-    """Deserialize bytes back to object tree. Uses ast.literal_eval (safe)."""
-    serialized = codecs.decode(serialized_bytes, "utf-8")
-    if '\x00' in serialized:
+def dump_into(obj, target, indent=False, module_in_classname=False, bytes_repr=False, chunk_size=65536, memo_size=0,
+              canonical=False, trusted=False, max_bytes=None, compress=None, zdict=None):
+    """
+    Serialize object tree straight into a bytearray (appending to it) or any object with a write method.
+    The output is encoded and written in pieces of about chunk_size bytes while the object tree is being
+    serialized. Returns the number of bytes written. See Serializer.serialize_into for details.
+    The other parameters are the same as for dump().
+    """
+    return Serializer(indent, module_in_classname, bytes_repr, memo_size=memo_size, canonical=canonical,
+                      trusted=trusted, max_bytes=max_bytes, compress=compress,
+                      zdict=zdict).serialize_into(obj, target, chunk_size)
+
+
+def loads(serialized_bytes, engine="literal_eval", workers=None, zdict=None, max_decompressed_size=64 * 1024 * 1024):
+    """
+    Deserialize bytes back to object tree. Only literals are accepted (safe).
+    The data can be given as any bytes-like object, such as bytes, bytearray, memoryview or mmap.
+    engine = "literal_eval" (default) to use ast.literal_eval, or "native" to use serpent's own decoder,
+    which is faster and gives identical results (it leaves input it can't handle to ast.literal_eval).
+    The native decoder works on the data as it is, without decoding and copying it as a whole first.
+    workers = decode a large top-level list, tuple, set or dict in parallel with this many processes
+              (default=None, don't). The result is the same. Smaller data or other values are decoded directly.
+    zdict = the preset dictionary that compressed data was compressed with, if any.
+    Compressed data is recognised by its prefix, and decompressed first.
+    max_decompressed_size = the maximum size of the decompressed data, larger data raises ValueError (None=no limit).
+                            A small compressed input could otherwise decompress to an enormous size.
+    """
+    if engine not in _decoder_engines:
+        raise ValueError("invalid decoder engine: " + repr(engine))
+    if serialized_bytes[:len(_compressed_magic)] == _compressed_magic:
+        serialized_bytes = _decompress(serialized_bytes, zdict, max_decompressed_size)
+    try:
+        gc.disable()
+        if workers and workers > 1 and len(serialized_bytes) >= _parallel_loads_threshold:
+            result = _loads_parallel(serialized_bytes, engine, workers)
+            if result is not _no_value:
+                return result
+        if engine == "native":
+            try:
+                return _decode_native(serialized_bytes)
+            except _native_fallback_errors:
+                pass
+        serialized = codecs.decode(serialized_bytes, "utf-8")
+        if '\x00' in serialized:
+            raise ValueError(
+                "The serpent data contains 0-bytes so it cannot be parsed by ast.literal_eval. Has it been corrupted?")
+        return ast.literal_eval(serialized)
+    finally:
+        gc.enable()
+
+
+def load(file, engine="literal_eval", zdict=None, max_decompressed_size=64 * 1024 * 1024):
+    """
+    Deserialize bytes from a file back to object tree. Only literals are accepted (safe).
+    Regular files that are opened in binary mode are memory mapped rather than read into memory.
+    zdict, max_decompressed_size = as for loads(), for compressed data.
+    """
+    try:
+        fileno = file.fileno()
+        position = file.tell()
+        status = os.fstat(fileno)
+        mappable = "b" in file.mode and stat.S_ISREG(status.st_mode) and status.st_size > position
+    except (AttributeError, OSError, ValueError):
+        mappable = False
+    if not mappable:
+        return loads(file.read(), engine, zdict=zdict, max_decompressed_size=max_decompressed_size)
+    with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mapped:
+        file.seek(0, os.SEEK_END)     # like file.read() would
+        with memoryview(mapped) as view, view[position:] as data:
+            return loads(data, engine, zdict=zdict, max_decompressed_size=max_decompressed_size)
+
+
+def extract(serialized_bytes, path, engine="literal_eval", zdict=None, max_decompressed_size=64 * 1024 * 1024):
+    """
+    Deserialize just the value at path in the serialized data, such as a single field of a large message.
+    path = a sequence of dict keys and list or tuple indexes: ("header", "route") gets obj["header"]["route"].
+    The data is scanned up to the value without decoding anything else than the keys on the way, so the
+    rest of it isn't validated. Dicts are scanned to their end: like loads(), the last duplicate
+    key wins. Raises KeyError, IndexError or TypeError like the indexing itself would.
+    engine, zdict, max_decompressed_size = as for loads(). Only literals are accepted (safe).
+    """
+    if engine not in _decoder_engines:
+        raise ValueError("invalid decoder engine: " + repr(engine))
+    if isinstance(path, (str, bytes)):
+        raise TypeError("path must be a sequence of keys and indexes")
+    if serialized_bytes[:len(_compressed_magic)] == _compressed_magic:
+        serialized_bytes = _decompress(serialized_bytes, zdict, max_decompressed_size)
+    start, end = 0, len(serialized_bytes)
+    for key in path:
+        start, end = _extract_item(serialized_bytes, start, key, engine)
+    text = codecs.decode(serialized_bytes[start:end], "utf-8")
+    if '\x00' in text:
         raise ValueError(
             "The serpent data contains 0-bytes so it cannot be parsed by ast.literal_eval. Has it been corrupted?")
+    value = _literal_eval("[" + text + "\n]", engine)
+    if len(value) != 1:
+        raise ValueError("invalid syntax in serialized data: expected a single value")
+    return value[0]
+
+
+# Text up to the next structural character, skipping over strings and comments. A quote that doesn't start
+# a valid string is captured instead, and the end of the data is captured as an empty group.
+_extract_token = r"""[^'"#%(chars)s]*(?:(?:
+    '''[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*'''|\"\"\"[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*\"\"\"
+  | '[^'\\\n]*(?:\\.[^'\\\n]*)*'|"[^"\\\n]*(?:\\.[^"\\\n]*)*"
+  | \#[^\r\n]*)[^'"#%(chars)s]*)*
+  ([%(chars)s'"]|\Z)"""
+_extract_openers = {b"[": b"]", b"(": b")", b"{": b"}"}
+
+
+@functools.lru_cache(maxsize=None)
+def _extract_regexes():
+    """The regular expressions of extract(): tokens, tokens inside elements, and blank text. Compiled on first use."""
+    return (re.compile((_extract_token % {"chars": r"()\[\]{},:"}).encode(), re.X | re.S),
+            re.compile((_extract_token % {"chars": r"()\[\]{}"}).encode(), re.X | re.S),
+            re.compile(br"(?:\s|\#[^\r\n]*)*"))
+
+
+def _extract_item(data, start, key, engine):
+    """Find the item at the key or index in the container that is serialized at start, returns its (start, end)."""
+    token_re, _, blank_re = _extract_regexes()
+    match = token_re.match(data, start)
+    opener = match.group(1)
+    if opener not in _extract_openers or blank_re.match(data, start).end() != match.start(1):
+        raise TypeError("the value at this path is not a list, tuple or dict")
+    elements = _extract_elements(data, match.end(), _extract_openers[opener])
+    if opener == b"{":
+        found = None
+        for element_start, colon, element_end, _ in elements:
+            if colon is None:
+                raise TypeError("the value at this path is a set, it can't be indexed")
+            if _literal_eval("[" + codecs.decode(data[element_start:colon], "utf-8") + "\n]", engine) == [key]:
+                found = colon + 1, element_end      # keep looking: like loads, the last duplicate key wins
+        if found is None:
+            raise KeyError(key)
+        return found
+    kind = "list" if opener == b"[" else "tuple"
+    if not isinstance(key, int):
+        raise TypeError("%s indices must be integers, not %s" % (kind, type(key).__name__))
+    if key < 0:
+        elements = list(elements)
+        if len(elements) == 1 and elements[0][3] and kind == "tuple":
+            raise TypeError("the value at this path is not a list, tuple or dict")
+        if -key <= len(elements):
+            element_start, colon, element_end, _ = elements[key]
+            return element_start, element_end
+    else:
+        for index, (element_start, colon, element_end, last) in enumerate(elements):
+            if index == 0 and last and kind == "tuple":
+                raise TypeError("the value at this path is not a list, tuple or dict")   # just parentheses
+            if index == key:
+                return element_start, element_end
+    raise IndexError("%s index out of range" % kind)
+
+
+def _extract_elements(data, pos, closer):
+    """
+    Generator of the (start, colon, end, last) spans of the elements of the container whose text begins at pos
+    (just after its opening bracket). colon is the position of the key-value separator, or None.
+    last is whether the element was closed by the closing bracket rather than a comma.
+    """
+    token_re, bracket_re, blank_re = _extract_regexes()
+    start = pos
+    colon = None
+    depth = 0
+    while True:
+        match = (bracket_re if depth else token_re).match(data, pos)
+        char = match.group(1)
+        pos = match.end()
+        if char == b"[" or char == b"(" or char == b"{":
+            depth += 1
+        elif char == b"]" or char == b")" or char == b"}":
+            if depth:
+                depth -= 1
+                continue
+            if char != closer:
+                raise ValueError("mismatched closing bracket in serialized data")
+            if blank_re.match(data, start).end() < match.start(1):
+                yield start, colon, match.start(1), True
+            return
+        elif char == b"'" or char == b'"':
+            raise ValueError("unterminated string in serialized data")
+        elif not char:
+            raise ValueError("unexpected end of serialized data")
+        elif char == b",":     # (only brackets are matched at depth > 0)
+            if blank_re.match(data, start).end() == match.start(1):
+                raise ValueError("invalid syntax in serialized data: empty element")
+            yield start, colon, match.start(1), False
+            start = pos
+            colon = None
+        elif char == b":":
+            if colon is not None:
+                raise ValueError("invalid syntax in serialized data: unexpected ':'")
+            colon = match.start(1)
+
+
+def iterload(file, chunk_size=65536, engine="literal_eval", zdict=None, max_decompressed_size=64 * 1024 * 1024):
+    """
+    Deserialize the elements of a top-level list, tuple or set from a file, one by one (a generator).
+    For a top-level dict it produces its (key, value) pairs instead.
+    The file is read in chunks of chunk_size and elements are produced as soon as they're complete,
+    so the whole data never has to be in memory. Only literals are accepted (safe).
+    Compressed data is decompressed while it's being read. zdict = the preset dictionary it was compressed with.
+    max_decompressed_size = as for loads(), it limits the total size of the decompressed data.
+    """
+    decoder = IncrementalDecoder(engine=engine, zdict=zdict, max_decompressed_size=max_decompressed_size)
+    while True:
+        data = file.read(chunk_size)
+        if not data:
+            break
+        yield from decoder.feed(data)
+    yield from decoder.close()
+
+
+class IncrementalDecoder(object):
+    """
+    Push-based decoder, for data that arrives in arbitrary pieces (in a protocol's data_received, for instance).
+    Feed it the pieces with feed(), it returns the objects that were completed by each piece, and call close()
+    at the end of the data. Incomplete input is kept and scanned just once, not retried on every feed.
+    documents = False (default): the data is a single top-level list, tuple, set or dict, and its elements
+                are returned one by one (for a dict: its (key, value) pairs), like iterload() does.
+                True: the data is a sequence of serialized documents, written one after another, and those are
+                returned. A document that isn't a container is only complete when the next one starts, or at close().
+    engine, zdict = as for loads(). Compressed data is decompressed as it's fed. Only literals are accepted (safe).
+    max_decompressed_size = as for loads(), it limits the total size of the decompressed data.
+    """
+
+    def __init__(self, documents=False, engine="literal_eval", zdict=None, max_decompressed_size=64 * 1024 * 1024):
+        if engine not in _decoder_engines:
+            raise ValueError("invalid decoder engine: " + repr(engine))
+        self.engine = engine
+        self.zdict = zdict
+        self.max_decompressed_size = max_decompressed_size
+        self._scanner = _TopLevelScanner(documents)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._head = b""            # the start of the data, until it's known if it's compressed or not
+        self._decompressor = None
+        self._decompressed_size = 0
+        self._closed = False
+
+    def feed(self, data):
+        """Decode the next piece of data (bytes-like, or str). Returns the list of objects that it completed."""
+        return self._decode(data, False)
+
+    def close(self):
+        """End of the data. Returns the list of objects that were still pending, raises ValueError if it's incomplete."""
+        return self._decode(b"", True)
+
+    def _decode(self, data, final):
+        if self._closed:
+            raise ValueError("the decoder has been closed")
+        self._closed = final
+        if isinstance(data, str):
+            text = data
+        else:
+            text = self._utf8.decode(self._decompress(data, final), final)
+        if '\x00' in text:
+            raise ValueError(
+                "The serpent data contains 0-bytes so it cannot be parsed by ast.literal_eval. Has it been corrupted?")
+        scanner = self._scanner
+        texts = scanner.feed(text, final)
+        if not texts:
+            return []
+        if scanner.documents:
+            return [_literal_eval(text, self.engine) for text in texts]
+        # evaluate all elements that we have in one go, that's a lot faster than one by one
+        if scanner.kind == "dict":
+            return list(_literal_eval("{" + ",".join(texts) + "\n}", self.engine).items())
+        if scanner.kind == "set":
+            return list(_literal_eval("{" + ",".join(texts) + "\n}", self.engine))
+        return _literal_eval("[" + ",".join(texts) + "\n]", self.engine)
+
+    def _decompress(self, data, final):
+        if self._head is not None:
+            data = self._head + data
+            prefix = len(_compressed_magic) + 7     # the magic, the method byte, and the start of the zlib header
+            if not final and len(data) < prefix and _compressed_magic.startswith(data[:len(_compressed_magic)]):
+                self._head = data
+                return b""
+            self._head = None
+            if data.startswith(_compressed_magic):
+                start = len(_compressed_magic)
+                self._decompressor = _new_decompressor(data[start:start + 1], data[start + 1:start + 7], self.zdict)
+                data = data[start + 1:]
+        decompressor = self._decompressor
+        if decompressor is None:
+            return data
+        data = _decompress_limited(decompressor, data, self.max_decompressed_size, self._decompressed_size) if data else b""
+        self._decompressed_size += len(data)
+        if final and (not decompressor.eof or decompressor.unused_data):
+            raise ValueError("invalid compressed serpent data: truncated, or followed by other data")
+        return data
+
+
+_decoder_engines = ("literal_eval", "native")
+
+
+_parallel_loads_threshold = 1 << 20     # minimum size of the data for loads() to use worker processes
+
+# A structural character of the serialized data, preceded by any other text. Strings and comments are skipped,
+# but comments leave a '#' in the group. A quote that doesn't start a valid string, and a backslash outside
+# of a string (a line continuation, which doesn't survive the splitting), are left in it as well.
+_structure_token = r"""[^'"#()\[\]{},\\]*(?:
+    '''[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*'''|\"\"\"[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*\"\"\"
+  | '[^'\\\n]*(?:\\.[^'\\\n]*)*'|"[^"\\\n]*(?:\\.[^"\\\n]*)*"
+  | ([#()\[\]{},'"\\])(?:(?<=\#)[^\r\n]*)?)"""
+_structure_depth = {"": 0, "#": 0, ",": 0, "(": 1, "[": 1, "{": 1, ")": -1, "]": -1, "}": -1}
+
+
+@functools.lru_cache(maxsize=None)
+def _structure_regexes():
+    """The regular expressions for one structure token and for a run of 1000 of them, compiled on first use."""
+    return re.compile(_structure_token, re.X | re.S), re.compile("(?:%s){1000}" % _structure_token, re.X | re.S)
+
+
+def _loads_parallel(serialized_bytes, engine, workers):
+    """
+    Decode a top-level container in parallel: split its text into chunks of elements at the commas between
+    them, and decode those in worker processes. Returns _no_value when the data can't be decoded this way;
+    loads() decodes it directly then, so that the result is always the same (or the same error is raised).
+    """
+    try:
+        text = codecs.decode(serialized_bytes, "utf-8")
+    except ValueError:
+        return _no_value
+    structure_re, structure_steps_re = _structure_regexes()
+    tokens = structure_re.findall(text)
+    if "'" in tokens or '"' in tokens or "\\" in tokens or '\x00' in text:
+        return _no_value
+    depths = list(itertools.accumulate(map(_structure_depth.__getitem__, tokens)))
+    first = last = None
+    for first, token in enumerate(tokens):
+        if token != "" and token != "#":
+            break
+    for last in range(len(tokens) - 1, -1, -1):
+        if tokens[last] != "" and tokens[last] != "#":
+            break
+    if first is None or tokens[first] not in _TopLevelScanner._closing_brackets:
+        return _no_value
+    opener = tokens[first]
+    closer = _TopLevelScanner._closing_brackets[opener]
+    try:
+        if tokens[last] != closer or depths.index(0, first) != last:
+            return _no_value
+    except ValueError:
+        return _no_value
+    # split at the commas between the elements of the container, near equally spaced tokens
+    splits = []
+    chunk_count = workers * 4
+    index = first
+    for chunk in range(1, chunk_count):
+        index = max(index + 1, first + (last - first) * chunk // chunk_count)
+        while index < last and (tokens[index] != "," or depths[index] != 1):
+            index += 1
+        if index >= last:
+            break
+        splits.append(index)
+    if not splits:
+        return _no_value
+    positions = []
+    pos = count = 0
+    for index in [first] + splits + [last]:
+        while index - count >= 1000:
+            pos = structure_steps_re.match(text, pos).end()
+            count += 1000
+        for _ in range(index - count):
+            pos = structure_re.match(text, pos).end()
+        match = structure_re.match(text, pos)
+        if first < index < last and not text[pos:match.start(1)].strip() and tokens[index - 1] not in ("", ")", "]", "}"):
+            return _no_value    # an empty element (or a comment) before the comma, leave it to the parser
+        pos = match.end()
+        count = index + 1
+        positions.append(match.start(1))
+    del tokens, depths
+    try:
+        # what's around the container must be valid on its own, and the container type is checked as well
+        if type(_literal_eval(text[:positions[0]] + opener + closer + text[positions[-1] + 1:], engine)) \
+                is not {"[": list, "(": tuple, "{": dict}[opener]:
+            return _no_value
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return _no_value
+    root = opener
+    if root == "(":
+        opener, closer = "[", "]"
+    texts = [opener + text[start + 1:end] + "\n" + closer for start, end in zip(positions, positions[1:])]
+    del text
+    import concurrent.futures
+    try:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:   # with the default start method
+            chunks = list(pool.map(_parallel_literal_eval, texts, itertools.repeat(engine)))
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return _no_value
+    if len(set(type(chunk) for chunk in chunks if chunk)) != 1 or not all(chunks[:-1]):
+        return _no_value    # a mix of dict and set elements, or an empty element
+    if type(chunks[0]) is list:
+        result = list(itertools.chain.from_iterable(chunks))
+        return tuple(result) if root == "(" else result
+    result = type(chunks[0])()
+    for chunk in chunks:
+        result.update(chunk)
+    return result
+
+
+def _parallel_literal_eval(text, engine):
     try:
         gc.disable()
-        return ast.literal_eval(serialized)
+        return _literal_eval(text, engine)
     finally:
         gc.enable()
 
 
-def load(file):
-    """Deserialize bytes from a file back to object tree. Uses ast.literal_eval (safe)."""
-    data = file.read()
-    return loads(data)
+def _literal_eval(text, engine):
+    if engine == "native":
+        try:
+            return _decode_native(text)
+        except _native_fallback_errors:
+            pass
+    return ast.literal_eval(text)
+
+
+@functools.lru_cache(maxsize=None)
+def _scanner_regexes():
+    """The regular expressions of _TopLevelScanner: significant characters, and the body of a string per kind of quotes."""
+    return re.compile(r"""['"#()\[\]{},:]"""), {
+        "'''": re.compile(r"[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*", re.S),
+        '"""': re.compile(r'[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*', re.S),
+        "'": re.compile(r"[^'\\\n]*(?:\\.[^'\\\n]*)*", re.S),
+        '"': re.compile(r'[^"\\\n]*(?:\\.[^"\\\n]*)*', re.S),
+    }
+
+
+class _TopLevelScanner(object):
+    """
+    Incremental scanner that splits serialized data into the elements of its top-level container
+    (list, tuple, set or dict), or into whole documents, without parsing them. It knows just enough about
+    the syntax to skip over strings and comments and to keep track of the nesting of brackets.
+    Feed it the text in pieces, it returns the text of the elements that were completed by each piece.
+    A string or comment that continues in the next piece is resumed there, rather than scanned again.
+    """
+    _closing_brackets = {"[": "]", "(": ")", "{": "}"}
+
+    def __init__(self, documents=False):
+        self._significant_re, self._string_body_res = _scanner_regexes()
+        self.documents = documents  # split into documents (one after another) instead of container elements?
+        self.kind = None        # None, "list", "tuple", "set", "dict", or "(" and "{" when it's not known yet
+        self.root = None        # opening bracket of the top-level container
+        self.depth = 0
+        self.closed = False     # has the top-level container been closed?
+        self.pieces = []        # text of the current element that has been scanned already
+        self.content = False    # does the current element have content (other than whitespace and comments)?
+        self.colon = False      # does the current element contain a key-value separator?
+        self.quote = None       # the quotes of the string that the scanned text ends in, if any
+        self.comment = False    # does the scanned text end in a comment?
+        self.tail = ""          # text that couldn't be scanned yet because it's incomplete
+
+    def feed(self, text, final=False):
+        """Scan the next piece of text. Returns the list of elements (as text) that have been completed by it."""
+        text = self.tail + text
+        length = len(text)
+        elements = []
+        segment = pos = 0       # segment is where the text of the current element starts
+        while True:
+            if self.quote:
+                pos = self._skip_string(text, pos, final)
+                if self.quote:
+                    break
+            elif self.comment:
+                pos = text.find("\n", pos)
+                if pos < 0:
+                    pos = length
+                    if not final:
+                        break
+                self.comment = False
+            match = self._significant_re.search(text, pos)
+            end = match.start() if match else length
+            if end > pos and not self.content and not text[pos:end].isspace():
+                self._found_content()
+            if match is None:
+                pos = length
+                break
+            char = match.group()
+            pos = end
+            if char == "'" or char == '"':
+                if length - pos < 3 and not final and text[pos:] in (char, char * 2):
+                    break       # can't tell yet if it's an empty string or triple quotes
+                self._found_content()
+                self.quote = char * 3 if text.startswith(char * 3, pos) else char
+                pos += len(self.quote)
+            elif char == "#":
+                if self.documents and self.depth == 0 and self.content:
+                    # a document that isn't a container ends where the next one (its header comment) starts
+                    self._document_done(text[segment:pos], elements)
+                    segment = pos
+                self.comment = True
+                pos += 1
+            elif char in "([{":
+                if self.depth == 0:
+                    if self.documents:
+                        if not self.content:
+                            self.root = char
+                        self.content = True
+                    else:
+                        if self.closed:
+                            raise ValueError("invalid data after the end of the top-level container")
+                        self.root = char
+                        self.kind = "list" if char == "[" else char
+                        segment = pos + 1
+                else:
+                    self.content = True
+                self.depth += 1
+                pos += 1
+            elif char in ")]}":
+                self.depth -= 1
+                if self.depth < 0:
+                    raise ValueError("mismatched closing bracket in serialized data")
+                if self.depth == 0 and self.root:
+                    if char != self._closing_brackets[self.root]:
+                        raise ValueError("mismatched closing bracket in serialized data")
+                    if self.documents:
+                        self._document_done(text[segment:pos + 1], elements)
+                        segment = pos + 1
+                    else:
+                        self._element_done(text[segment:pos], True, elements)
+                        self.closed = True
+                pos += 1
+            else:
+                if self.depth == 0:
+                    self._found_content()
+                elif self.depth == 1 and not self.documents:
+                    if char == ",":
+                        self._element_done(text[segment:pos], False, elements)
+                        segment = pos + 1
+                    else:
+                        self.colon = True
+                pos += 1
+        if final and self.documents and self.depth == 0:
+            if self.content:
+                self._document_done(text[segment:pos], elements)
+            self.pieces = []
+        elif pos > segment and (self.depth > 0 or self.documents):
+            self.pieces.append(text[segment:pos])
+        self.tail = text[pos:]
+        if final and (self.depth > 0 if self.documents else not self.closed):
+            raise ValueError("unexpected end of serialized data")
+        return elements
+
+    def _skip_string(self, text, pos, final):
+        """
+        Skip over (the rest of) the string that the scanned text ends in, and return the position after it.
+        If the string continues in the next piece of text, it returns the position to resume scanning it from:
+        quotes and backslashes at the end of the text may still turn out to be closing quotes or escapes.
+        """
+        quote = self.quote
+        end = self._string_body_res[quote].match(text, pos).end()
+        if text.startswith(quote, end):
+            self.quote = None
+            return end + len(quote)
+        if final or text.startswith("\n", end):
+            raise ValueError("unterminated string in serialized data")
+        while end > pos and text[end - 1] in ("\\", quote[0]):
+            end -= 1
+        return end
+
+    def _found_content(self):
+        if self.depth == 0 and not self.documents:
+            raise ValueError("the serialized data must be a list, tuple, set or dict")
+        self.content = True
+
+    def _document_done(self, text, elements):
+        if self.pieces:
+            self.pieces.append(text)
+            text = "".join(self.pieces)
+            self.pieces = []
+        elements.append(text.strip())
+        self.content = False
+        self.root = None
+
+    def _element_done(self, text, closing, elements):
+        if self.pieces:
+            self.pieces.append(text)
+            text = "".join(self.pieces)
+            self.pieces = []
+        if self.content:
+            if self.kind == "{":
+                self.kind = "dict" if self.colon else "set"
+            elif self.kind == "(":
+                if closing:
+                    raise ValueError("the serialized data must be a list, tuple, set or dict")
+                self.kind = "tuple"
+            elif self.colon != (self.kind == "dict"):
+                raise ValueError("invalid element in serialized " + self.kind)
+            elements.append(text)
+        elif not closing:
+            raise ValueError("invalid syntax in serialized data: empty element")
+        elif self.kind == "(":
+            self.kind = "tuple"
+        self.content = self.colon = False
+
+
+class _Unsupported(Exception):
+    """Raised by the native decoder for input that it leaves to ast.literal_eval."""
+    pass
+
+
+# One token of the literal syntax, preceded by whitespace and comments. Every position matches something:
+# text that isn't part of a literal (including form feeds and 0-bytes) becomes a single character token,
+# and the end of the text an empty token.
+_native_token = r"""
+    [ \t\r\n]*(?:\#[^\r\n\x00]*[ \t\r\n]*)*
+    (
+        0[xX](?:_?[0-9a-fA-F])+|0[oO](?:_?[0-7])+|0[bB](?:_?[01])+
+      | (?:[0-9]+(?:_[0-9]+)*(?:\.(?:[0-9]+(?:_[0-9]+)*)?)?|\.[0-9]+(?:_[0-9]+)*)(?:[eE][-+]?[0-9]+(?:_[0-9]+)*)?[jJ]?
+      | (?:[bB][rR]?|[rR][bB]?|[uU])?
+        (?:'''[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*'''|\"\"\"[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*\"\"\"
+          |'(?!'')[^'\\\n]*(?:\\.[^'\\\n]*)*'|"(?!"")[^"\\\n]*(?:\\.[^"\\\n]*)*")
+      | True|False|None|set
+      | .
+      | \Z
+    )"""
+# In bytes, comments only match valid utf-8: they aren't decoded like the tokens are, but must be validated too.
+# An invalid byte ends the comment, and then becomes a token of its own (that doesn't decode).
+_native_utf8_comment = r"""\#(?:[\x01-\x09\x0b\x0c\x0e-\x7f]+|[\xc2-\xdf][\x80-\xbf]|\xe0[\xa0-\xbf][\x80-\xbf]
+    |[\xe1-\xec\xee\xef][\x80-\xbf]{2}|\xed[\x80-\x9f][\x80-\xbf]|\xf0[\x90-\xbf][\x80-\xbf]{2}
+    |[\xf1-\xf3][\x80-\xbf]{3}|\xf4[\x80-\x8f][\x80-\xbf]{2})*"""
+# escape sequences that Python warns about, or that a codec can't decode in the same way
+_native_str_escape = r"""\\(?![\n\\'"abfnrtv0-7xNuU])|\\[4-7][0-7][0-7]"""
+_native_bytes_escape = r"""\\(?![\n\\'"abfnrtv0-7x])|\\[4-7][0-7][0-7]"""
+_native_names = {"True": True, "False": False, "None": None}
+
+
+@functools.lru_cache(maxsize=None)
+def _native_regexes():
+    """The token regular expressions of the native decoder, for text and for bytes. Compiled on first use."""
+    bytes_token = _native_token.replace(r"\#[^\r\n\x00]*", _native_utf8_comment).encode("ascii")
+    return re.compile(_native_token, re.X | re.S), re.compile(bytes_token, re.X | re.S)
+
+
+def _native_number(token):
+    if token.isdigit():
+        if token[0] == "0" and token.strip("0"):
+            raise _Unsupported      # leading zeros aren't allowed
+        return int(token)
+    if token[-1] in "jJ":
+        return complex(0.0, float(token[:-1]))
+    if token[:2] in ("0x", "0X", "0o", "0O", "0b", "0B"):
+        return int(token, 0)
+    if "." in token or "e" in token or "E" in token:
+        return float(token)
+    return int(token, 0)
+
+
+def _native_string(token):
+    quote = token[-1]
+    start = token.index(quote)
+    size = 3 if len(token) - start >= 6 and token[start + 1] == quote == token[start + 2] else 1
+    body = token[start + size:-size]
+    if "\r" in body or "\x00" in body:
+        raise _Unsupported      # newlines in the source get normalized, 0-bytes are invalid
+    if start == 0 or token[0] in "uU":
+        if "\\" not in body:
+            return body
+        if re.search(_native_str_escape, body):
+            raise _Unsupported
+        return body.encode("latin-1", "backslashreplace").decode("unicode_escape")
+    prefix = token[:start].lower()
+    if "b" in prefix:
+        if not body.isascii():
+            raise _Unsupported
+        if "r" in prefix or "\\" not in body:
+            return body.encode("ascii")
+        if re.search(_native_bytes_escape, body):
+            raise _Unsupported
+        return codecs.escape_decode(body)[0]
+    return body     # raw string
+
+
+def _decode_native(data):
+    """
+    Decode serialized data into the object tree without going through the Python parser, with the
+    same result as ast.literal_eval. Like it, it only accepts literals. Input that it can't decode
+    in exactly the same way (which includes all invalid input) raises one of _native_fallback_errors,
+    and is then left to ast.literal_eval instead.
+    The data is either text, or any bytes-like object (such as a memoryview or mmap). That is tokenized
+    as it is, without decoding or copying it as a whole; only the tokens are decoded, which validates the utf-8.
+    """
+    is_text = isinstance(data, str)
+    if is_text:
+        token_re = _native_regexes()[0]
+        tokens = token_re.findall(data)
+        next_token = iter(tokens).__next__
+    else:
+        if not isinstance(data, (bytes, bytearray)):
+            data = memoryview(data).cast("B")
+        token_re = _native_regexes()[1]
+        tokens = token_re.findall(data)
+        next_token = map(bytes.decode, tokens).__next__
+
+    def text(start, end=None):
+        return data[start:end] if is_text else str(data[start:end], "utf-8")
+
+    def value(token):
+        # decodes the value that starts with the given token, returns it together with the token after it
+        first = token[:1]
+        if "0" <= first <= "9" or first == "." and len(token) > 1:
+            return operation(_native_number(token), next_token())
+        if len(token) > 1 and first in "'\"bBrRuU":
+            obj = _native_string(token)
+            token = next_token()
+            if len(token) > 1 and token[:1] in "'\"bBrRuU":
+                # implicit concatenation of adjacent string literals
+                parts = [obj]
+                while len(token) > 1 and token[:1] in "'\"bBrRuU":
+                    parts.append(_native_string(token))
+                    token = next_token()
+                if len(set(map(type, parts))) > 1:
+                    raise _Unsupported
+                obj = obj[:0].join(parts)
+            return obj, token
+        if token == "[":
+            return sequence([], "]", next_token())
+        if token == "{":
+            token = next_token()
+            if token == "}":
+                return {}, next_token()
+            key, token = value(token)
+            if token != ":":
+                if token == ",":
+                    token = next_token()
+                elif token != "}":
+                    raise _Unsupported
+                items, token = sequence([key], "}", token)
+                return set(items), token
+            result = {}
+            while True:
+                result[key], token = value(next_token())
+                if token == ",":
+                    token = next_token()
+                    if token == "}":
+                        break
+                    key, token = value(token)
+                    if token != ":":
+                        raise _Unsupported
+                elif token == "}":
+                    break
+                else:
+                    raise _Unsupported
+            return result, next_token()
+        if token == "(":
+            token = next_token()
+            if token == ")":
+                return (), next_token()
+            obj, token = value(token)
+            if token == ")":
+                # just parentheses around a value
+                token = next_token()
+                if token == "+" or token == "-":
+                    raise _Unsupported
+                return obj, token
+            if token != ",":
+                raise _Unsupported
+            items, token = sequence([obj], ")", next_token())
+            return tuple(items), token
+        if token in _native_names:
+            return _native_names[token], next_token()
+        if token == "-" or token == "+":
+            number = next_token()
+            if not ("0" <= number[:1] <= "9" or number[:1] == "." and len(number) > 1):
+                raise _Unsupported
+            number = _native_number(number)
+            return operation(-number if token == "-" else +number, next_token())
+        if token == "set":
+            if next_token() != "(" or next_token() != ")":
+                raise _Unsupported
+            return set(), next_token()
+        raise _Unsupported
+
+    def operation(number, token):
+        # a real number, optionally followed by + or - and an imaginary number (that's how complex numbers are written)
+        if token != "+" and token != "-":
+            return number, token
+        imaginary = next_token()
+        if type(number) is complex or not ("0" <= imaginary[:1] <= "9" or imaginary[:1] == ".") or imaginary[-1] not in "jJ":
+            raise _Unsupported
+        imaginary = _native_number(imaginary)
+        number = number + imaginary if token == "+" else number - imaginary
+        token = next_token()
+        if token == "+" or token == "-":
+            raise _Unsupported
+        return number, token
+
+    def sequence(items, closer, token):
+        # decodes the remaining items of a list, tuple or set up until the closing bracket
+        append = items.append
+        while token != closer:
+            obj, token = value(token)
+            append(obj)
+            if token == ",":
+                token = next_token()
+            elif token != closer:
+                raise _Unsupported
+        return items, next_token()
+
+    # the Python tokenizer has indentation rules for the first and last line, and a
+    # value can only be spread over multiple lines when it's enclosed in brackets
+    token = next_token()
+    start = len(token_re.match(data).group()) - len(tokens[0])
+    leading = text(0, start).lstrip(" \t")
+    if leading[max(leading.rfind("\n"), leading.rfind("\r")) + 1:]:
+        raise _Unsupported
+    if data[-1:] in (" ", "\t", b" ", b"\t"):
+        stripped = text(0).rstrip(" \t")
+        if not stripped or stripped[-1] in "\r\n":
+            raise _Unsupported
+    if token not in ("[", "(", "{"):
+        core = text(start).rstrip()
+        if "\n" in core or "\r" in core:
+            raise _Unsupported
+    obj, token = value(token)
+    if token:
+        raise _Unsupported
+    return obj
+
+
+_native_fallback_errors = (_Unsupported, ValueError, TypeError, RecursionError)
 
 
 def _ser_OrderedDict(obj, serializer, outputstream, indentlevel):
@@ -110,20 +998,102 @@ def _ser_DictView(obj, serializer, outputstream, indentlevel):
     serializer.ser_builtins_list(obj, outputstream, indentlevel)
 
 
+def _ser_Enum(obj, serializer, outputstream, indentlevel):
+    serializer._serialize(obj.value, outputstream, indentlevel)
+
+
 _special_classes_registry = collections.OrderedDict()  # must be insert-order preserving to make sure of proper precedence rules
+_registry_lock = threading.Lock()       # serializes changes to the registry
+_registry_snapshot = None               # what serializers use, replaced whenever the registry changes
 
 
-def _reset_special_classes_registry():
-    _special_classes_registry.clear()
-    _special_classes_registry[KeysView] = _ser_DictView
-    _special_classes_registry[ValuesView] = _ser_DictView
-    _special_classes_registry[ItemsView] = _ser_DictView
-    _special_classes_registry[collections.OrderedDict] = _ser_OrderedDict
+class _ClassLayout(object):
+    """
+    How ser_default_class writes the instances of a class, determined once per class: the names of the
+    fields to write (None to write the instance's vars) and the class name, without and with module prefix,
+    also as the ready-made text that ends the dict.
+    """
+    __slots__ = ("fields", "class_names", "closers")
+
+    def __init__(self, fields, class_names):
+        self.fields = fields
+        self.class_names = class_names
+        self.closers = tuple("%r:%r}" % ("__class__", name) for name in class_names)
+
+
+_object_getstate = getattr(object, "__getstate__", None)   # python 3.11+ object itself has __getstate__
+
+
+def _class_layout(t):
+    """
+    Determine the _ClassLayout of class t. Returns None for classes that provide their own __getstate__ or
+    __class__, or that have neither a regular __dict__ nor __slots__: those are handled per instance.
+    This also covers dataclasses, whose fields are either in the vars or (with slots=True) the __slots__.
+    """
+    if getattr(t, "__getstate__", None) is not _object_getstate:
+        return None
+    class_dicts = [vars(clazz) for clazz in t.__mro__[:-1]]
+    if any("__class__" in class_dict for class_dict in class_dicts):
+        return None
+    for class_dict in class_dicts:
+        if "__dict__" in class_dict:
+            if type(class_dict["__dict__"]) is not types.GetSetDescriptorType:
+                return None
+            fields = None
+            break
+    else:
+        if not hasattr(t, "__slots__"):
+            return None
+        fields = tuple(t.__slots__)
+    return _ClassLayout(fields, (t.__name__, "%s.%s" % (t.__module__, t.__name__)))
+
+
+class _RegistrySnapshot(object):
+    """
+    Immutable snapshot of the special classes registry, and the cache of resolved serializer functions that
+    goes with it. Every change to the registry publishes a new snapshot, so serializers can use the current
+    one as it is, without copying the registry. It's thread safe because the snapshot never changes.
+    """
+    __slots__ = ("version", "registry", "handler_cache", "class_layouts", "abc_token")
+
+    def __init__(self, version, registry):
+        self.version = version
+        self.abc_token = abc.get_cache_token()     # changes whenever a class is registered with an ABC
+        self.registry = types.MappingProxyType(collections.OrderedDict(registry))
+        self.handler_cache = {}     # type -> (serializer function, is_special_class), only valid for this registry
+        self.class_layouts = {}     # type -> _ClassLayout or None
 
-    def _ser_Enum(obj, serializer, outputstream, indentlevel):
-        serializer._serialize(obj.value, outputstream, indentlevel)
 
-    _special_classes_registry[enum.Enum] = _ser_Enum
+def _publish_registry():
+    # call this with the _registry_lock held
+    global _registry_snapshot
+    version = _registry_snapshot.version + 1 if _registry_snapshot else 1
+    _registry_snapshot = _RegistrySnapshot(version, _special_classes_registry)
+
+
+def _current_registry():
+    """
+    The current registry snapshot. A class registered with an ABC (abc.register) can make another
+    handler apply to its instances, so in that case a new snapshot is published with an empty handler cache.
+    """
+    snapshot = _registry_snapshot
+    if snapshot.abc_token != abc.get_cache_token():
+        with _registry_lock:
+            if _registry_snapshot.abc_token != abc.get_cache_token():
+                _publish_registry()
+            snapshot = _registry_snapshot
+    return snapshot
+
+
+def _reset_special_classes_registry():
+    with _registry_lock:
+        _special_classes_registry.clear()
+        _special_classes_registry[KeysView] = _ser_DictView
+        _special_classes_registry[ValuesView] = _ser_DictView
+        _special_classes_registry[ItemsView] = _ser_DictView
+        _special_classes_registry[collections.OrderedDict] = _ser_OrderedDict
+        _special_classes_registry[enum.Enum] = _ser_Enum
+        _publish_registry()
 
 
 _reset_special_classes_registry()
@@ -131,8 +1101,10 @@ _reset_special_classes_registry()
 
 def unregister_class(clazz):
     """Unregister the specialcase serializer for the given class."""
-    if clazz in _special_classes_registry:
-        del _special_classes_registry[clazz]
+    with _registry_lock:
+        if clazz in _special_classes_registry:
+            del _special_classes_registry[clazz]
+            _publish_registry()
 
 
 def register_class(clazz, serializer):
@@ -140,8 +1112,11 @@ def register_class(clazz, serializer):
     Register a special serializer function for objects of the given class.
     The function will be called with (object, serpent_serializer, outputstream, indentlevel) arguments.
     The function must write the serialized data to outputstream. It doesn't return a value.
+    It also applies to subclasses, including those registered with an ABC (clazz.register) afterwards.
     """
-    _special_classes_registry[clazz] = serializer
+    with _registry_lock:
+        _special_classes_registry[clazz] = serializer
+        _publish_registry()
 
 
 _repr_types = {str, int, bool, type(None)}
@@ -155,23 +1130,138 @@ _translate_types = {
 
 _bytes_types = (bytes, bytearray, memoryview)
 
+_no_value = object()    # sentinel
+_checkpoint = object()  # sentinel
+
+
+class _Text(str):
+    """Output that has been serialized already (a batch of elements), the iterative engine writes it as it is."""
+    __slots__ = ()
+
+
+_hashable_key_types = {bool, bytes, str, tuple, int, float, complex}   # grows with every other type that passes the check
+
+
+def _canonical_key(obj):
+    """
+    Sort key that puts any mix of dict keys or set elements in one deterministic order:
+    by type first (module and name), then by value. Unlike the values themselves, these keys always compare.
+    """
+    t = type(obj)
+    if t is str or t is int or t is bytes or t is bool:
+        value = obj
+    elif t is float:
+        value = (0, obj) if obj == obj else (1, 0.0)    # NaN goes last
+    elif t is tuple:
+        value = tuple(map(_canonical_key, obj))
+    elif t is complex:
+        value = (_canonical_key(obj.real), _canonical_key(obj.imag))
+    elif obj is None:
+        value = 0
+    elif isinstance(obj, enum.Enum):
+        value = _canonical_key(obj.value)
+    elif isinstance(obj, (numbers.Real, decimal.Decimal)) and obj == obj:
+        value = (0, obj)
+    else:
+        value = (1, repr(obj))
+    return t.__module__, t.__qualname__, value
+
+
+def _canonical_item_key(item):
+    return _canonical_key(item[0])
+
+
+def _first_item(item):
+    return item[0]
+
+
+_natively_ordered_types = ({str}, {int}, {bytes})  # key types whose own ordering is the same as their canonical order
+
+
+_printable_bytes = bytes(range(32, 127))
+
 
 def _translate_byte_type(t, data, bytes_repr):
-    if bytes_repr:
-        if t == bytes:
-            return repr(data)
-        elif t == bytearray:
-            return repr(bytes(data))
-        elif t == memoryview:
-            return repr(bytes(data))
-        else:
-            raise TypeError("invalid bytes type")
+    if not bytes_repr:
+        return _base64_literal(data)
+    if t is memoryview:
+        data = _memoryview_bytes(data)
+        t = type(data)
+    if bytes_repr == "adaptive":
+        size = len(data)
+        base64_size = (size + 2) // 3 * 4 + 34
+        # every byte takes at least one character in the literal, and the ones that aren't printable ascii at least two
+        if size + len(data.translate(None, _printable_bytes)) + 3 < base64_size:
+            literal = _bytes_literal(t, data)
+            if len(literal) <= base64_size:
+                return literal
+        return _base64_literal(data)
+    return _bytes_literal(t, data)
+
+
+def _bytes_literal(t, data):
+    if t is bytes:
+        return repr(data)
+    elif t is bytearray:
+        return repr(data)[10:-1]    # strip the bytearray( ) around the bytes literal
     else:
-        b64 = base64.b64encode(data)
-        return repr({
-            "data": b64 if type(b64) is str else b64.decode("ascii"),
-            "encoding": "base64"
-        })
+        raise TypeError("invalid bytes type")
+
+
+def _base64_literal(data):
+    # same as the repr() of the dict {"data": base64 text, "encoding": "base64"}
+    return "{'data': '" + binascii.b2a_base64(data, newline=False).decode("ascii") + "', 'encoding': 'base64'}"
+
+
+def _memoryview_bytes(view):
+    # the bytes or bytearray the memoryview is a view on, if it shows all of it, to avoid a copy
+    if type(view.obj) in (bytes, bytearray) and view.c_contiguous and view.nbytes == len(view.obj):
+        return view.obj
+    return view.tobytes()
+
+
+class _ReprMemo(dict):
+    """Maps values to their repr(), stops growing when it has reached the given size."""
+    def __init__(self, size):
+        super(_ReprMemo, self).__init__()
+        self.size = size
+
+    def __missing__(self, value):
+        text = repr(value)
+        if len(self) < self.size:
+            self[value] = text
+        return text
+
+
+_parallel_state = None     # in a worker process: (serializer, elements or None, container id, are the elements dict items)
+
+
+def _parallel_init(registry, state):
+    global _parallel_state
+    if registry != _registry_snapshot.registry:
+        # not a forked process: use the same class registrations as the parent process
+        with _registry_lock:
+            _special_classes_registry.clear()
+            _special_classes_registry.update(registry)
+            _publish_registry()
+    _parallel_state = state
+
+
+def _parallel_chunk(task):
+    serializer, elements, container_id, pairs = _parallel_state
+    if elements is not None:
+        task = elements[task[0]:task[1]]    # forked process: it has the elements already
+    return serializer._serialize_elements(task, container_id, pairs)
+
+
+def _float_repr(float_obj):
+    if math.isnan(float_obj):
+        # there's no literal expression for a float NaN...
+        return "{'__class__':'float','value':'nan'}"
+    if math.isinf(float_obj):
+        # output a literal expression that overflows the float and results in +/-INF
+        return "1e30000" if float_obj > 0 else "-1e30000"
+    return repr(float_obj)
 
 
 def tobytes(obj):
@@ -184,6 +1274,7 @@ def tobytes(obj):
     All this is not required if you called serpent with 'bytes_repr' set to True, since Serpent 1.40
     that can be used to directly encode bytes into the bytes literal value representation.
     That will be less efficient than the default base-64 encoding though, but it's a bit more convenient.
+    With bytes_repr set to "adaptive" you get either one of the two, this function accepts both.
     """
     if isinstance(obj, _bytes_types):
         return obj
@@ -195,6 +1286,119 @@ def tobytes(obj):
     raise TypeError("argument is neither bytes nor serpent base64 encoded bytes dict")
 
 
+# Compressed serpent data starts with this, followed by a byte for the compression method and then the
+# compressed stream. Serpent text is utf-8 encoded source code without 0-bytes, so it never starts like this.
+_compressed_magic = b"\x00serpent\x00"
+_compression_methods = {"zlib": b"z", "lzma": b"x"}
+_decompression_errors = (zlib.error, EOFError) + ((lzma.LZMAError,) if lzma else ())
+
+
+def _check_compression(compress, zdict):
+    if compress is not None and compress not in _compression_methods:
+        raise ValueError("invalid compression method: " + repr(compress))
+    if zdict is not None and compress != "zlib":
+        raise ValueError("a zdict can only be used with zlib compression")
+
+
+def _new_compressor(compress, zdict):
+    if compress == "zlib":
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zdict=zdict) if zdict else zlib.compressobj()
+    if lzma is None:
+        raise ValueError("lzma compression is not available")
+    return lzma.LZMACompressor()
+
+
+def _new_decompressor(method, stream_start, zdict):
+    """
+    Create the decompressor for a compressed stream, given the method byte and the first bytes of the stream.
+    The preset dictionary must be the one the data was compressed with, this is checked for zlib streams.
+    """
+    if method == _compression_methods["zlib"]:
+        if len(stream_start) >= 6 and stream_start[1] & 0x20:
+            # the zlib header contains the adler32 checksum of the preset dictionary
+            if zdict is None:
+                raise ValueError("the compressed serpent data requires the zdict that it was compressed with")
+            if zlib.adler32(zdict) != int.from_bytes(stream_start[2:6], "big"):
+                raise ValueError("the compressed serpent data was compressed with a different zdict")
+            return zlib.decompressobj(zdict=zdict)
+        return zlib.decompressobj()
+    if method == _compression_methods["lzma"]:
+        if lzma is None:
+            raise ValueError("lzma compression is not available")
+        return lzma.LZMADecompressor()
+    raise ValueError("unknown compression method in compressed serpent data")
+
+
+def _decompress_limited(decompressor, data, max_size, done=0):
+    """
+    Decompress the next data with the decompressor, when done bytes have been decompressed already.
+    Raises ValueError as soon as the total gets larger than max_size (None=no limit): the output is capped,
+    rather than checked afterwards, so a small input can't make it allocate a huge amount of memory.
+    """
+    try:
+        if max_size is None:
+            return decompressor.decompress(data)
+        limit = max(max_size - done, 0) + 1
+        result = decompressor.decompress(data, limit)
+    except _decompression_errors as x:
+        raise ValueError("invalid compressed serpent data: " + str(x)) from x
+    if len(result) >= limit:
+        raise ValueError("decompressed serpent data exceeds max_decompressed_size=%d" % max_size)
+    return result
+
+
+def _decompress(data, zdict, max_size):
+    """
+    Decompress compressed serpent data (starting with the magic prefix) as a whole, to the serpent text bytes.
+    The decompressed data can be at most max_size bytes (None=no limit), or ValueError is raised.
+    """
+    with memoryview(data) as view:
+        prefix = len(_compressed_magic)
+        decompressor = _new_decompressor(bytes(view[prefix:prefix + 1]), bytes(view[prefix + 1:prefix + 7]), zdict)
+        result = _decompress_limited(decompressor, view[prefix + 1:], max_size)
+    if not decompressor.eof or decompressor.unused_data:
+        raise ValueError("invalid compressed serpent data: truncated, or followed by other data")
+    return result
+
+
+def make_zdict(samples, size=32768):
+    """
+    Build a preset dictionary for zlib compression (the zdict parameter) from sample serialized messages
+    that are typical for the data that will be compressed, so that small messages compress well too.
+    It consists of the text fragments that occur most often in the samples, such as dict keys and class
+    names, preceded by the text of the samples themselves as far as it fits in size bytes.
+    The same dictionary must be given when the compressed data is deserialized.
+    """
+    samples = [bytes(sample) for sample in samples]
+    counts = collections.Counter()
+    for sample in samples:
+        if sample.startswith(b"#"):
+            header, _, sample = sample.partition(b"\n")
+            counts[header + b"\n"] += 1
+        counts.update(re.findall(_zdict_fragment, sample))
+    scored = sorted(((count * len(fragment), fragment) for fragment, count in counts.items() if count > 1), reverse=True)
+    chosen = []
+    total = 0
+    for score, fragment in scored:
+        if total + len(fragment) <= size:
+            chosen.append(fragment)
+            total += len(fragment)
+    # zlib finds the end of the dictionary at the shortest distance, so that's where the most valuable fragments go
+    fragments = b"".join(reversed(chosen))
+    if total >= size:
+        return fragments
+    return b"".join(samples)[-(size - total):] + fragments
+
+
+# a string or other literal in serpent text, with the punctuation that follows it
+_zdict_fragment = rb"""(?:'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*"|[^\s'",:()\[\]{}]+)[\s,:()\[\]{}]*|[\s,:()\[\]{}]+"""
+
+
+class OutputTooLargeError(ValueError):
+    """Raised when the serialized output gets larger than the max_bytes limit of the serializer."""
+    pass
+
+
 class Serializer(object):
     """
     Serialize an object tree to a byte stream.
@@ -203,36 +1407,353 @@ class Serializer(object):
     across different threads.
     """
     dispatch = {}
+    engines = ("recursive", "iterative")
+    header = "# serpent utf-8 python3.2\n"
+    parallel_threshold = 10000      # minimum number of elements for serialize_parallel to use worker processes
 
-    def __init__(self, indent=False, module_in_classname=False, bytes_repr=False):
+    def __init__(self, indent=False, module_in_classname=False, bytes_repr=False, engine="recursive", memo_size=0,
+                 canonical=False, trusted=False, max_bytes=None, compress=None, zdict=None):
         """
         Initialize the serializer.
         indent=indent the output over multiple lines (default=false)
         module_in_classname = include module prefix for class names or only use the class name itself
         bytes_repr = should the bytes literal value representation be used instead of base-64 encoding for bytes types?
+                     "adaptive" = per value, use whichever of the two is smaller
+        engine = "recursive" (default) or "iterative". The iterative engine walks the object tree with an
+                 explicit stack, so it has no nesting depth limit (maximum_level is ignored, unless trusted).
+        memo_size = within a single serialization, remember the serialized form of up to this many objects
+                    of immutable types (uuid, decimal, datetime types, enums), and of string dict keys,
+                    and reuse it when they occur again. Default is 0, no memo.
+        canonical = write the keys of dicts and the elements of sets in a fixed order: by type, then by value,
+                    also for a mix of types. Equal object trees then always give identical bytes.
+                    Without it, they're only sorted when indenting, and only if they can be compared.
+        trusted = the data is known to be free of circular references and of invalid dict keys and set elements:
+                  skip those checks, for speed. A circular reference then fails with a ValueError when the
+                  nesting gets deeper than maximum_level (also in the iterative engine).
+        max_bytes = the maximum size of the serialized output (default=None, no limit). The output is
+                    measured while it is being produced, and OutputTooLargeError is raised as soon as it
+                    exceeds the limit. With a limit, the object tree is always walked by the iterative engine.
+                    It applies to the serialized text, before compression.
+        compress = None (default) for plain serpent text, or "zlib" or "lzma" to compress it. Compressed data
+                   starts with a distinct prefix, so that the load functions recognise and decompress it.
+        zdict = a preset dictionary for zlib compression (see make_zdict), it's needed to decompress the data too.
         """
+        if engine not in self.engines:
+            raise ValueError("invalid serializer engine: " + repr(engine))
+        _check_compression(compress, zdict)
         self.indent = indent
         self.module_in_classname = module_in_classname
         self.serialized_obj_ids = set()
         self.special_classes_registry_copy = None
+        self._handler_cache = {}
+        self._class_layouts = {}
         self.maximum_level = min(sys.getrecursionlimit() // 5, 1000)
         self.bytes_repr = bytes_repr
+        self.engine = engine
+        self.memo_size = memo_size
+        self.canonical = canonical
+        self.trusted = trusted
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.zdict = zdict
+        self._memo = {}
+        self._key_repr = repr
+        if engine == "iterative":
+            self._serialize = self._serialize_iterative
 
     def serialize(self, obj):
         """Serialize the object tree to bytes."""
-        self.special_classes_registry_copy = _special_classes_registry.copy()  # make it thread safe
-        header = "# serpent utf-8 python3.2\n"
-        out = [header]
+        self._use_registry(_current_registry())
+        self._start_memo()
+        out = [self.header]
         try:
             gc.disable()
             self.serialized_obj_ids = set()
+            if self.max_bytes is not None:
+                return self._compressed(b"".join(self._encoded_pieces(obj, self._max_bytes_checkpoint)))
             self._serialize(obj, out, 0)
+        finally:
+            gc.enable()
+            self.special_classes_registry_copy = None
+            self._handler_cache = {}
+            self._start_memo(False)
+            self.serialized_obj_ids = set()
+        return self._compressed("".join(out).encode("utf-8"))
+
+    def serialize_many(self, objs, buffer=None):
+        """
+        Serialize each object tree from the iterable into its own message, as serialize() does.
+        The setup and cleanup is done just once for the whole batch, so this is a lot faster
+        than separate serialize() calls for many small messages. Class registrations made while
+        the batch is being serialized are not used for it.
+        Returns a list of the messages, or appends them to the buffer (a bytearray) if it is given,
+        and returns a list of the (start, end) offsets of each message in it.
+        """
+        self._use_registry(_current_registry())
+        serialize = self._serialize
+        header = self.header
+        results = []
+        append = results.append
+        try:
+            gc.disable()
+            self.serialized_obj_ids = set()     # every serialization leaves this empty again
+            for obj in objs:
+                if self.memo_size:
+                    self._start_memo()
+                if self.max_bytes is not None:
+                    data = b"".join(self._encoded_pieces(obj, self._max_bytes_checkpoint))
+                else:
+                    out = [header]
+                    serialize(obj, out, 0)
+                    data = "".join(out).encode("utf-8")
+                if self.compress:
+                    data = self._compressed(data)
+                if buffer is None:
+                    append(data)
+                else:
+                    start = len(buffer)
+                    buffer += data
+                    append((start, len(buffer)))
+        finally:
+            gc.enable()
+            self.special_classes_registry_copy = None
+            self._handler_cache = {}
+            self._start_memo(False)
+            self.serialized_obj_ids = set()
+        return results
+
+    def serialize_parallel(self, obj, workers, mp_context=None):
+        """
+        Serialize the object tree to bytes, like serialize(), but if it is a list, tuple or dict of at least
+        parallel_threshold elements, the elements are serialized in chunks by a pool of worker processes.
+        The output is identical to that of serialize(). Smaller or other objects are serialized directly.
+        mp_context = the multiprocessing context to start the workers with (default=None, the default start method).
+        With the "fork" start method, the workers share the object tree and class registrations.
+        Otherwise the chunks of elements, this serializer, and the registered classes and their
+        serializer functions are pickled for the workers, so they must be picklable then.
+        The max_bytes limit is checked for every chunk that a worker finishes.
+        """
+        t = type(obj)
+        if workers < 2 or t not in (list, tuple, dict) or len(obj) < self.parallel_threshold \
+                or self.dispatch[t] is not Serializer.dispatch[t] \
+                or any(issubclass(t, clazz) for clazz in _registry_snapshot.registry):
+            return self.serialize(obj)
+        elements = obj
+        if t is dict:
+            elements = list(self._ordered_items(obj))
+        chunk_size = -(-len(elements) // (workers * 4))
+        ranges = [(start, start + chunk_size) for start in range(0, len(elements), chunk_size)]
+        import multiprocessing
+        import concurrent.futures
+        context = mp_context or multiprocessing.get_context()
+        if context.get_start_method() == "fork":
+            state = (self, elements, id(obj), t is dict)
+            tasks = ranges
+        else:
+            state = (self, None, id(obj), t is dict)
+            tasks = (elements[start:end] for start, end in ranges)
+        with concurrent.futures.ProcessPoolExecutor(workers, context, _parallel_init,
+                                                    (_registry_snapshot.registry.copy(), state)) as pool:
+            chunks = []
+            separator = b",\n  " if self.indent else b","
+            size = len(self.header.encode("utf-8")) + (len(ranges) - 1) * len(separator) + (6 if self.indent else 2)
+            for chunk in pool.map(_parallel_chunk, tasks):
+                chunks.append(chunk)
+                size += len(chunk)
+                if self.max_bytes is not None and size > self.max_bytes:
+                    pool.shutdown(cancel_futures=True)
+                    raise OutputTooLargeError("serialized output exceeds max_bytes=%d" % self.max_bytes)
+        opener, closer = {list: (b"[", b"]"), tuple: (b"(", b")"), dict: (b"{", b"}")}[t]
+        if self.indent:
+            return self._compressed(b"".join([self.header.encode("utf-8"), opener, b"\n  ", separator.join(chunks),
+                                              b"\n", closer]))
+        return self._compressed(b"".join([self.header.encode("utf-8"), opener, separator.join(chunks), closer]))
+
+    def _serialize_elements(self, elements, container_id, pairs):
+        """
+        Serialize a chunk of the elements of a top-level container (of its (key, value) items if it's a dict),
+        separated like serialize() does, for serialize_parallel. Returns the utf-8 encoded bytes.
+        """
+        max_bytes = self.max_bytes
+        size = measured = 0
+        separator = ",\n  " if self.indent else ","
+        key_separator = ": " if self.indent else ":"
+        self._use_registry(_current_registry())
+        self._start_memo()
+        serialize = self._serialize
+        key_repr = self._key_repr
+        out = []
+        append = out.append
+        try:
+            gc.disable()
+            self.serialized_obj_ids = {container_id}
+            for element in elements:
+                if pairs:
+                    key, element = element
+                    if type(key) is str:
+                        append(key_repr(key))
+                    else:
+                        if not self.trusted and type(key) not in _hashable_key_types:
+                            self._check_hashable_type(type(key))
+                        serialize(key, out, 1)
+                    append(key_separator)
+                serialize(element, out, 1)
+                append(separator)
+                if max_bytes is not None:
+                    # the number of characters is a lower bound of the encoded size
+                    size += sum(map(len, out[measured:]))
+                    measured = len(out)
+                    if size > max_bytes:
+                        raise OutputTooLargeError("serialized output exceeds max_bytes=%d" % max_bytes)
+            del out[-1]  # remove the last separator
         finally:
             gc.enable()
         self.special_classes_registry_copy = None
-        del self.serialized_obj_ids
+        self._handler_cache = {}
+        self._start_memo(False)
+        self.serialized_obj_ids = set()
         return "".join(out).encode("utf-8")
 
+    def iter_serialize(self, obj, chunk_size=65536):
+        """
+        Serialize the object tree to bytes, as a generator of chunks of chunk_size bytes (the last one can be shorter).
+        The output is encoded and handed out while the object tree is being walked, so that the
+        serialized data as a whole never has to be in memory. It always uses the iterative engine.
+        With compression, the output is compressed while it's being produced as well.
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        self._use_registry(_current_registry())
+        self._start_memo()
+        self.serialized_obj_ids = set()
+        pending = bytearray()
+        pieces = self._encoded_pieces(obj, max(chunk_size // 16, 16))
+        if self.compress:
+            pieces = self._compressing(pieces)
+        try:
+            while True:
+                try:
+                    gc.disable()
+                    piece = next(pieces, None)
+                finally:
+                    gc.enable()
+                if piece is None:
+                    break
+                pending += piece
+                while len(pending) >= chunk_size:
+                    yield bytes(pending[:chunk_size])
+                    del pending[:chunk_size]
+            if pending:
+                yield bytes(pending)
+        finally:
+            pieces.close()
+            self.special_classes_registry_copy = None
+            self._handler_cache = {}
+            self._start_memo(False)
+            self.serialized_obj_ids = set()
+
+    def serialize_into(self, obj, target, chunk_size=65536):
+        """
+        Serialize the object tree and write the utf-8 encoded output to target: a bytearray (that the output
+        is appended to), or any object with a write method such as io.BytesIO or a file.
+        The output is encoded and written in pieces of about chunk_size bytes while the object tree is
+        being walked, so it never exists as a whole in another form. It always uses the iterative engine.
+        With compression, the output is compressed while it's being produced as well.
+        Returns the number of bytes written. If an error occurs, a bytearray target is restored to its
+        original length, other targets keep what was written to them.
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        if isinstance(target, bytearray):
+            write = target.extend
+            start = len(target)
+        else:
+            write = target.write
+            start = None
+        self._use_registry(_current_registry())
+        self._start_memo()
+        self.serialized_obj_ids = set()
+        pieces = self._encoded_pieces(obj, max(chunk_size // 16, 16))
+        if self.compress:
+            pieces = self._compressing(pieces)
+        written = 0
+        try:
+            gc.disable()
+            for piece in pieces:
+                write(piece)
+                written += len(piece)
+        except BaseException:
+            if start is not None:
+                del target[start:]
+            raise
+        finally:
+            gc.enable()
+            pieces.close()
+            self.special_classes_registry_copy = None
+            self._handler_cache = {}
+            self._start_memo(False)
+            self.serialized_obj_ids = set()
+        return written
+
+    _max_bytes_checkpoint = 1024    # number of output fragments after which the size is checked against max_bytes
+    _bulk_batch_size = None         # when streaming: the number of elements that bulk output is produced for at a time
+
+    def _encoded_pieces(self, obj, checkpoint):
+        """
+        Generator that walks the object tree with the iterative engine, and produces the utf-8 encoded
+        output (including the header) in pieces, each time out has grown to checkpoint fragments.
+        Raises OutputTooLargeError as soon as the total size exceeds max_bytes.
+        """
+        out = [self.header]
+        walker = self._walk(obj, out, 0, checkpoint)
+        max_bytes = self.max_bytes
+        size = 0
+        self._bulk_batch_size = checkpoint
+        try:
+            finished = False
+            while not finished:
+                finished = next(walker, _no_value) is _no_value
+                piece = "".join(out).encode("utf-8")
+                out.clear()
+                size += len(piece)
+                if max_bytes is not None and size > max_bytes:
+                    raise OutputTooLargeError("serialized output exceeds max_bytes=%d" % max_bytes)
+                yield piece
+        finally:
+            walker.close()
+            self._bulk_batch_size = None
+
+    def _compressed(self, data):
+        """The serialized data in its compressed form, if the serializer compresses its output."""
+        if not self.compress:
+            return data
+        compressor = _new_compressor(self.compress, self.zdict)
+        return b"".join([_compressed_magic, _compression_methods[self.compress], compressor.compress(data), compressor.flush()])
+
+    def _compressing(self, pieces):
+        """Generator that compresses the pieces of output from _encoded_pieces, while they're being produced."""
+        compressor = _new_compressor(self.compress, self.zdict)
+        try:
+            yield _compressed_magic + _compression_methods[self.compress]
+            for piece in pieces:
+                piece = compressor.compress(piece)
+                if piece:
+                    yield piece
+            yield compressor.flush()
+        finally:
+            pieces.close()
+
+    def _use_registry(self, snapshot):
+        # the snapshot is immutable and consistent with its handler cache, so there's no need to copy anything
+        self.special_classes_registry_copy = snapshot.registry
+        self._handler_cache = snapshot.handler_cache if self.dispatch is Serializer.dispatch and not self.memo_size else {}
+        self._class_layouts = snapshot.class_layouts if type(self).get_class_name is Serializer.get_class_name else {}
+
+    def _start_memo(self, start=True):
+        # the memos only live for the duration of a single serialization; the handlers look them up on every call
+        self._memo = {}
+        self._key_repr = _ReprMemo(self.memo_size).__getitem__ if start and self.memo_size else repr
+
     _shortcut_dispatch_types = {float, complex, tuple, list, dict, set, frozenset}
 
     def _serialize(self, obj, out, level):
@@ -253,38 +1774,362 @@ class Serializer(object):
         if t in self._shortcut_dispatch_types:
             # we shortcut these builtins directly to the dispatch function to avoid type lookup overhead below
             return self.dispatch[t](self, obj, out, level)
+        try:
+            func, special = self._handler_cache[t]
+        except KeyError:
+            func, special = self._handler_cache[t] = self._resolve_handler(t)
+        if special:
+            func(obj, self, out, level)
+        else:
+            func(self, obj, out, level)
+
+    def _resolve_handler(self, t):
+        """
+        Find the serializer function for objects of type t.
+        Returns a (function, is_special_class) tuple, special class functions
+        have a different call signature than the dispatch methods.
+        """
+        func, special = self._find_handler(t)
+        if self.memo_size and (func in self._bulk_formatters or issubclass(t, enum.Enum)):
+            return self._memoized_handler(func, special), False
+        return func, special
+
+    def _memoized_handler(self, func, special):
+        """
+        Wrap the serializer function of an immutable type, to reuse the serialized form of
+        objects that were serialized before. Returns a dispatch-style function.
+        """
+        memo_size = self.memo_size
+
+        def serialize_memoized(serializer, obj, out, level):
+            memo = serializer._memo     # (replaced for every serialization, so don't bind it here)
+            known = memo.get(id(obj))
+            if known is not None:
+                out.append(known[0])
+                return
+            start = len(out)
+            if special:
+                func(obj, serializer, out, level)
+            else:
+                func(serializer, obj, out, level)
+            if len(out) == start + 1 and len(memo) < memo_size and "\n" not in out[start]:
+                # (multi-line output depends on the indentation level so that can't be reused)
+                memo[id(obj)] = (out[start], obj)     # keep obj alive, its id must remain unique
+
+        serialize_memoized.bulk_formatter = None if special else self._bulk_formatters.get(func)
+        return serialize_memoized
+
+    def _find_handler(self, t):
         # check special registered types:
         special_classes = self.special_classes_registry_copy
         for clazz in special_classes:
-            if isinstance(obj, clazz):
-                special_classes[clazz](obj, self, out, level)
-                return
+            if issubclass(t, clazz):
+                return special_classes[clazz], True
         # serialize dispatch
         try:
-            func = self.dispatch[t]
+            return self.dispatch[t], False
         except KeyError:
+            numpy = sys.modules.get("numpy")
+            if numpy is not None:
+                # numpy support is only activated when it's being used, serpent doesn't depend on it.
+                # Checked before the MRO because some numpy scalar types subclass float or str, but have another repr.
+                if issubclass(t, numpy.ndarray):
+                    return Serializer.ser_numpy_ndarray, False
+                if issubclass(t, numpy.generic):
+                    return Serializer.ser_numpy_generic, False
             # walk the MRO until we find a base class we recognise
             for type_ in t.__mro__:
                 if type_ in self.dispatch:
-                    func = self.dispatch[type_]
-                    break
+                    return self.dispatch[type_], False
+            # fall back to the default class serializer
+            return Serializer.ser_default_class, False
+
+    def _serialize_iterative(self, obj, out, level):
+        """
+        Serialize obj by walking the object tree with an explicit stack instead of recursion.
+        The output is identical to that of the recursive ser_builtins_* methods.
+        """
+        for _ in self._walk(obj, out, level, sys.maxsize):
+            pass
+
+    def _walk(self, obj, out, level, checkpoint):
+        """
+        Generator that does the work for the iterative engine.
+        It yields (nothing) whenever out has grown to at least checkpoint fragments, so that the
+        caller can take the output so far and clear out, before resuming.
+        """
+        append = out.append
+        repr_types = _repr_types
+        key_repr = self._key_repr
+        trusted = self.trusted
+        stack = []
+        while True:
+            if obj is not _checkpoint:
+                # serialize obj, or open a new stack frame if it's a non-empty container
+                t = type(obj)
+                if t in _bytes_types:
+                    append(_translate_byte_type(t, obj, self.bytes_repr))
+                else:
+                    if t in _translate_types:
+                        obj = _translate_types[t](obj)
+                        t = type(obj)
+                    if t in repr_types:
+                        append(repr(obj))
+                    elif t is float:
+                        self.ser_builtins_float(obj, out, level)
+                    elif t is _Text:
+                        append(obj)
+                        yield   # a whole batch of elements, let the caller take it
+                    else:
+                        if t in self._shortcut_dispatch_types:
+                            func = self.dispatch[t]
+                        else:
+                            try:
+                                func, special = self._handler_cache[t]
+                            except KeyError:
+                                func, special = self._handler_cache[t] = self._resolve_handler(t)
+                            if special:
+                                func(obj, self, out, level)
+                                func = None
+                        if func is not None:
+                            frame = self._open_frame(func, obj, out, level)
+                            if frame:
+                                if trusted and len(stack) >= self.maximum_level:
+                                    # without cycle detection, this is what stops a circular reference
+                                    raise ValueError("Object graph nesting too deep (trusted mode). "
+                                                     "Increase serializer.maximum_level if you think you need more.")
+                                stack.append(frame)
+            if len(out) >= checkpoint:
+                yield
+            # find the next object to serialize, closing the frames that have been completed.
+            # simple elements are serialized right here, to avoid going through the whole loop for them.
+            while stack:
+                frame = stack[-1]
+                prefix, next_prefix, kv_separator = frame[1], frame[2], frame[6]
+                if kv_separator is None:
+                    for obj in frame[0]:
+                        append(prefix)
+                        prefix = next_prefix
+                        if type(obj) not in repr_types:
+                            break
+                        append(repr(obj))
+                        if len(out) >= checkpoint:
+                            obj = _checkpoint
+                            break
+                    else:
+                        obj = _no_value
+                else:
+                    obj = frame[7]
+                    if obj is not _no_value:
+                        # the value that goes with the dict key that was just serialized
+                        frame[7] = _no_value
+                        append(kv_separator)
+                        level = frame[5]
+                        break
+                    for key, obj in frame[0]:
+                        append(prefix)
+                        prefix = next_prefix
+                        t = type(key)
+                        if not trusted and t not in _hashable_key_types:
+                            self._check_hashable_type(t)
+                        if t not in repr_types:
+                            frame[7] = obj
+                            obj = key
+                            break
+                        append(key_repr(key) if t is str else repr(key))
+                        append(kv_separator)
+                        if type(obj) not in repr_types:
+                            break
+                        append(repr(obj))
+                        if len(out) >= checkpoint:
+                            obj = _checkpoint
+                            break
+                    else:
+                        obj = _no_value
+                if obj is _no_value:
+                    append(frame[3])
+                    for obj_id in frame[4]:
+                        self.serialized_obj_ids.discard(obj_id)
+                    stack.pop()
+                    continue
+                frame[1] = next_prefix
+                level = frame[5]
+                break
+            else:
+                return
+
+    def _open_frame(self, func, obj, out, level):
+        """
+        Used by the iterative engine. Writes the opening part of a container type and returns
+        the stack frame to process its elements with, or None if there's nothing more to do.
+        Objects that aren't containers are handed to their serializer function directly.
+        A frame is a list: [element iterator, prefix for the next element, prefix for elements after that,
+        closing text, ids to discard from serialized_obj_ids when done, level of the elements,
+        key-value separator (None if not a dict), pending dict value, and optionally the object whose id
+        is tracked if nothing else keeps it alive]
+        In trusted mode, no ids are tracked and dict keys and set elements aren't checked.
+        """
+        trusted = self.trusted
+        if func is Serializer.ser_default_class:
+            if trusted:
+                ids = ()
+            else:
+                if id(obj) in self.serialized_obj_ids:
+                    raise ValueError("Circular reference detected (class)")
+                self.serialized_obj_ids.add(id(obj))
+                ids = (id(obj),)
+            items = self._class_items(obj)
+            if items is not None:
+                out.append("{")
+                class_item = ("__class__", self._class_layouts[type(obj)].class_names[1 if self.module_in_classname else 0])
+                return [itertools.chain(items, (class_item,)), "", ",", "}", ids, level + 1, ":", _no_value]
+            value, as_dict = self._class_state(obj)
+            if as_dict:
+                frame = self._open_frame(Serializer.ser_builtins_dict, value, out, level)
+                if frame:
+                    frame[4] += ids
+                    frame.append(value)     # a temporary dict's id could be reused while it's in serialized_obj_ids
+                    return frame
+                self.serialized_obj_ids.discard(id(obj))
+                return None
+            # serialize the state object as the single element of an otherwise invisible container
+            return [iter((value,)), "", "", "", ids, level, None, _no_value]
+        if func is Serializer.ser_builtins_list:
+            if not trusted and id(obj) in self.serialized_obj_ids:
+                raise ValueError("Circular reference detected (list)")
+            if not obj:
+                out.append("[]")
+                return None
+            elements = iter(obj)
+            if len(obj) > 1:
+                if self._bulk_batch_size:
+                    elements = self._scalar_batches(obj, level)
+                elif self._ser_scalar_sequence(obj, "[", "]", out, level):
+                    return None
+            if trusted:
+                ids = ()
             else:
-                # fall back to the default class serializer
-                func = Serializer.ser_default_class
+                self.serialized_obj_ids.add(id(obj))
+                ids = (id(obj),)
+            if self.indent:
+                indent_chars = "  " * level
+                indent_chars_inside = indent_chars + "  "
+                out.append("[\n")
+                return [elements, indent_chars_inside, ",\n" + indent_chars_inside, "\n" + indent_chars + "]",
+                        ids, level + 1, None, _no_value]
+            out.append("[")
+            return [elements, "", ",", "]", ids, level + 1, None, _no_value]
+        if func is Serializer.ser_builtins_tuple:
+            if not obj:
+                out.append("()")
+                return None
+            elements = iter(obj)
+            if len(obj) > 1:
+                if self._bulk_batch_size:
+                    elements = self._scalar_batches(obj, level)
+                elif self._ser_scalar_sequence(obj, "(", ")", out, level):
+                    return None
+            if self.indent:
+                indent_chars = "  " * level
+                indent_chars_inside = indent_chars + "  "
+                out.append("(\n")
+                closer = (",\n" if len(obj) == 1 else "\n") + indent_chars + ")"
+                return [elements, indent_chars_inside, ",\n" + indent_chars_inside, closer, (), level + 1, None, _no_value]
+            out.append("(")
+            return [elements, "", ",", ",)" if len(obj) == 1 else ")", (), level + 1, None, _no_value]
+        if func is Serializer.ser_builtins_dict:
+            if not trusted and id(obj) in self.serialized_obj_ids:
+                raise ValueError("Circular reference detected (dict)")
+            if not obj:
+                out.append("{}")
+                return None
+            if trusted:
+                ids = ()
+            else:
+                self.serialized_obj_ids.add(id(obj))
+                ids = (id(obj),)
+            if self.indent:
+                indent_chars = "  " * level
+                indent_chars_inside = indent_chars + "  "
+                out.append("{\n")
+                return [iter(self._ordered_items(obj)), indent_chars_inside, ",\n" + indent_chars_inside, "\n" + indent_chars + "}",
+                        ids, level + 1, ": ", _no_value]
+            out.append("{")
+            items = self._ordered_items(obj) if self.canonical else obj.items()
+            return [iter(items), "", ",", "}", ids, level + 1, ":", _no_value]
+        if func is Serializer.ser_builtins_set:
+            if not obj:
+                out.append("()")
+                return None
+            elements = self._ordered_elements(obj)
+            elements = iter(elements) if trusted else self._checked_hashable(elements)
+            if self.indent:
+                indent_chars = "  " * level
+                indent_chars_inside = indent_chars + "  "
+                out.append("{\n")
+                return [elements, indent_chars_inside, ",\n" + indent_chars_inside,
+                        "\n" + indent_chars + "}", (), level + 1, None, _no_value]
+            out.append("{")
+            return [elements, "", ",", "}", (), level + 1, None, _no_value]
+        if self._bulk_batch_size:
+            # streaming the output: the elements of arrays are written in batches too, rather than all at once
+            if func is Serializer.ser_array_array and obj.typecode != "u" and obj:
+                return self._list_frame(self._scalar_batches(obj, level), out, level)
+            if func is Serializer.ser_numpy_ndarray and obj.ndim and len(obj) and obj.dtype.kind in "biuf" \
+                    and not hasattr(obj, "mask"):
+                # the rows of a multidimensional array are arrays, that get a frame of their own
+                elements = self._scalar_batches(obj, level, True) if obj.ndim == 1 else iter(obj)
+                return self._list_frame(elements, out, level)
         func(self, obj, out, level)
+        return None
+
+    def _list_frame(self, elements, out, level):
+        """Writes the opening bracket of a list, and returns the stack frame for its elements."""
+        if self.indent:
+            indent_chars = "  " * level
+            indent_chars_inside = indent_chars + "  "
+            out.append("[\n")
+            return [elements, indent_chars_inside, ",\n" + indent_chars_inside, "\n" + indent_chars + "]",
+                    (), level + 1, None, _no_value]
+        out.append("[")
+        return [elements, "", ",", "]", (), level + 1, None, _no_value]
+
+    def _ordered_items(self, dict_obj):
+        """The items of a dict in the order in which they're written: canonical, sorted when indenting, or as they are."""
+        if self.canonical:
+            if len(dict_obj) > 1:
+                if set(map(type, dict_obj)) in _natively_ordered_types:
+                    return sorted(dict_obj.items(), key=_first_item)
+                return sorted(dict_obj.items(), key=_canonical_item_key)
+        elif self.indent:
+            try:
+                return sorted(dict_obj.items())
+            except TypeError:  # can occur when elements can't be ordered (Python 3.x)
+                pass
+        return dict_obj.items()
+
+    def _ordered_elements(self, set_obj):
+        """The elements of a set in the order in which they're written, like _ordered_items."""
+        if self.canonical:
+            if len(set_obj) > 1:
+                if set(map(type, set_obj)) in _natively_ordered_types:
+                    return sorted(set_obj)
+                return sorted(set_obj, key=_canonical_key)
+        elif self.indent:
+            try:
+                return sorted(set_obj)
+            except TypeError:  # can occur when elements can't be ordered (Python 3.x)
+                pass
+        return set_obj
+
+    def _checked_hashable(self, elements):
+        for elt in elements:
+            if type(elt) not in _hashable_key_types:
+                self._check_hashable_type(type(elt))
+            yield elt
 
     def ser_builtins_float(self, float_obj, out, level):
-        if math.isnan(float_obj):
-            # there's no literal expression for a float NaN...
-            out.append("{'__class__':'float','value':'nan'}")
-        elif math.isinf(float_obj):
-            # output a literal expression that overflows the float and results in +/-INF
-            if float_obj > 0:
-                out.append("1e30000")
-            else:
-                out.append("-1e30000")
-        else:
-            out.append(repr(float_obj))
+        out.append(_float_repr(float_obj))
 
     dispatch[float] = ser_builtins_float
 
@@ -298,7 +2143,81 @@ class Serializer(object):
 
     dispatch[complex] = ser_builtins_complex
 
+    def _ser_scalar_sequence(self, seq, opener, closer, out, level):
+        """
+        Fast path for sequences of 2 or more elements that are all of the same simple type
+        (or a mix of the types that are serialized by a plain repr): write them in bulk.
+        Returns False when the sequence doesn't qualify; nothing has been written then.
+        """
+        fragments = self._scalar_fragments(seq)
+        if fragments is None:
+            return False
+        self._write_fragments(fragments, opener, closer, out, level)
+        return True
+
+    def _scalar_batches(self, seq, level, tolist=False):
+        """
+        Generator of the elements of a sequence for the iterative engine when it's streaming the output.
+        The elements are taken in batches, and a batch that qualifies for bulk output is produced as a single
+        _Text, so that the output of a large sequence is never formatted all at once.
+        tolist = convert every batch with its tolist method first (for numpy arrays).
+        """
+        size = self._bulk_batch_size
+        separator = ",\n" + "  " * (level + 1) if self.indent else ","
+        for start in range(0, len(seq), size):
+            batch = seq[start:start + size]
+            if tolist:
+                batch = batch.tolist()
+            fragments = self._scalar_fragments(batch) if len(batch) > 1 else None
+            if fragments is None:
+                yield from batch
+            else:
+                yield _Text(separator.join(fragments))
+
+    def _scalar_fragments(self, seq):
+        """The serialized elements of a sequence for _ser_scalar_sequence, or None if it doesn't qualify."""
+        types = set(map(type, seq))
+        if types <= _repr_types:
+            fragments = map(repr, seq)
+        elif len(types) > 1:
+            return None
+        else:
+            t = types.pop()
+            if t is float:
+                fragments = map(repr if math.isfinite(sum(seq)) else _float_repr, seq)
+            else:
+                try:
+                    func, special = self._handler_cache[t]
+                except KeyError:
+                    func, special = self._handler_cache[t] = self._resolve_handler(t)
+                formatter = None if special else self._bulk_formatters.get(func)
+                if formatter is not None:
+                    fragments = formatter(t, seq)
+                else:
+                    formatter = getattr(func, "bulk_formatter", None)
+                    if formatter is None:
+                        return None
+                    # memoized type: format every distinct object just once
+                    unique = dict(zip(map(id, seq), seq))
+                    formatted = dict(zip(unique, formatter(t, unique.values())))
+                    fragments = map(formatted.__getitem__, map(id, seq))
+        return fragments
+
+    def _write_fragments(self, fragments, opener, closer, out, level):
+        if self.indent:
+            indent_chars = "  " * level
+            indent_chars_inside = indent_chars + "  "
+            out.append(opener + "\n" + indent_chars_inside)
+            out.append((",\n" + indent_chars_inside).join(fragments))
+            out.append("\n" + indent_chars + closer)
+        else:
+            out.append(opener)
+            out.append(",".join(fragments))
+            out.append(closer)
+
     def ser_builtins_tuple(self, tuple_obj, out, level):
+        if len(tuple_obj) > 1 and self._ser_scalar_sequence(tuple_obj, "(", ")", out, level):
+            return
         append = out.append
         serialize = self._serialize
         if self.indent and tuple_obj:
@@ -325,9 +2244,13 @@ class Serializer(object):
     dispatch[tuple] = ser_builtins_tuple
 
     def ser_builtins_list(self, list_obj, out, level):
-        if id(list_obj) in self.serialized_obj_ids:
-            raise ValueError("Circular reference detected (list)")
-        self.serialized_obj_ids.add(id(list_obj))
+        if len(list_obj) > 1 and self._ser_scalar_sequence(list_obj, "[", "]", out, level):
+            return
+        trusted = self.trusted
+        if not trusted:
+            if id(list_obj) in self.serialized_obj_ids:
+                raise ValueError("Circular reference detected (list)")
+            self.serialized_obj_ids.add(id(list_obj))
         append = out.append
         serialize = self._serialize
         if self.indent and list_obj:
@@ -348,36 +2271,40 @@ class Serializer(object):
             if list_obj:
                 del out[-1]  # remove the last ,
             append("]")
-        self.serialized_obj_ids.discard(id(list_obj))
+        if not trusted:
+            self.serialized_obj_ids.discard(id(list_obj))
 
     dispatch[list] = ser_builtins_list
 
     def _check_hashable_type(self, t):
-        if t not in (bool, bytes, str, tuple) and not issubclass(t, numbers.Number):
-            if issubclass(t, enum.Enum):
-                return
+        if t in _hashable_key_types:
+            return
+        if not issubclass(t, numbers.Number) and not issubclass(t, enum.Enum):
             raise TypeError("one of the keys in a dict or set is not of a primitive hashable type: " +
                             str(t) + ". Use simple types as keys or use a list or tuple as container.")
+        _hashable_key_types.add(t)
 
     def ser_builtins_dict(self, dict_obj, out, level):
-        if id(dict_obj) in self.serialized_obj_ids:
-            raise ValueError("Circular reference detected (dict)")
-        self.serialized_obj_ids.add(id(dict_obj))
+        trusted = self.trusted
+        if not trusted:
+            if id(dict_obj) in self.serialized_obj_ids:
+                raise ValueError("Circular reference detected (dict)")
+            self.serialized_obj_ids.add(id(dict_obj))
         append = out.append
         serialize = self._serialize
+        key_repr = self._key_repr
         if self.indent and dict_obj:
             indent_chars = "  " * level
             indent_chars_inside = indent_chars + "  "
             append("{\n")
-            dict_items = dict_obj.items()
-            try:
-                sorted_items = sorted(dict_items)
-            except TypeError:  # can occur when elements can't be ordered (Python 3.x)
-                sorted_items = dict_items
-            for key, value in sorted_items:
+            for key, value in self._ordered_items(dict_obj):
                 append(indent_chars_inside)
-                self._check_hashable_type(type(key))
-                serialize(key, out, level + 1)
+                if type(key) is str:
+                    append(key_repr(key))
+                else:
+                    if not trusted and type(key) not in _hashable_key_types:
+                        self._check_hashable_type(type(key))
+                    serialize(key, out, level + 1)
                 append(": ")
                 serialize(value, out, level + 1)
                 append(",\n")
@@ -385,41 +2312,45 @@ class Serializer(object):
             append("\n" + indent_chars + "}")
         else:
             append("{")
-            for key, value in dict_obj.items():
-                self._check_hashable_type(type(key))
-                serialize(key, out, level + 1)
+            for key, value in self._ordered_items(dict_obj) if self.canonical else dict_obj.items():
+                if type(key) is str:
+                    append(key_repr(key))
+                else:
+                    if not trusted and type(key) not in _hashable_key_types:
+                        self._check_hashable_type(type(key))
+                    serialize(key, out, level + 1)
                 append(":")
                 serialize(value, out, level + 1)
                 append(",")
             if dict_obj:
                 del out[-1]  # remove the last ,
             append("}")
-        self.serialized_obj_ids.discard(id(dict_obj))
+        if not trusted:
+            self.serialized_obj_ids.discard(id(dict_obj))
 
     dispatch[dict] = ser_builtins_dict
 
     def ser_builtins_set(self, set_obj, out, level):
+        trusted = self.trusted
         append = out.append
         serialize = self._serialize
         if self.indent and set_obj:
             indent_chars = "  " * level
             indent_chars_inside = indent_chars + "  "
             append("{\n")
-            try:
-                sorted_elts = sorted(set_obj)
-            except TypeError:  # can occur when elements can't be ordered (Python 3.x)
-                sorted_elts = set_obj
-            for elt in sorted_elts:
+            for elt in self._ordered_elements(set_obj):
                 append(indent_chars_inside)
-                self._check_hashable_type(type(elt))
+                if not trusted and type(elt) not in _hashable_key_types:
+                    self._check_hashable_type(type(elt))
                 serialize(elt, out, level + 1)
                 append(",\n")
             del out[-1]  # remove the last ,\n
             append("\n" + indent_chars + "}")
         elif set_obj:
             append("{")
-            for elt in set_obj:
-                self._check_hashable_type(type(elt))
+            for elt in self._ordered_elements(set_obj) if self.canonical else set_obj:
+                if not trusted and type(elt) not in _hashable_key_types:
+                    self._check_hashable_type(type(elt))
                 serialize(elt, out, level + 1)
                 append(",")
             del out[-1]  # remove the last ,
@@ -481,46 +2412,656 @@ class Serializer(object):
     def ser_array_array(self, array_obj, out, level):
         if array_obj.typecode == 'u':
             self._serialize(array_obj.tounicode(), out, level)
+        elif not array_obj:
+            out.append("[]")
         else:
-            self._serialize(array_obj.tolist(), out, level)
+            # all elements are int or float, so they can be written in bulk without converting to a list first
+            if array_obj.typecode in "fd" and not math.isfinite(sum(array_obj)):
+                fragments = map(_float_repr, array_obj)
+            else:
+                fragments = map(repr, array_obj)
+            self._write_fragments(fragments, "[", "]", out, level)
 
     dispatch[array.array] = ser_array_array
 
+    def ser_numpy_ndarray(self, array_obj, out, level):
+        # not in the dispatch table, see _resolve_handler
+        if array_obj.ndim == 0:
+            self._serialize(array_obj[()], out, level)
+        elif array_obj.dtype.kind in "biuf" and not hasattr(array_obj, "mask") and \
+                (array_obj.dtype.kind != "f" or sys.modules["numpy"].isfinite(array_obj).all()):
+            # the elements are all plain bools, ints or finite floats: convert the whole array in one go
+            # and write every innermost list in bulk, the output is the same as for the converted lists
+            self._write_numpy_rows(array_obj.tolist(), array_obj.ndim, out, level)
+        else:
+            self._serialize(array_obj.tolist(), out, level)
+
+    def _write_numpy_rows(self, rows, ndim, out, level):
+        if not rows:
+            out.append("[]")
+        elif ndim == 1:
+            self._write_fragments(map(repr, rows), "[", "]", out, level)
+        else:
+            append = out.append
+            if self.indent:
+                indent_chars = "  " * level
+                separator = ",\n" + indent_chars + "  "
+                append("[\n" + indent_chars + "  ")
+            else:
+                separator = ","
+                append("[")
+            for row in rows:
+                self._write_numpy_rows(row, ndim - 1, out, level + 1)
+                append(separator)
+            out[-1] = "\n" + indent_chars + "]" if self.indent else "]"
+
+    def ser_numpy_generic(self, scalar_obj, out, level):
+        # not in the dispatch table, see _resolve_handler
+        numpy = sys.modules["numpy"]
+        value = scalar_obj.item()
+        if isinstance(value, numpy.generic):
+            # there's no equivalent python type (numpy.longdouble for instance)
+            if isinstance(value, numpy.complexfloating):
+                value = complex(value)
+            elif isinstance(value, numpy.floating):
+                value = float(value)
+            else:
+                self.ser_default_class(scalar_obj, out, level)
+                return
+        self._serialize(value, out, level)
+
     def ser_default_class(self, obj, out, level):
-        if id(obj) in self.serialized_obj_ids:
-            raise ValueError("Circular reference detected (class)")
-        self.serialized_obj_ids.add(id(obj))
+        trusted = self.trusted
+        if not trusted:
+            if id(obj) in self.serialized_obj_ids:
+                raise ValueError("Circular reference detected (class)")
+            self.serialized_obj_ids.add(id(obj))
         try:
-            # note: python 3.11+ object itself now has __getstate__
-            has_own_getstate = (
-                hasattr(type(obj), '__getstate__')
-                and type(obj).__getstate__ is not getattr(object, '__getstate__', None)
-            )
-            if has_own_getstate:
-                value = obj.__getstate__()
-                if isinstance(value, dict):
-                    self.ser_builtins_dict(value, out, level)
-                    return
-            else:
-                try:
-                    value = dict(vars(obj))  # make sure we can serialize anything that resembles a dict
-                    value["__class__"] = self.get_class_name(obj)
-                except TypeError:
-                    if hasattr(obj, "__slots__"):
-                        # use the __slots__ instead of the vars dict
-                        value = {}
-                        for slot in obj.__slots__:
-                            value[slot] = getattr(obj, slot)
-                        value["__class__"] = self.get_class_name(obj)
+            items = self._class_items(obj)
+            if items is not None:
+                # write the fields as a dict directly, followed by the class name
+                append = out.append
+                serialize = self._serialize
+                key_repr = self._key_repr
+                append("{")
+                for key, value in items:
+                    if type(key) is str:
+                        append(key_repr(key))
+                    else:
+                        if not trusted and type(key) not in _hashable_key_types:
+                            self._check_hashable_type(type(key))
+                        serialize(key, out, level + 1)
+                    append(":")
+                    if type(value) in _repr_types:
+                        append(repr(value))
                     else:
-                        raise TypeError("don't know how to serialize class " +
-                                        str(obj.__class__) + ". Give it vars() or an appropriate __getstate__")
-            self._serialize(value, out, level)
+                        serialize(value, out, level + 1)
+                    append(",")
+                append(self._class_layouts[type(obj)].closers[1 if self.module_in_classname else 0])
+                return
+            value, as_dict = self._class_state(obj)
+            if as_dict:
+                self.ser_builtins_dict(value, out, level)
+            else:
+                self._serialize(value, out, level)
         finally:
-            self.serialized_obj_ids.discard(id(obj))
+            if not trusted:
+                self.serialized_obj_ids.discard(id(obj))
+
+    def _get_class_layout(self, t):
+        try:
+            return self._class_layouts[t]
+        except KeyError:
+            layout = _class_layout(t) if type(self).get_class_name is Serializer.get_class_name else None
+            self._class_layouts[t] = layout
+            return layout
+
+    def _class_items(self, obj):
+        """
+        The (name, value) fields of a class instance, to be written directly as a dict that ends with the
+        class name. Returns None if that's not possible for obj, or if the dict must be sorted, or indented.
+        """
+        if self.indent or self.canonical:
+            return None
+        layout = self._get_class_layout(type(obj))
+        if layout is None:
+            return None
+        if layout.fields is None:
+            state = vars(obj)
+            if "__class__" in state:
+                return None
+            return state.items()
+        return zip(layout.fields, map(getattr, itertools.repeat(obj), layout.fields))
+
+    def _class_state(self, obj):
+        """
+        Determine the value that is serialized in place of the (otherwise unknown) class instance obj.
+        Returns (value, as_dict): if as_dict is true, value must be serialized as a plain dict.
+        """
+        layout = self._get_class_layout(type(obj))
+        if layout is not None:
+            if layout.fields is None:
+                value = dict(vars(obj))
+            else:
+                value = {field: getattr(obj, field) for field in layout.fields}
+            value["__class__"] = layout.class_names[1 if self.module_in_classname else 0]
+            return value, True
+        # note: python 3.11+ object itself now has __getstate__
+        has_own_getstate = (
+            hasattr(type(obj), '__getstate__')
+            and type(obj).__getstate__ is not getattr(object, '__getstate__', None)
+        )
+        if has_own_getstate:
+            value = obj.__getstate__()
+            return value, isinstance(value, dict)
+        try:
+            value = dict(vars(obj))  # make sure we can serialize anything that resembles a dict
+            value["__class__"] = self.get_class_name(obj)
+        except TypeError:
+            if hasattr(obj, "__slots__"):
+                # use the __slots__ instead of the vars dict
+                value = {}
+                for slot in obj.__slots__:
+                    value[slot] = getattr(obj, slot)
+                value["__class__"] = self.get_class_name(obj)
+            else:
+                raise TypeError("don't know how to serialize class " +
+                                str(obj.__class__) + ". Give it vars() or an appropriate __getstate__")
+        return value, True
 
     def get_class_name(self, obj):
         if self.module_in_classname:
             return "%s.%s" % (obj.__class__.__module__, obj.__class__.__name__)
         else:
             return obj.__class__.__name__
+
+    # Functions producing the serialized form of a whole sequence of elements of type t at once,
+    # for the types whose serializer function is a simple conversion to a string or number.
+    _bulk_formatters = {
+        ser_decimal_Decimal: lambda t, seq: map(repr, map(str, seq)),
+        ser_datetime_datetime: lambda t, seq: map(repr, map(t.isoformat, seq)),
+        ser_datetime_date: lambda t, seq: map(repr, map(t.isoformat, seq)),
+        ser_datetime_timedelta: lambda t, seq: map(repr, map(t.total_seconds, seq)),
+        ser_datetime_time: lambda t, seq: map(repr, map(str, seq)),
+        ser_uuid_UUID: lambda t, seq: map(repr, map(str, seq)),
+    }
+
+
+# A frame is this header, followed by the crc32 of the payload if the checksum flag is set, and the payload.
+# The header is: a marker byte (that can't start serpent text), the flags, and the length of the payload.
+_frame_header = struct.Struct(">BBI")
+_frame_checksum = struct.Struct(">I")
+_frame_marker = 0xf5
+_frame_flag_checksum = 1
+
+
+def _frame_header_size(header, max_size):
+    """Check a frame header, returns the size of the header including the checksum, and the payload length."""
+    marker, flags, length = _frame_header.unpack(header)
+    if marker != _frame_marker or flags & ~_frame_flag_checksum:
+        raise ValueError("invalid frame header, the stream is corrupt")
+    if length > max_size:
+        raise ValueError("frame too large: %d bytes (max_size is %d)" % (length, max_size))
+    return _frame_header.size + (_frame_checksum.size if flags else 0), length
+
+
+class FrameWriter(object):
+    """
+    Writes serialized messages as length-prefixed frames to a socket (with sendall) or a file-like object
+    (with write), so that a FrameReader on the other end can tell where each message ends.
+    checksum = include a crc32 checksum of every message, so that the reader detects corruption.
+    serializer = the Serializer used for the messages (default=a new default one). Its settings such as
+                 compression apply to the messages.
+    """
+    def __init__(self, target, checksum=False, serializer=None):
+        self.send = target.sendall if hasattr(target, "sendall") else target.write
+        self.checksum = checksum
+        self.serializer = serializer if serializer is not None else Serializer()
+        self._buffer = bytearray()
+
+    def write(self, obj):
+        """Serialize the object tree and write it as a single frame."""
+        self.write_many((obj,))
+
+    def write_many(self, objs):
+        """Serialize every object tree from an iterable into its own frame, and write all of them in one go."""
+        self.write_frames(self.serializer.serialize_many(objs))
+
+    def write_frames(self, payloads):
+        """Write already serialized messages (bytes-like objects) as frames, all in one go."""
+        buffer = self._buffer
+        flags = _frame_flag_checksum if self.checksum else 0
+        for payload in payloads:
+            buffer += _frame_header.pack(_frame_marker, flags, len(payload))
+            if flags:
+                buffer += _frame_checksum.pack(zlib.crc32(payload))
+            buffer += payload
+        try:
+            if buffer:
+                self.send(buffer)
+        finally:
+            del buffer[:]   # the buffer is kept, to reuse its allocated memory
+
+
+class FrameReader(object):
+    """
+    Reads the frames written by a FrameWriter from a socket (with recv_into) or a file-like object
+    (with readinto or read), and deserializes the messages. It's also an iterator over the messages.
+    The data is received into a buffer that is reused for every frame, and only grows for larger frames.
+    buffer_size = the initial size of the buffer
+    max_size = the maximum size of a message, larger frames are taken to be corrupt (ValueError).
+               It's also the max_decompressed_size for compressed messages.
+    engine, zdict = passed on to loads()
+    """
+    def __init__(self, source, buffer_size=65536, max_size=256 * 1024 * 1024, engine="literal_eval", zdict=None):
+        if engine not in _decoder_engines:
+            raise ValueError("invalid decoder engine: " + repr(engine))
+        if hasattr(source, "recv_into"):
+            self._readinto = source.recv_into
+        elif hasattr(source, "readinto"):
+            self._readinto = source.readinto
+        else:
+            self._read = source.read
+            self._readinto = self._readinto_from_read
+        self.max_size = max_size
+        self.engine = engine
+        self.zdict = zdict
+        self._buffer = bytearray(max(buffer_size, _frame_header.size + _frame_checksum.size))
+        self._start = self._end = 0      # the part of the buffer that holds data not processed yet
+
+    def read(self):
+        """Read the next frame and return the deserialized message. Raises EOFError at the end of the stream."""
+        with self.read_frame() as payload:
+            return loads(payload, self.engine, zdict=self.zdict, max_decompressed_size=self.max_size)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return self.read()
+        except EOFError:
+            raise StopIteration
+
+    def read_frame(self):
+        """
+        Read the next frame and return its payload (the serialized message) as a memoryview on the buffer.
+        It's only valid until the next read, release it before that. Raises EOFError at the end of the stream.
+        """
+        if not self._fill(_frame_header.size):
+            if self._start != self._end:
+                raise ValueError("the stream ends with an incomplete frame")
+            raise EOFError("end of stream")
+        header_size, length = _frame_header_size(self._buffer[self._start:self._start + _frame_header.size], self.max_size)
+        if not self._fill(header_size + length):
+            raise ValueError("the stream ends with an incomplete frame")
+        start = self._start + header_size
+        end = start + length
+        self._start = end
+        payload = memoryview(self._buffer)[start:end]
+        if header_size > _frame_header.size:
+            checksum = _frame_checksum.unpack_from(self._buffer, start - _frame_checksum.size)[0]
+            if zlib.crc32(payload) != checksum:
+                payload.release()
+                raise ValueError("frame checksum mismatch, the stream is corrupt")
+        return payload
+
+    def _fill(self, size):
+        """Receive data until the buffer holds at least size unprocessed bytes. Returns False if the stream ended."""
+        buffer = self._buffer
+        while self._end - self._start < size:
+            if len(buffer) - self._start < size:
+                # move the unprocessed data to the front, and grow the buffer if it's too small for it
+                pending = self._end - self._start
+                buffer[:pending] = buffer[self._start:self._end]
+                self._start, self._end = 0, pending
+                if len(buffer) < size:
+                    buffer.extend(bytes(size - len(buffer)))
+            with memoryview(buffer) as view, view[self._end:] as free:
+                count = self._readinto(free)
+            if not count:
+                return False
+            self._end += count
+        return True
+
+    def _readinto_from_read(self, view):
+        data = self._read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+
+# The index of an archive holds the end offset of every record in its data file.
+_archive_offset = struct.Struct("<Q")
+_archive_key_entry = br": (\d+),\n\Z"
+
+
+def _valid_archive_key(key):
+    """Is it a key that comes back the same (and hashable) when the keys of an archive are loaded?"""
+    if type(key) is tuple:
+        return all(map(_valid_archive_key, key))
+    return type(key) in (str, int)
+
+
+class SerpentArchive(object):
+    """
+    A file of serialized records with random access to them, by position or by key. Every record is stored
+    as a plain serialized document, one after another, so loads() can decode any of them on its own.
+    The end offset of every record is kept in a sidecar index file (path + ".idx", 8 bytes per record),
+    and the keys of the records that have one in another sidecar file (path + ".keys"). The files are
+    memory mapped for reading, so any record is found in constant time, without reading the others.
+    mode = "r" to read, "a" to read and append (the files are created if needed), "w" to create a new archive
+    serializer = the Serializer for the records that are appended (default=a new default one)
+    engine, zdict = passed on to loads() (zdict defaults to the serializer's)
+    Appended records can be read right away, flush() or close() makes sure they're written to the files.
+    Records that weren't completely written (because of a crash) are dropped when the archive is opened.
+    """
+    def __init__(self, path, mode="r", serializer=None, engine="literal_eval", zdict=None):
+        if mode not in ("r", "a", "w"):
+            raise ValueError("invalid archive mode: " + repr(mode))
+        if engine not in _decoder_engines:
+            raise ValueError("invalid decoder engine: " + repr(engine))
+        self.path = path
+        self.mode = mode
+        self.serializer = serializer if serializer is not None else Serializer()
+        self.engine = engine
+        self.zdict = zdict if zdict is not None else self.serializer.zdict
+        self._key_serializer = Serializer()
+        self._data_map = self._index_map = None
+        self._mapped = 0        # the number of records that the memory maps cover
+        self._keys = None       # key -> position, loaded when it's first needed
+        file_mode = {"r": "rb", "a": "a+b", "w": "w+b"}[mode]
+        self._data = open(path, file_mode)
+        self._index = self._key_file = None
+        try:
+            self._index = open(path + ".idx", file_mode)
+            if mode != "r" or os.path.exists(path + ".keys"):
+                self._key_file = open(path + ".keys", file_mode)
+        except OSError:
+            for file in (self._data, self._index):
+                if file is not None:
+                    file.close()
+            raise
+        size = os.fstat(self._data.fileno()).st_size
+        count = os.fstat(self._index.fileno()).st_size // _archive_offset.size
+        while count and self._read_end(count - 1) > size:
+            count -= 1
+        self._count = count
+        self._size = self._read_end(count - 1) if count else 0
+        if mode != "r":
+            self._index.truncate(count * _archive_offset.size)
+            self._data.truncate(self._size)
+            self._trim_keys()
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getitem__(self, position):
+        """Read the record at a position, or a list of records for a slice of positions."""
+        if isinstance(position, slice):
+            return self.read_many(range(*position.indices(self._count)))
+        return self.read(position)
+
+    def __iter__(self):
+        """Iterate over all records, in order (including the ones that are appended meanwhile)."""
+        position = 0
+        while position < self._count:
+            yield self.read(position)
+            position += 1
+
+    def append(self, obj, key=None):
+        """Append a record, with an optional key (str, int, or a tuple of those) to look it up by. Returns its position."""
+        return self.extend((obj,), (key,))[0]
+
+    def extend(self, objs, keys=None):
+        """
+        Append the records from an iterable, serialized as a batch, which is a lot faster than one by one.
+        keys = an iterable with the key (or None) of every record, if they have one. Returns the range of
+        their positions. A key that was used before refers to the new record from then on.
+        """
+        self._check_open()
+        if self.mode == "r":
+            raise ValueError("the archive is opened for reading only")
+        buffer = bytearray()
+        spans = self.serializer.serialize_many(objs, buffer)
+        first = self._count
+        entries = []
+        if keys is not None:
+            keys = list(keys)
+            if len(keys) != len(spans):
+                raise ValueError("the number of keys doesn't match the number of records")
+            header_size = len(self._key_serializer.header)
+            for position, key in enumerate(keys, first):
+                if key is not None:
+                    if not _valid_archive_key(key):
+                        raise TypeError("archive keys must be str, int or tuples of those")
+                    entries.append(b"%s: %d,\n" % (self._key_serializer.serialize(key)[header_size:], position))
+        self._data.write(buffer)
+        self._index.write(struct.pack("<%dQ" % len(spans), *(self._size + end for _, end in spans)))
+        if entries:
+            self._key_file.write(b"".join(entries))
+            if self._keys is not None:
+                self._keys.update((key, position) for position, key in enumerate(keys, first) if key is not None)
+        self._size += len(buffer)
+        self._count += len(spans)
+        return range(first, self._count)
+
+    def raw(self, position):
+        """The serialized bytes of the record at a position."""
+        start, end = self._span(position)
+        return self._data_map[start:end]
+
+    def read(self, position):
+        """Read the record at a position (a negative one counts from the end)."""
+        start, end = self._span(position)
+        with memoryview(self._data_map) as view, view[start:end] as record:
+            return loads(record, self.engine, zdict=self.zdict)
+
+    def read_many(self, positions):
+        """Read the records at the positions from an iterable, returns a list of them."""
+        spans = [self._span(position) for position in positions]
+        with memoryview(self._data_map) as view:
+            records = []
+            for start, end in spans:
+                with view[start:end] as record:
+                    records.append(loads(record, self.engine, zdict=self.zdict))
+            return records
+
+    def position(self, key):
+        """The position of the record with the key. Raises KeyError if there is none."""
+        return self._key_map()[key]
+
+    def read_key(self, key):
+        """Read the record with the key. Raises KeyError if there is none."""
+        return self.read(self._key_map()[key])
+
+    def keys(self):
+        """The keys of the records that have one."""
+        return self._key_map().keys()
+
+    def flush(self):
+        """Write the appended records and their index entries to the files."""
+        if self.mode != "r" and self._data is not None:
+            self._data.flush()
+            self._index.flush()
+            self._key_file.flush()
+
+    def close(self):
+        if self._data is None:
+            return
+        try:
+            self.flush()
+        finally:
+            for mapped in (self._data_map, self._index_map):
+                if mapped is not None:
+                    mapped.close()
+            for file in (self._data, self._index, self._key_file):
+                if file is not None:
+                    file.close()
+            self._data = self._data_map = self._index_map = None
+
+    def _check_open(self):
+        if self._data is None:
+            raise ValueError("the archive is closed")
+
+    def _span(self, position):
+        """The (start, end) offsets of the record at a position in the data file."""
+        self._check_open()
+        if position < 0:
+            position += self._count
+        if not 0 <= position < self._count:
+            raise IndexError("archive position out of range")
+        if position >= self._mapped:
+            self._remap()
+        if position:
+            return _archive_offset.unpack_from(self._index_map, (position - 1) * _archive_offset.size)[0], \
+                _archive_offset.unpack_from(self._index_map, position * _archive_offset.size)[0]
+        return 0, _archive_offset.unpack_from(self._index_map, 0)[0]
+
+    def _remap(self):
+        """Map the files again, to cover the records that were appended since they were mapped."""
+        self.flush()
+        for mapped in (self._data_map, self._index_map):
+            if mapped is not None:
+                mapped.close()
+        self._data_map = self._index_map = None
+        self._data_map = mmap.mmap(self._data.fileno(), 0, access=mmap.ACCESS_READ)
+        self._index_map = mmap.mmap(self._index.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mapped = self._count
+
+    def _read_end(self, position):
+        self._index.seek(position * _archive_offset.size)
+        return _archive_offset.unpack(self._index.read(_archive_offset.size))[0]
+
+    def _key_map(self):
+        self._check_open()
+        if self._keys is None:
+            keys = {}
+            if self._key_file is not None:
+                self.flush()
+                self._key_file.seek(0)
+                data = self._key_file.read()
+                data = data[:data.rfind(b"\n") + 1]     # an incomplete entry at the end is dropped
+                keys = loads(b"{" + data + b"}", self.engine)
+                if any(position >= self._count for position in keys.values()):
+                    keys = {key: position for key, position in keys.items() if position < self._count}
+            self._keys = keys
+        return self._keys
+
+    def _trim_keys(self):
+        """Remove the key entries of records that weren't completely written, they would refer to new records."""
+        file = self._key_file
+        size = file.seek(0, os.SEEK_END)
+        file.seek(max(0, size - 4096))
+        last_entry = re.search(_archive_key_entry, file.read())
+        if size == 0 or last_entry and int(last_entry.group(1)) < self._count:
+            return
+        file.seek(0)
+        entries = file.read().splitlines(True)
+        entries = [entry for entry in entries
+                   if entry.endswith(b",\n") and int(entry[entry.rindex(b": ") + 2:-2]) < self._count]
+        file.truncate(0)
+        file.write(b"".join(entries))
+        file.flush()
+
+
+async def dump_async(obj, writer, serializer=None, chunk_size=65536, framed=False, checksum=False,
+                     offload_threshold=None, executor=None):
+    """
+    Serialize object tree to an asyncio StreamWriter (or anything with write() and a drain() coroutine).
+    The data is produced and written in chunks of chunk_size bytes. After every chunk it lets the event loop
+    run (drain() alone doesn't suspend until the writer's buffer is full), and it waits for writer.drain()
+    so that a slow reader slows the serialization down.
+    serializer = the Serializer to use (default=a new default one)
+    framed = write a frame, as FrameWriter does, instead of a plain serialized document. The frame starts
+             with the length of the message, so the message is produced as a whole before it's written.
+    checksum = include a crc32 checksum in the frame
+    offload_threshold = once this many bytes have been produced, produce the rest in an executor so that
+                        it doesn't hold up the event loop (default=None, never)
+    executor = the executor for that (default=None, the default executor of the event loop)
+    Returns the number of bytes written (excluding the frame header).
+    """
+    import asyncio
+    if serializer is None:
+        serializer = Serializer()
+    loop = asyncio.get_running_loop()
+    chunks = serializer.iter_serialize(obj, chunk_size)
+    produced = 0
+    pending = []
+    try:
+        while True:
+            if offload_threshold is not None and produced >= offload_threshold:
+                chunk = await loop.run_in_executor(executor, next, chunks, None)
+            else:
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            produced += len(chunk)
+            if framed:
+                pending.append(chunk)
+            else:
+                writer.write(chunk)
+                await writer.drain()
+            await asyncio.sleep(0)
+    finally:
+        chunks.close()
+    if framed:
+        flags = _frame_flag_checksum if checksum else 0
+        header = _frame_header.pack(_frame_marker, flags, produced)
+        if checksum:
+            crc = 0
+            for chunk in pending:
+                crc = zlib.crc32(chunk, crc)
+            header += _frame_checksum.pack(crc)
+        writer.write(header)
+        for chunk in pending:
+            writer.write(chunk)
+            await writer.drain()
+    return produced
+
+
+async def load_async(reader, framed=False, engine="literal_eval", zdict=None, max_size=256 * 1024 * 1024,
+                     offload_threshold=None, executor=None):
+    """
+    Deserialize an object tree from an asyncio StreamReader. Only literals are accepted (safe).
+    framed = read a single frame as written by FrameWriter or dump_async(framed=True), and raise EOFError if
+             the stream ends before it. Otherwise the serialized document is read until the end of the stream.
+    max_size = the maximum size of a frame, larger frames are taken to be corrupt (ValueError).
+               It's also the max_decompressed_size for compressed data, framed or not.
+    offload_threshold = deserialize data of at least this many bytes in an executor, so that
+                        it doesn't hold up the event loop (default=None, never)
+    executor = the executor for that (default=None, the default executor of the event loop). Python's parser
+               holds the GIL while it parses all of the data, so with the literal_eval engine, a thread
+               executor hardly helps. Use the native engine, or a process pool executor.
+    engine, zdict = passed on to loads()
+    """
+    import asyncio
+    if engine not in _decoder_engines:
+        raise ValueError("invalid decoder engine: " + repr(engine))
+    if framed:
+        try:
+            header = await reader.readexactly(_frame_header.size)
+        except asyncio.IncompleteReadError as x:
+            if x.partial:
+                raise ValueError("the stream ends with an incomplete frame") from None
+            raise EOFError("end of stream") from None
+        header_size, length = _frame_header_size(header, max_size)
+        try:
+            checksum = await reader.readexactly(header_size - _frame_header.size)
+            data = await reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            raise ValueError("the stream ends with an incomplete frame") from None
+        if checksum and zlib.crc32(data) != _frame_checksum.unpack(checksum)[0]:
+            raise ValueError("frame checksum mismatch, the stream is corrupt")
+    else:
+        data = await reader.read()
+    if offload_threshold is not None and len(data) >= offload_threshold:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(loads, data, engine, zdict=zdict,
+                                                                      max_decompressed_size=max_size))
+    return loads(data, engine, zdict=zdict, max_decompressed_size=max_size)
@@ -48,7 +48,23 @@ and the .NET assembly can be obtained from Nuget.org (package ``Razorvine.Serpen
 **API**
 
 - ``ser_bytes = serpent.dumps(obj, indent=False, module_in_classname=False):``      # serialize obj tree to bytes
+- ``messages = serpent.dumps_many(objs)``     # serialize many obj trees to a list of bytes, doing the setup only once
 - ``obj = serpent.loads(ser_bytes)``     # deserialize bytes back into object tree
+- ``obj = serpent.loads(ser_bytes, engine="native")``     # same, but with serpent's own (faster) decoder instead of ast.literal_eval
+- ``serpent.dumps(obj, workers=4)``, ``serpent.loads(ser_bytes, workers=4)``
+  # (de)serialize a large top-level container with multiple processes
+- ``for chunk in serpent.iter_dumps(obj, chunk_size=65536):``      # serialize obj tree to a stream of byte chunks
+- ``size = serpent.dump_into(obj, buffer)``      # serialize obj tree straight into a bytearray or file-like object
+- ``serpent.dumps(obj, compress="zlib", zdict=serpent.make_zdict(samples))``
+  # compressed output, ``loads`` recognises it (pass it the same ``zdict``)
+- ``for element in serpent.iterload(file):``      # deserialize the elements of a top-level container one by one
+- ``route = serpent.extract(ser_bytes, ["header", "route"])``      # deserialize just one value, the rest is only scanned
+- ``decoder = serpent.IncrementalDecoder()``, ``objs = decoder.feed(data)``      # push-based decoding of data that arrives in pieces
+- ``serpent.FrameWriter(sock).write_many(objs)``, ``for obj in serpent.FrameReader(sock):``
+  # length-prefixed message frames over a socket or file
+- ``await serpent.dump_async(obj, writer)``, ``obj = await serpent.load_async(reader)``      # asyncio streams, with drain() backpressure
+- ``archive = serpent.SerpentArchive(path, "a")``, ``archive.append(obj, key)``, ``archive[position]``,
+  ``archive.read_key(key)``      # a file of records with random access
 - You can use ``ast.literal_eval`` yourself to deserialize, but ``serpent.deserialize``
   works around a few corner cases. See source for details.
 
@@ -5,6 +5,8 @@ Compares results based on size of the output, and time taken to (de)serialize.
 
 from timeit import default_timer as perf_timer
 import sys
+import os
+import concurrent.futures
 import datetime
 import decimal
 import uuid
@@ -53,6 +55,10 @@ import json
 serializers["json"] = (lambda d: json.dumps(d).encode("utf-8"), lambda d: json.loads(d.decode("utf-8")))
 import serpent
 serializers["serpent"] = (serpent.dumps, serpent.loads)
+serializers["serpent-native"] = (serpent.dumps, lambda d: serpent.loads(d, engine="native"))
+serializers["serpent-memo"] = (lambda d: serpent.dumps(d, memo_size=4096), serpent.loads)
+serializers["serpent-trusted"] = (lambda d: serpent.dumps(d, trusted=True), serpent.loads)
+serializers["serpent-zlib"] = (lambda d: serpent.dumps(d, compress="zlib"), serpent.loads)
 import marshal
 serializers["marshal"] = (marshal.dumps, marshal.loads)
 try:
@@ -167,8 +173,167 @@ def tables_speed(results, what_times, header):
     print()
 
 
+def batch_overhead():
+    print("\nBATCH SERIALIZATION OF SMALL MESSAGES (microseconds per message)\n")
+    messages = [{"method": "ping", "args": (i, "arg"), "kwargs": {}} for i in range(10000)]
+    repeat = 5
+
+    def best_of(func):
+        durations = []
+        for _ in range(repeat):
+            start = perf_timer()
+            func()
+            durations.append(perf_timer() - start)
+        return min(durations) * 1e6 / len(messages)
+
+    serializer = serpent.Serializer()
+    candidates = [
+        ("dumps() per message", lambda: [serpent.dumps(m) for m in messages]),
+        ("serialize() per message", lambda: [serializer.serialize(m) for m in messages]),
+        ("dumps_many()", lambda: serpent.dumps_many(messages)),
+        ("dumps_many() into buffer", lambda: serpent.dumps_many(messages, buffer=bytearray())),
+    ]
+    baseline = None
+    for name, func in candidates:
+        duration = best_of(func)
+        if baseline is None:
+            baseline = duration
+        print(" %-26s %6.2f   (saves %.2f per message)" % (name, duration, baseline - duration))
+    print()
+
+
+def trusted_throughput():
+    print("\nTRUSTED MODE SERIALIZATION THROUGHPUT (MB/sec)\n")
+    records = [{"id": i, "name": "record %d" % i, "tags": ["a", "b", str(i)], "owner": Person("harry", i),
+                "nested": {"values": [i, i * 0.5], "flags": {"x", "y"}}} for i in range(20000)]
+    size = len(serpent.dumps(records))
+    repeat = 5
+    for engine in serpent.Serializer.engines:
+        durations = {}
+        for trusted in (False, True):
+            best = None
+            for _ in range(repeat):
+                start = perf_timer()
+                serpent.dumps(records, engine=engine, trusted=trusted)
+                duration = perf_timer() - start
+                best = duration if best is None else min(best, duration)
+            durations[trusted] = best
+        print(" %-9s  checked %6.1f   trusted %6.1f   (%+.0f%%)" % (
+            engine, size / durations[False] / 1e6, size / durations[True] / 1e6,
+            (durations[False] / durations[True] - 1) * 100))
+    print()
+
+
+def async_latency():
+    print("\nEVENT LOOP LATENCY WHILE (DE)SERIALIZING A LARGE OBJECT TREE (milliseconds)\n")
+    import asyncio
+    import socket
+    records = [{"id": i, "name": "record %d" % i, "values": [i, i * 0.5, str(i)], "owner": Person("harry", i)}
+               for i in range(100000)]
+    serialized = serpent.dumps(records)
+    processes = concurrent.futures.ProcessPoolExecutor(1)
+    processes.submit(int).result()      # start the worker process before measuring
+
+    async def with_writer(function):
+        # a real StreamWriter over a socket pair, with a task at the other end that reads and discards the data
+        ours, theirs = socket.socketpair()
+        _, writer = await asyncio.open_connection(sock=ours)
+        peer_reader, peer_writer = await asyncio.open_connection(sock=theirs)
+
+        async def discard():
+            while await peer_reader.read(1 << 16):
+                pass
+
+        discarding = asyncio.ensure_future(discard())
+        await function(writer)
+        writer.close()
+        await writer.wait_closed()
+        await discarding
+        peer_writer.close()
+
+    def reader():
+        stream = asyncio.StreamReader()
+        stream.feed_data(serialized)
+        stream.feed_eof()
+        return stream
+
+    async def plain_dumps(writer):
+        writer.write(serpent.dumps(records))
+        await writer.drain()
+
+    async def plain_loads():
+        serpent.loads(await reader().read())
+
+    candidates = [
+        ("dumps() + write()", lambda: with_writer(plain_dumps)),
+        ("dump_async()", lambda: with_writer(lambda writer: serpent.dump_async(records, writer))),
+        ("dump_async(framed)", lambda: with_writer(lambda writer: serpent.dump_async(records, writer, framed=True))),
+        ("dump_async(offload)", lambda: with_writer(lambda writer: serpent.dump_async(records, writer,
+                                                                                       offload_threshold=1 << 20))),
+        ("read() + loads()", plain_loads),
+        ("load_async(offload)", lambda: serpent.load_async(reader(), offload_threshold=1 << 20)),
+        ("load_async(native, offload)", lambda: serpent.load_async(reader(), engine="native", offload_threshold=1 << 20)),
+        ("load_async(process pool)", lambda: serpent.load_async(reader(), offload_threshold=1 << 20, executor=processes)),
+    ]
+
+    async def measure(coroutine_function):
+        delays = []
+        done = False
+
+        async def ticker():
+            while not done:
+                start = perf_timer()
+                await asyncio.sleep(0.001)
+                delays.append(perf_timer() - start - 0.001)
+
+        ticking = asyncio.ensure_future(ticker())
+        await asyncio.sleep(0.01)
+        start = perf_timer()
+        await coroutine_function()
+        duration = perf_timer() - start
+        done = True
+        await ticking
+        return max(delays) * 1000, duration * 1000
+
+    for name, coroutine_function in candidates:
+        worst, duration = asyncio.run(measure(coroutine_function))
+        print(" %-28s worst loop delay %7.1f   total time %7.1f" % (name, worst, duration))
+    processes.shutdown()
+    print()
+
+
+def parallel_scaling():
+    print("\nPARALLEL (DE)SERIALIZATION OF A LARGE LIST (seconds)\n")
+    records = [{"id": uuid.UUID(int=i), "name": "record %d" % i, "created": datetime.datetime(2020, 1, 1, 12, i % 60),
+                "values": [i, i * 0.5, str(i)], "owner": Person("harry", i)} for i in range(200000)]
+    expected = serpent.dumps(records)
+    cpus = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, 4, 8, cpus})
+    expected_records = serpent.loads(expected)
+    baselines = None
+    for workers in worker_counts:
+        start = perf_timer()
+        result = serpent.dumps(records, workers=workers)
+        duration_ser = perf_timer() - start
+        assert result == expected
+        start = perf_timer()
+        result = serpent.loads(expected, workers=workers)
+        duration_deser = perf_timer() - start
+        assert result == expected_records
+        if baselines is None:
+            baselines = duration_ser, duration_deser
+        print(" %2d workers  dumps %6.2f (speedup %.2fx)   loads %6.2f (speedup %.2fx)%s" % (
+            workers, duration_ser, baselines[0] / duration_ser, duration_deser, baselines[1] / duration_deser,
+            "  > cpu count" if workers > cpus else ""))
+    print()
+
+
 if __name__ == "__main__":
     results = run()
     tables_size(results)
     tables_speed(results, "ser-times", "SPEED RESULTS (SERIALIZATION)")
     tables_speed(results, "deser-times", "SPEED RESULTS (DESERIALIZATION)")
+    batch_overhead()
+    trusted_throughput()
+    async_latency()
+    parallel_scaling()
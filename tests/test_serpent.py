@@ -4,13 +4,16 @@ Software license: "MIT software license". See http://opensource.org/licenses/MIT
 """
 import sys
 import ast
+import abc
 import timeit
 import datetime
 import uuid
 import decimal
 import array
 import tempfile
+import io
 import os
+import mmap
 import hashlib
 import traceback
 import threading
@@ -19,8 +22,15 @@ import collections
 import enum
 import attr
 import unittest
+import unittest.mock
+import multiprocessing
+import concurrent.futures
 from collections.abc import KeysView, ValuesView, ItemsView
 import serpent
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 def strip_header(ser):
@@ -72,6 +82,30 @@ class TestDeserialize(unittest.TestCase):
         self.assertEqual("text", serpent.loads(bytes_input))
         self.assertEqual("text", serpent.loads(bytearray_input))
         self.assertEqual("text", serpent.loads(memview_input))
+        self.assertEqual(42, serpent.loads(memoryview(b"'text' 42")[7:]))
+
+    def test_invalid_bytes(self):
+        for data in [b"'te\x00xt'", b"[1, 2\x00]", b"[1, # \x00\n 2]", b"\x00"]:
+            with self.assertRaises(ValueError) as x:
+                serpent.loads(data)
+            self.assertIn("0-bytes", str(x.exception))
+        for data in [b"'te\xffxt'", b"[1, \xe2\x82]", b"# \xff\n42", b"[1, # \xff\n 2]", b"[1] # \xff", b"[1] # \xed\xa0\x80"]:
+            with self.assertRaises(UnicodeDecodeError):
+                serpent.loads(data)
+        self.assertEqual([1, 2], serpent.loads(b"[1, # \xe2\x82\xac \xf0\x9f\x90\x8d\n 2]"))
+
+    def test_mmap(self):
+        with tempfile.TemporaryFile() as file:
+            file.write(b"# comment\n[1, 'two', 3.0]")
+            file.flush()
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                self.assertEqual([1, "two", 3.0], serpent.loads(mapped))
+            file.seek(10)
+            self.assertEqual([1, "two", 3.0], serpent.load(file))
+            self.assertEqual(file.tell(), os.fstat(file.fileno()).st_size)
+            file.seek(0, os.SEEK_END)
+            with self.assertRaises(SyntaxError):
+                serpent.load(file)      # nothing left to read
 
 
 class TestBasics(unittest.TestCase):
@@ -444,6 +478,26 @@ class TestBasics(unittest.TestCase):
         ser = serpent.dumps(memoryview(b"abcdef\xff"), bytes_repr=True)
         data = serpent.loads(ser)
         self.assertEqual(b'abcdef\xff', data)
+        ser = serpent.dumps(memoryview(b"abcdef\xff")[2:], bytes_repr=True)
+        data = serpent.loads(ser)
+        self.assertEqual(b'cdef\xff', data)
+        ser = serpent.dumps(memoryview(array.array('B', b"abc")), bytes_repr=True)
+        data = serpent.loads(ser)
+        self.assertEqual(b'abc', data)
+
+    def test_bytes_adaptive(self):
+        text = b"mostly ascii text\n" * 10
+        binary = bytes(range(256))
+        for value in (text, bytearray(text), memoryview(text), memoryview(b"xx" + text)[2:]):
+            ser = serpent.dumps(value, bytes_repr="adaptive")
+            self.assertEqual(strip_header(serpent.dumps(value, bytes_repr=True)), strip_header(ser))
+            self.assertEqual(text, serpent.loads(ser))
+        for value in (binary, bytearray(binary), memoryview(binary)):
+            ser = serpent.dumps(value, bytes_repr="adaptive")
+            self.assertEqual(strip_header(serpent.dumps(value)), strip_header(ser))
+            self.assertEqual(binary, serpent.tobytes(serpent.loads(ser)))
+        ser = serpent.dumps([b"", b"'", b"\x00"], bytes_repr="adaptive")
+        self.assertEqual([b"", b"'", b"\x00"], serpent.loads(ser))
 
     def test_exception(self):
         x = ZeroDivisionError("wrong")
@@ -503,6 +557,31 @@ class TestBasics(unittest.TestCase):
         data = serpent.loads(ser)
         self.assertEqual({'__class__': 'SlotsClass', 'attr': 1}, data)
 
+    def test_class_layouts(self):
+        class SlotsSubClass(SlotsClass):
+            __slots__ = ("attr", "other")
+
+            def __init__(self):
+                self.attr = 1
+                self.other = [Class1()]
+
+        class OddClass(object):
+            def __init__(self):
+                self.__dict__[42] = "number key"
+                self.__dict__["__class__"] = "bogus"
+
+        class ModuleNamingSerializer(serpent.Serializer):
+            def get_class_name(self, obj):
+                return "renamed." + type(obj).__name__
+
+        for _ in range(2):
+            data = serpent.loads(serpent.dumps(SlotsSubClass()))
+            self.assertEqual({'__class__': 'SlotsSubClass', 'attr': 1, 'other': [{'__class__': 'Class1', 'attr': 1}]}, data)
+            data = serpent.loads(serpent.dumps(OddClass(), module_in_classname=True))
+            self.assertEqual({'__class__': __name__ + '.OddClass', 42: 'number key'}, data)
+            data = serpent.loads(ModuleNamingSerializer().serialize(Class1()))
+            self.assertEqual({'__class__': 'renamed.Class1', 'attr': 1}, data)
+
     def test_class_pprinter(self):
         import pprint
         p = pprint.PrettyPrinter(stream="dummy", width=99)
@@ -617,6 +696,34 @@ class TestBasics(unittest.TestCase):
         values2 = serpent.loads(b"[1e30000,-1e30000]")
         self.assertEqual([float('inf'), float('-inf')], values2)
 
+    def test_scalar_sequences(self):
+        ser = strip_header(serpent.dumps([1.5, float('inf'), 2.25, float('-inf'), float('nan')]))
+        self.assertEqual(b"[1.5,1e30000,2.25,-1e30000,{'__class__':'float','value':'nan'}]", ser)
+        ser = strip_header(serpent.dumps((1, "two", True, None, 2 ** 70)))
+        self.assertEqual(b"(1,'two',True,None,1180591620717411303424)", ser)
+        ser = strip_header(serpent.dumps([1.5, 2.5], indent=True))
+        self.assertEqual(b"[\n  1.5,\n  2.5\n]", ser)
+        ser = strip_header(serpent.dumps({"x": (1, 2)}, indent=True))
+        self.assertEqual(b"{\n  'x': (\n    1,\n    2\n  )\n}", ser)
+        uuids = [uuid.UUID(int=1), uuid.UUID(int=2)]
+        ser = strip_header(serpent.dumps(uuids))
+        self.assertEqual(b"['00000000-0000-0000-0000-000000000001','00000000-0000-0000-0000-000000000002']", ser)
+        dates = [datetime.datetime(2013, 1, 20, 23, 59, 45, 999888), datetime.datetime(2014, 2, 21)]
+        ser = strip_header(serpent.dumps(dates))
+        self.assertEqual(b"['2013-01-20T23:59:45.999888','2014-02-21T00:00:00']", ser)
+        ser = strip_header(serpent.dumps(array.array('d', [1.5, float('inf')])))
+        self.assertEqual(b"[1.5,1e30000]", ser)
+        ser = strip_header(serpent.dumps(array.array('b', [1, 2, 3]), indent=True))
+        self.assertEqual(b"[\n  1,\n  2,\n  3\n]", ser)
+        ser = strip_header(serpent.dumps(array.array('b')))
+        self.assertEqual(b"[]", ser)
+        serpent.register_class(uuid.UUID, lambda obj, serializer, stream, level: serializer._serialize("custom", stream, level))
+        try:
+            ser = strip_header(serpent.dumps(uuids))
+            self.assertEqual(b"['custom','custom']", ser)
+        finally:
+            serpent.unregister_class(uuid.UUID)
+
     def test_float_precision(self):
         # make sure we don't lose precision when converting floats (including scientific notation)
         v = serpent.loads(serpent.dumps(1.2345678987654321))
@@ -897,6 +1004,61 @@ class TestCustomClasses(unittest.TestCase):
         finally:
             serpent.unregister_class(uuid.UUID)
 
+    def testHandlerCache(self):
+        serpent.unregister_class(BaseClass)
+        serpent.unregister_class(SubClass)
+        s = SubClass()
+        x = serpent.loads(serpent.dumps([s, s]))
+        self.assertEqual([{"__class__": "SubClass"}, {"__class__": "SubClass"}], x)
+        self.assertIn(SubClass, serpent._registry_snapshot.handler_cache)
+        try:
+            serpent.register_class(BaseClass, lambda obj, serializer, stream, level: serializer._serialize("base", stream, level))
+            self.assertNotIn(SubClass, serpent._registry_snapshot.handler_cache)
+            self.assertEqual(["base", "base"], serpent.loads(serpent.dumps([s, s])))
+        finally:
+            serpent.unregister_class(BaseClass)
+        self.assertNotIn(SubClass, serpent._registry_snapshot.handler_cache)
+        self.assertEqual({"__class__": "SubClass"}, serpent.loads(serpent.dumps(s)))
+
+    def testHandlerCacheAbcRegister(self):
+        class Base(abc.ABC):
+            pass
+
+        class Virtual(object):
+            pass
+        v = Virtual()
+        serpent.register_class(Base, lambda obj, serializer, stream, level: serializer._serialize("base", stream, level))
+        try:
+            for engine in serpent.Serializer.engines:
+                self.assertEqual({"__class__": "Virtual"}, serpent.loads(serpent.dumps(v, engine=engine)))
+            Base.register(Virtual)
+            for engine in serpent.Serializer.engines:
+                self.assertEqual("base", serpent.loads(serpent.dumps(v, engine=engine)))
+                self.assertEqual(["base"], serpent.loads(serpent.Serializer(memo_size=10).serialize([v])))
+        finally:
+            serpent.unregister_class(Base)
+
+    def testRegistrySnapshot(self):
+        class Registered(object):
+            pass
+        snapshot = serpent._registry_snapshot
+        serializer = serpent.Serializer()
+        serializer.serialize([1, 2, 3])
+        self.assertIs(snapshot, serpent._registry_snapshot)
+        serializer._use_registry(snapshot)
+        self.assertIs(snapshot.registry, serializer.special_classes_registry_copy)
+        with self.assertRaises(TypeError):
+            snapshot.registry[Registered] = None
+        try:
+            serpent.register_class(Registered, lambda obj, serializer, stream, level: serializer._serialize("base", stream, level))
+            self.assertEqual(snapshot.version + 1, serpent._registry_snapshot.version)
+            self.assertNotIn(Registered, snapshot.registry)
+            self.assertIn(Registered, serpent._registry_snapshot.registry)
+        finally:
+            serpent.unregister_class(Registered)
+        self.assertEqual(snapshot.version + 2, serpent._registry_snapshot.version)
+        self.assertNotIn(Registered, serpent._registry_snapshot.registry)
+
     def testRegisterOrderPreserving(self):
         serpent._reset_special_classes_registry()
         serpent.register_class(BaseClass, lambda: None)
@@ -972,6 +1134,17 @@ class TestCyclic(unittest.TestCase):
             serpent.dumps(d)
         self.assertEqual("Circular reference detected (class)", str(e.exception))
 
+    def testNestedInstancesOk(self):
+        # the state dicts of the instances are temporary: their ids must not be mistaken for a cycle
+        obj = NestedVars(NestedSlots(NestedVars(NestedSlots(NestedVars(1)))))
+        expected = serpent.loads(serpent.dumps(obj))
+        for options in ({"indent": True}, {"canonical": True}, {"indent": True, "canonical": True}):
+            for engine in serpent.Serializer.engines:
+                self.assertEqual(expected, serpent.loads(serpent.dumps(obj, engine=engine, **options)))
+            stream = io.BytesIO()
+            serpent.dump(obj, stream, **options)
+            self.assertEqual(expected, serpent.loads(stream.getvalue()))
+
     # noinspection PyUnreachableCode
     def testMaxLevel(self):
         ser = serpent.Serializer()
@@ -1007,6 +1180,20 @@ class Cycle(object):
         self.ref = ref
 
 
+class NestedVars(object):
+    def __init__(self, a):
+        self.a = a
+        self.b = [a]
+
+
+class NestedSlots(object):
+    __slots__ = ("x", "y")
+
+    def __init__(self, x):
+        self.x = x
+        self.y = (x,)
+
+
 class RegisterThread(threading.Thread):
     def __init__(self):
         super(RegisterThread, self).__init__()
@@ -1035,9 +1222,9 @@ class SerializationThread(threading.Thread):
                 print(x)
                 break
 
-@unittest.skip
 class TestThreading(unittest.TestCase):
     def testThreadsafeTypeRegistrations(self):
+        self.addCleanup(serpent._reset_special_classes_registry)
         reg = RegisterThread()
         ser = SerializationThread()
         reg.daemon = ser.daemon = True
@@ -1045,6 +1232,8 @@ class TestThreading(unittest.TestCase):
         ser.start()
         time.sleep(1)
         reg.stop_running = ser.stop_running = True
+        reg.join()
+        ser.join()
         self.assertIsNone(ser.error)
 
 
@@ -1156,5 +1345,1344 @@ class SlotsClass(object):
         self.attr = 1
 
 
+class IterativeEngineMixin(object):
+    """Runs the tests of the TestCase it is mixed into with the iterative serializer engine."""
+    def setUp(self):
+        super(IterativeEngineMixin, self).setUp()
+        dumps = serpent.dumps
+
+        def iterative_dumps(*args, **kwargs):
+            kwargs.setdefault("engine", "iterative")
+            return dumps(*args, **kwargs)
+
+        patcher = unittest.mock.patch("serpent.dumps", iterative_dumps)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestBasicsIterative(IterativeEngineMixin, TestBasics):
+    pass
+
+
+class TestIndentIterative(IterativeEngineMixin, TestIndent):
+    pass
+
+
+class TestInterceptClassIterative(IterativeEngineMixin, TestInterceptClass):
+    pass
+
+
+class TestCustomClassesIterative(IterativeEngineMixin, TestCustomClasses):
+    pass
+
+
+class TestPyro4Iterative(IterativeEngineMixin, TestPyro4):
+    pass
+
+
+class TestCollectionsIterative(IterativeEngineMixin, TestCollections):
+    pass
+
+
+class DataclassesTestsIterative(IterativeEngineMixin, DataclassesTests):
+    pass
+
+
+class TestCyclicIterative(IterativeEngineMixin, TestCyclic):
+    def testMaxLevel(self):
+        # the iterative engine has no nesting limit
+        ser = serpent.Serializer(engine="iterative")
+        ser.maximum_level = 3
+        depth = sys.getrecursionlimit() * 2
+        array = arr = []
+        for level in range(depth):
+            arr2 = []
+            arr.append({"level": level, "nested": arr2})
+            arr = arr2
+        data = ser.serialize(array)
+        self.assertTrue(data.endswith(b"[]" + b"}]" * depth))
+
+
+class CountingState(object):
+    count = 0
+
+    def __getstate__(self):
+        CountingState.count += 1
+        return {"number": CountingState.count}
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.data = {
+            "list": [[x * x, "list", [300, 400, [500, 600, [x * x]]]] for x in range(200)],
+            "dict": {str(i * i): {str(1000 + j): chr(j + 65) for j in range(5)} for i in range(100)},
+            "unicode": u"abcdefghijklmnopqrstuvwxyz\u20ac\u20ac\u20ac\u20ac\u20ac" * 20,
+            "class": [Class1() for _ in range(100)],
+            "tuple": (1,)
+        }
+
+    def testChunks(self):
+        for indent in (False, True):
+            expected = serpent.dumps(self.data, indent=indent)
+            for chunk_size in (1, 7, 1000, 100000):
+                chunks = list(serpent.iter_dumps(self.data, indent=indent, chunk_size=chunk_size))
+                self.assertEqual(expected, b"".join(chunks))
+                self.assertTrue(all(len(chunk) == chunk_size for chunk in chunks[:-1]))
+                self.assertTrue(0 < len(chunks[-1]) <= chunk_size)
+        self.assertEqual([serpent.dumps(None)], list(serpent.iter_dumps(None)))
+        with self.assertRaises(ValueError):
+            list(serpent.iter_dumps(self.data, chunk_size=0))
+
+    def testIncremental(self):
+        CountingState.count = 0
+        chunks = serpent.iter_dumps([CountingState() for _ in range(10000)], chunk_size=1000)
+        first = next(chunks)
+        self.assertEqual(1000, len(first))
+        self.assertLess(CountingState.count, 1000)
+        chunks.close()
+
+    def testLargeSequences(self):
+        # large sequences of simple elements are written in bulk, but in batches when streaming
+        import tracemalloc
+        sequences = [list(range(5000)), tuple(x * 0.5 for x in range(5000)) + (float("nan"),), [uuid.UUID(int=1)] * 3000,
+                     array.array("i", range(5000)), array.array("d", [1.5, float("inf")] * 3000), array.array("u", "text")]
+        for indent in (False, True):
+            for sequence in sequences:
+                expected = serpent.dumps(sequence, indent=indent)
+                for chunk_size in (16, 65536):
+                    self.assertEqual(expected, b"".join(serpent.iter_dumps(sequence, indent=indent, chunk_size=chunk_size)))
+        for sequence in (list(range(1000000)), array.array("d", range(1000000))):
+            tracemalloc.start()
+            try:
+                chunks = serpent.iter_dumps(sequence)
+                next(chunks)
+                chunks.close()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            self.assertLess(peak, 1000000)     # the whole output would be 7 Mb or more
+
+    def testDump(self):
+        for indent in (False, True):
+            outf = io.BytesIO()
+            serpent.dump(self.data, outf, indent=indent, chunk_size=100)
+            self.assertEqual(serpent.dumps(self.data, indent=indent), outf.getvalue())
+
+    def testDumpInto(self):
+        for indent in (False, True):
+            expected = serpent.dumps(self.data, indent=indent)
+            buffer = bytearray(b"prefix")
+            self.assertEqual(len(expected), serpent.dump_into(self.data, buffer, indent=indent, chunk_size=100))
+            self.assertEqual(b"prefix" + expected, buffer)
+            outf = io.BytesIO()
+            self.assertEqual(len(expected), serpent.dump_into(self.data, outf, indent=indent))
+            self.assertEqual(expected, outf.getvalue())
+        with self.assertRaises(ValueError):
+            serpent.dump_into(self.data, bytearray(), chunk_size=0)
+
+    def testDumpIntoIncremental(self):
+        writes = []
+
+        class Writer(object):
+            def write(self, data):
+                writes.append((len(data), CountingState.count))
+
+        CountingState.count = 0
+        serpent.dump_into([CountingState() for _ in range(10000)], Writer(), chunk_size=1000)
+        self.assertGreater(len(writes), 10)
+        self.assertLess(writes[0][1], 1000)
+        self.assertLess(max(size for size, _ in writes), 10000)
+
+    def testDumpIntoError(self):
+        buffer = bytearray(b"prefix")
+        cycle = [1, 2, 3] * 1000
+        cycle.append(cycle)
+        with self.assertRaises(ValueError):
+            serpent.dump_into(cycle, buffer, chunk_size=100)
+        self.assertEqual(b"prefix", buffer)
+        serializer = serpent.Serializer()
+        with self.assertRaises(ValueError):
+            serializer.serialize_into(cycle, io.BytesIO(), chunk_size=100)
+        buffer = bytearray()
+        serializer.serialize_into(cycle[:3], buffer)
+        self.assertEqual(serializer.serialize(cycle[:3]), buffer)
+
+
+class CountingReader(object):
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+        self.reads = 0
+
+    def read(self, size):
+        self.reads += 1
+        return self.stream.read(size)
+
+
+class TestIterload(unittest.TestCase):
+    def iterload(self, data, chunk_size=65536):
+        return list(serpent.iterload(io.BytesIO(data), chunk_size))
+
+    def testContainers(self):
+        data = [
+            "string with [brackets], {braces}, (parens), 'quotes', \"doublequotes\" # and a comment",
+            u"€\U00022001",
+            b"bytes",
+            {"a": [1, 2, {"b": (3, 4)}], 5: set()},
+            (1,),
+            (),
+            1 + 2j,
+            -1.5,
+            None,
+            Class1(),
+        ]
+        for indent in (False, True):
+            for bytes_repr in (False, True):
+                ser = serpent.dumps(data, indent=indent, bytes_repr=bytes_repr)
+                expected = serpent.loads(ser)
+                for chunk_size in (1, 2, 3, 10, 65536):
+                    self.assertEqual(expected, self.iterload(ser, chunk_size))
+        ser = serpent.dumps(tuple(data), indent=True)
+        self.assertEqual(list(serpent.loads(ser)), self.iterload(ser, 5))
+        ser = serpent.dumps({"a": 1, "b": [2, 3], 4: "four"}, indent=True)
+        self.assertEqual([("a", 1), ("b", [2, 3]), (4, "four")], self.iterload(ser, 3))
+        ser = serpent.dumps({"a", "b"})
+        self.assertEqual({"a", "b"}, set(self.iterload(ser, 3)))
+        for empty in (b"[]", b"()", b"{}", b"# serpent utf-8 python3.2\n[ ]  # comment"):
+            self.assertEqual([], self.iterload(empty, 1))
+
+    def testSyntax(self):
+        ser = b"""# serpent utf-8 python3.2
+[ 1, 2,
+   # some comments here, with a [ bracket
+   3, '''triple 'quoted' string''', "\\"\\\\", 'quote\\' ',   # trailing comma
+]    # more here
+# and here."""
+        expected = serpent.loads(ser)
+        self.assertEqual([1, 2, 3, "triple 'quoted' string", "\"\\", "quote' "], expected)
+        for chunk_size in (1, 2, 65536):
+            self.assertEqual(expected, self.iterload(ser, chunk_size))
+        self.assertEqual([1, 2], self.iterload(b"(1, 2,)"))
+        self.assertEqual([("a", 1)], self.iterload(b"{'a': 1,}"))
+        self.assertEqual([1, u"€"], list(serpent.iterload(io.StringIO(u"[1, '€']"), 1)))
+
+    def testInvalid(self):
+        for data in (b"42", b"'string'", b"(42)", b"[1, 2", b"[1,,2]", b"[1] 2", b"{1, 2: 3}", b"[1)", b"['abc\n']", b"",
+                     b"['contains\x00nullbyte']"):
+            with self.assertRaises(ValueError):
+                self.iterload(data, 1)
+            with self.assertRaises(ValueError):
+                self.iterload(data)
+
+    def testIncremental(self):
+        ser = serpent.dumps(list(range(100000)))
+        reader = CountingReader(ser)
+        elements = serpent.iterload(reader, 1000)
+        self.assertEqual(0, next(elements))
+        self.assertEqual(1, reader.reads)
+        self.assertEqual(list(range(1, 100000)), list(elements))
+
+
+class TestIncrementalDecoder(unittest.TestCase):
+    def decode(self, data, piece_size, documents=False):
+        decoder = serpent.IncrementalDecoder(documents)
+        objects = []
+        for start in range(0, len(data), piece_size):
+            objects.extend(decoder.feed(data[start:start + piece_size]))
+        objects.extend(decoder.close())
+        return objects
+
+    def testElements(self):
+        data = ["string with [brackets], {braces}, (parens), # a comment", "'''", '"""', "\\", "\\'\\\"'", u"€\U00022001",
+                "line\nbreaks\n", "", b"bytes", {"a": [1, (2, 3)], 4: {"''": "\"\""}}, (1,), -1.5, 1 + 2j, None, Class1()]
+        for indent in (False, True):
+            ser = serpent.dumps(data, indent=indent)
+            expected = serpent.loads(ser)
+            for piece_size in (1, 2, 3, 7, 65536):
+                self.assertEqual(expected, self.decode(ser, piece_size))
+            for split in range(len(ser)):
+                decoder = serpent.IncrementalDecoder()
+                self.assertEqual(expected, decoder.feed(ser[:split]) + decoder.feed(ser[split:]) + decoder.close())
+        ser = serpent.dumps({"a": 1, "b": [2, 3]}, indent=True)
+        self.assertEqual([("a", 1), ("b", [2, 3])], self.decode(ser, 1))
+        self.assertEqual([1, u"€"], self.decode(u"[1, '€']", 1))
+
+    def testComplete(self):
+        decoder = serpent.IncrementalDecoder()
+        self.assertEqual([], decoder.feed(b"# serpent utf-8 python3.2\n[1"))
+        self.assertEqual([1], decoder.feed(b", 'two"))
+        self.assertEqual(["two"], decoder.feed(b"', 3"))
+        self.assertEqual([3], decoder.feed(b", [4"))
+        self.assertEqual([[4]], decoder.feed(b"]]"))
+        self.assertEqual([], decoder.close())
+        with self.assertRaises(ValueError):
+            decoder.feed(b"[]")
+
+    def testDocuments(self):
+        values = [{"a": [1, 2]}, 42, "string # with [", [], (1, 2), -1.5, 1 + 2j, None, {"set"}, b"bytes", "last"]
+        ser = b"".join(serpent.dumps(value) for value in values) + b"\n   # trailing comment\n"
+        expected = [serpent.loads(serpent.dumps(value)) for value in values]
+        for piece_size in (1, 3, 65536):
+            self.assertEqual(expected, self.decode(ser, piece_size, documents=True))
+        decoder = serpent.IncrementalDecoder(documents=True)
+        self.assertEqual([{"a": [1, 2]}], decoder.feed(serpent.dumps({"a": [1, 2]})))
+        self.assertEqual([], decoder.feed(serpent.dumps(42)))
+        self.assertEqual([42], decoder.feed(serpent.dumps("x")))
+        self.assertEqual(["x"], decoder.close())
+
+    def testCompressed(self):
+        data = [{"id": i, "name": "item %d" % i} for i in range(100)]
+        for compress in ("zlib", "lzma"):
+            self.assertEqual(data, self.decode(serpent.dumps(data, compress=compress), 5))
+        zdict = serpent.make_zdict([serpent.dumps(data)])
+        decoder = serpent.IncrementalDecoder(zdict=zdict)
+        self.assertEqual(data, decoder.feed(serpent.dumps(data, compress="zlib", zdict=zdict)) + decoder.close())
+
+    def testInvalid(self):
+        for data in (b"42", b"'string'", b"(42)", b"[1, 2", b"[1,,2]", b"[1] 2", b"{1, 2: 3}", b"[1)", b"['abc\n']", b"",
+                     b"['unterminated", b"['''unterminated", b"['contains\x00nullbyte']"):
+            with self.assertRaises(ValueError):
+                self.decode(data, 1)
+            with self.assertRaises(ValueError):
+                self.decode(data, 65536)
+        for data in (b"[1, 2", b"42 'string", b"{", b"[1)"):
+            with self.assertRaises(ValueError):
+                self.decode(data, 1, documents=True)
+        with self.assertRaises(ValueError):
+            serpent.IncrementalDecoder(engine="nope")
+
+
+class TestExtract(unittest.TestCase):
+    def setUp(self):
+        self.data = {
+            "header": {"route": "orders.eu", "id": 7, 8: "eight", (1, 2): "tuple key", "tags": ["a", "b"]},
+            "strings": ["[{(", "'''", '"""', "\\", "# not a comment", "a,b:c", u"€", "line\nbreak"],
+            "tuples": ((1,), (), (1, 2), 1 + 2j),
+            "object": Class1(),
+            "payload": [{"id": i, "values": list(range(i))} for i in range(10)],
+        }
+
+    def testPaths(self):
+        paths = [(), ("header",), ("header", "route"), ("header", 8), ("header", (1, 2)), ("header", "tags", 1),
+                 ("header", "tags", -2), ("strings", 0), ("strings", 3), ("strings", 4), ("strings", -1),
+                 ("tuples", 0, 0), ("tuples", 2, -1), ("tuples", 3), ("object", "__class__"), ("payload", 9, "values", 8),
+                 ("payload", -10, "values")]
+        for indent in (False, True):
+            ser = serpent.dumps(self.data, indent=indent)
+            obj = serpent.loads(ser)
+            for path in paths:
+                expected = obj
+                for key in path:
+                    expected = expected[key]
+                self.assertEqual(expected, serpent.extract(ser, path))
+                self.assertEqual(expected, serpent.extract(memoryview(ser), list(path), engine="native"))
+        ser = b"# comment [\n{ 'a' : # comment ]\n [1, 2,] , 'b': ( 3 ,)}"
+        self.assertEqual(2, serpent.extract(ser, ["a", 1]))
+        self.assertEqual(3, serpent.extract(ser, ["b", -1]))
+        for engine in ("literal_eval", "native"):
+            ser = b"{'a': 1, 'b': 0, 'a': 2, 'b': [3, 4]}"
+            self.assertEqual(serpent.loads(ser)["a"], serpent.extract(ser, ["a"], engine=engine))
+            self.assertEqual(4, serpent.extract(ser, ["b", 1], engine=engine))
+        ser = serpent.dumps(self.data, compress="zlib")
+        self.assertEqual("orders.eu", serpent.extract(ser, ["header", "route"]))
+
+    def testScansOnlyUpToValue(self):
+        ser = serpent.dumps([self.data["header"], self.data["strings"], self.data["payload"]])
+        cut = ser.index(b"# not a comment")
+        self.assertEqual("orders.eu", serpent.extract(ser[:cut], [0, "route"]))
+        with self.assertRaises(ValueError):
+            serpent.extract(ser[:cut], [2])
+        with self.assertRaises(ValueError):
+            serpent.extract(serpent.dumps(self.data)[:cut], ["header", "route"])     # dicts are scanned to the end
+
+    def testErrors(self):
+        ser = serpent.dumps(self.data)
+        for path, error in [(["nope"], KeyError), (["header", 7], KeyError), (["header", "tags", 2], IndexError),
+                            (["header", "tags", -3], IndexError), (["tuples", 1, 0], IndexError),
+                            (["header", "tags", "x"], TypeError), (["header", "route", 0], TypeError),
+                            (["tuples", 3, 0], TypeError), (["header", "id", 0], TypeError)]:
+            with self.assertRaises(error):
+                serpent.extract(ser, path)
+        with self.assertRaises(TypeError):
+            serpent.extract(serpent.dumps({"set": {1, 2}}), ["set", 0])
+        with self.assertRaises(TypeError):
+            serpent.extract(ser, "header")
+        for data in (b"[1, 2", b"[1, [2", b"[1, ['abc", b"[1,,2]", b"[1)", b"['abc\n', 2]", b"{'a': 1: 2}"):
+            with self.assertRaises(ValueError):
+                serpent.extract(data, [1])
+        with self.assertRaises(SyntaxError):
+            serpent.extract(b"[1 2, 3]", [0])
+        with self.assertRaises(ValueError):
+            serpent.extract(ser, ["header"], engine="nope")
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "records")
+        self.records = [{"id": i, "name": u"record %d €" % i, "values": list(range(i % 5))} for i in range(100)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def testReadWrite(self):
+        with serpent.SerpentArchive(self.path, "w") as archive:
+            self.assertEqual(range(0, 50), archive.extend(self.records[:50]))
+            for record in self.records[50:]:
+                archive.append(record)
+            self.assertEqual(100, len(archive))
+            self.assertEqual(self.records[10], archive[10])
+            self.assertEqual(100, archive.append("appended after reading"))
+            self.assertEqual("appended after reading", archive[-1])
+        with serpent.SerpentArchive(self.path) as archive:
+            self.assertEqual(101, len(archive))
+            self.assertEqual(self.records + ["appended after reading"], list(archive))
+            self.assertEqual(self.records[42], archive.read(42))
+            self.assertEqual(self.records[-3], archive[-4])
+            self.assertEqual(self.records[10:20:3], archive[10:20:3])
+            self.assertEqual([self.records[7], self.records[3]], archive.read_many([7, 3]))
+            self.assertEqual(self.records[5], serpent.loads(archive.raw(5)))
+            with self.assertRaises(IndexError):
+                archive.read(101)
+            with self.assertRaises(ValueError):
+                archive.append(1)
+        with open(self.path, "rb") as file:
+            data = file.read()
+        with open(self.path + ".idx", "rb") as file:
+            self.assertEqual(101 * 8, len(file.read()))
+        self.assertEqual(101, data.count(serpent.Serializer.header.encode("utf-8")))
+        with serpent.SerpentArchive(self.path, "w") as archive:
+            self.assertEqual(0, len(archive))
+            self.assertEqual([], list(archive))
+
+    def testKeys(self):
+        with serpent.SerpentArchive(self.path, "w") as archive:
+            archive.extend(self.records, ["key%d" % record["id"] for record in self.records])
+            archive.append("tuple key", key=(1, "a"))
+            archive.append("no key")
+            archive.append("replaced", key="key3")
+            self.assertEqual("tuple key", archive.read_key((1, "a")))
+            for key in (1.5, ("t", [1]), ("t", ("nested", {1})), True):
+                with self.assertRaises(TypeError):
+                    archive.append("invalid key", key=key)
+            self.assertEqual(103, len(archive))
+            with self.assertRaises(ValueError):
+                archive.extend([1, 2], ["only one key"])
+        with serpent.SerpentArchive(self.path, "a", engine="native") as archive:
+            self.assertEqual(self.records[42], archive.read_key("key42"))
+            self.assertEqual(100, archive.position((1, "a")))
+            self.assertEqual("replaced", archive.read_key("key3"))
+            self.assertEqual(101, len(archive.keys()))
+            with self.assertRaises(KeyError):
+                archive.read_key("key100")
+            archive.append("new", key="key100")
+            self.assertEqual("new", archive.read_key("key100"))
+        with serpent.SerpentArchive(self.path) as archive:
+            self.assertEqual(103, archive.position("key100"))
+
+    def testCompressed(self):
+        zdict = serpent.make_zdict([serpent.dumps(record) for record in self.records[:10]])
+        serializer = serpent.Serializer(compress="zlib", zdict=zdict)
+        with serpent.SerpentArchive(self.path, "w", serializer=serializer) as archive:
+            archive.extend(self.records)
+            self.assertEqual(self.records[5], archive[5])
+        with serpent.SerpentArchive(self.path) as archive:
+            with self.assertRaises(ValueError):
+                archive.read(0)    # without the preset dictionary
+        with serpent.SerpentArchive(self.path, zdict=zdict) as archive:
+            self.assertEqual(self.records, list(archive))
+            self.assertEqual(self.records[:3], archive.read_many(range(3)))
+        serializer = serpent.Serializer(compress="zlib")
+        with serpent.SerpentArchive(self.path, "w", serializer=serializer) as archive:
+            archive.extend(self.records)
+        with serpent.SerpentArchive(self.path) as archive:
+            self.assertEqual(self.records, list(archive))
+            self.assertEqual(self.records[:3], archive.read_many(range(3)))
+
+    def testIncompleteWrites(self):
+        with serpent.SerpentArchive(self.path, "w") as archive:
+            archive.extend(self.records[:10], ["key%d" % i for i in range(10)])
+        # what a crash could leave behind: part of a record, index entries beyond the data, key entries without a record
+        with open(self.path, "ab") as file:
+            file.write(b"# serpent utf-8 python3.2\n{'incompl")
+        with open(self.path + ".idx", "ab") as file:
+            file.write(b"\xff" * 12)
+        with open(self.path + ".keys", "ab") as file:
+            file.write(b"'key10': 10,\n'key11': 11,\n'key")
+        with serpent.SerpentArchive(self.path) as archive:
+            self.assertEqual(10, len(archive))
+            self.assertEqual(["key%d" % i for i in range(10)], sorted(archive.keys()))
+        with serpent.SerpentArchive(self.path, "a") as archive:
+            self.assertEqual(10, len(archive))
+            archive.append("new")
+        with serpent.SerpentArchive(self.path) as archive:
+            self.assertEqual(self.records[:10] + ["new"], list(archive))
+            self.assertNotIn("key10", archive.keys())
+
+    def testInvalid(self):
+        with self.assertRaises(ValueError):
+            serpent.SerpentArchive(self.path, "x")
+        with self.assertRaises(OSError):
+            serpent.SerpentArchive(self.path)
+        archive = serpent.SerpentArchive(self.path, "w")
+        archive.close()
+        archive.close()
+        with self.assertRaises(ValueError):
+            archive.read(0)
+
+
+class TestEngines(unittest.TestCase):
+    def testInvalidEngine(self):
+        with self.assertRaises(ValueError):
+            serpent.Serializer(engine="nope")
+
+    def testIdenticalOutput(self):
+        Point = collections.namedtuple("Point", ["x", "y"])
+
+        class Color(enum.Enum):
+            RED = 1
+
+        data = {
+            "numbers": [1, 2.5, float("inf"), float("nan"), 3 + 4j, 2 ** 100, decimal.Decimal("1.5"), True, None],
+            "strings": ("abc", "\u20ac", b"bytes", bytearray(b"bytearray")),
+            "single": (1,),
+            "empty": [[], (), {}, set(), frozenset()],
+            "sets": ({1, 2, 3}, frozenset({"a", "b"})),
+            "nested": {"a": [1, {"b": (2, [3, {4, 5}])}], 99: {(1, 2): "tuplekey"}},
+            "classes": [Class1(), Class2(), SlotsClass(), Cycle(), ZeroDivisionError("wrong", 42)],
+            "special": [Point(1, 2), Color.RED, collections.OrderedDict(a=1), {"a": 1}.keys(), collections.deque([1])],
+            "misc": [uuid.UUID(int=1), datetime.datetime(2020, 1, 2, 3, 4, 5), datetime.timedelta(seconds=5),
+                     array.array('i', [1, 2]), array.array('u', "unicode")]
+        }
+        for indent in (False, True):
+            for bytes_repr in (False, True):
+                recursive = serpent.dumps(data, indent=indent, bytes_repr=bytes_repr)
+                iterative = serpent.dumps(data, indent=indent, bytes_repr=bytes_repr, engine="iterative")
+                self.assertEqual(recursive, iterative)
+
+
+class NativeDecoderMixin(object):
+    """Runs the tests of the TestCase it is mixed into with the native decoder engine."""
+    def setUp(self):
+        super(NativeDecoderMixin, self).setUp()
+        loads = serpent.loads
+
+        def native_loads(serialized_bytes, engine="native", *args, **kwargs):
+            return loads(serialized_bytes, engine, *args, **kwargs)
+
+        patcher = unittest.mock.patch("serpent.loads", native_loads)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestDeserializeNative(NativeDecoderMixin, TestDeserialize):
+    pass
+
+
+class TestBasicsNative(NativeDecoderMixin, TestBasics):
+    pass
+
+
+class TestNativeDecoder(unittest.TestCase):
+    def literal_eval_result(self, text):
+        try:
+            return ast.literal_eval(text)
+        except Exception as x:
+            return type(x)
+
+    def native_result(self, text):
+        try:
+            return serpent.loads(text.encode("utf-8"), engine="native")
+        except Exception as x:
+            return type(x)
+
+    def assertSameResult(self, text):
+        expected = self.literal_eval_result(text)
+        result = self.native_result(text)
+        self.assertEqual(repr(expected), repr(result), text)
+        self.assertEqual(type(expected), type(result), text)
+
+    def testInvalidEngine(self):
+        with self.assertRaises(ValueError):
+            serpent.loads(b"42", engine="nope")
+
+    def testSerializedData(self):
+        data = {
+            "numbers": [0, -1, 2 ** 100, -2 ** 100, 1.5, -0.0, 1e-300, float("inf"), float("-inf"), float("nan"),
+                        3 + 4j, -3 - 4j, complex(float("inf"), -1), decimal.Decimal("1.5"), True, False, None],
+            "strings": ["", "abc", "€", "'\"\\\n\t\x01\x7f\xff", "\U0001F600", "\ud800", b"bytes", bytearray(b"\x00\xff")],
+            "empty": [[], (), {}, set(), frozenset(), ""],
+            "single": (1,),
+            "sets": {1, 2, "three", (4, 5)},
+            "nested": {"a": [1, {"b": (2, [3, {4, 5}])}], 99: {(1, 2): "tuplekey"}},
+            "classes": [Class1(), Class2(), SlotsClass(), ZeroDivisionError("wrong", 42)],
+            "misc": [uuid.UUID(int=1), datetime.datetime(2020, 1, 2, 3, 4, 5), datetime.timedelta(seconds=5)]
+        }
+        for indent in (False, True):
+            for bytes_repr in (False, True):
+                ser = serpent.dumps(data, indent=indent, bytes_repr=bytes_repr)
+                text = ser.decode("utf-8")
+                self.assertEqual(repr(ast.literal_eval(text)), repr(serpent._decode_native(text)))
+
+    def testLiterals(self):
+        for text in ["1", "-1", "+1", "00", "1_000", "0x_1f", "0o17", "0b101", "1.", ".5", "1.e5", "1E-5", "2j", "1.5J",
+                     "1+2j", "-1-2j", "(1+2j)", "-0.0-0j", "1e30000", "-1e30000", "(1e30000-1e30000j)",
+                     "True", "False", "None", "set()", "set( )", "()", "(1,)", "(1)", "((1))", "(1, 2,)", "[]", "[1,]",
+                     "{}", "{1,}", "{1: 2,}", "{1: 2, 1: 3}", "{1: 'a', True: 'b'}", "{1, True}",
+                     "'a' 'b'", "'a' r'\\n'", "b'a' rb'\\n'", "u'\\n'", "'''a\nb'''", "''''''", "'a\\\nb'",
+                     r"'\x41\101€\U0001F600\N{EURO SIGN}'", r"b'\x41\101\n'", "'€'",
+                     "  1", "\t1", "1  ", "1 \n", "# comment\n1", "1 # comment", "[1, # comment\n 2]", "[1,\r\n2]\r\n"]:
+            self.assertSameResult(text)
+
+    def testInvalid(self):
+        for text in ["", "   ", "# comment", "x", "1 2", "1;", "--1", "-(1)", "(1)+(2j)", "1j+2", "1 + -2j", "1+2", "1+2j+3j",
+                     "-True", "010", "1__0", "0b12", "1.real", "1 if 1 else 2", "(,)", "[,]", "[1,,]", "[1", "[1]]", "(1]",
+                     "{1:}", "{:1}", "{1: 2, 3}", "{1, 2: 3}", "set(1)", "frozenset()", "b'a' 'b'", "b'€'", "f'x'",
+                     "''''", "'''a''''", r"'\x4'", r"'\N{NOPE}'", r"'\U00110000'", "{[1]: 2}", "{[1], 2}", "[\\\n1]",
+                     "1\n+2j", "'a'\n'b'", "\n 1", "# comment\n  1", "1\n  ", "[1]\n\t", "0" * 5000 + "1", "1" * 5000]:
+            self.assertSameResult(text)
+
+    def testDeeplyNested(self):
+        text = "[" * 100000 + "]" * 100000
+        with self.assertRaises(Exception) as x:
+            ast.literal_eval(text)
+        with self.assertRaises(type(x.exception)):
+            serpent.loads(text.encode("utf-8"), engine="native")
+
+    def testLoadEngines(self):
+        with tempfile.TemporaryFile() as file:
+            serpent.dump(list(range(10)), file)
+            file.seek(0)
+            self.assertEqual(list(range(10)), serpent.load(file, engine="native"))
+            file.seek(0)
+            self.assertEqual(list(range(10)), list(serpent.iterload(file, engine="native")))
+
+
+class CountingUUID(uuid.UUID):
+    conversions = 0
+
+    def __str__(self):
+        CountingUUID.conversions += 1
+        return super(CountingUUID, self).__str__()
+
+
+class TestMemo(unittest.TestCase):
+    def setUp(self):
+        CountingUUID.conversions = 0
+
+    def testIdenticalOutput(self):
+        class Color(enum.Enum):
+            RED = 1
+            BLUE = (1, 2)
+
+        guid = uuid.uuid4()
+        amount = decimal.Decimal("1.50")
+        when = datetime.datetime(2020, 1, 2, 3, 4, 5)
+        data = [{"id": guid, "amount": amount, "when": when, "color": Color.RED, "other": Color.BLUE,
+                 "nested": {"id": guid, "n": i}} for i in range(20)]
+        data.append([guid, guid, amount, decimal.Decimal("1.5"), when, when.date(), Color.BLUE, Color.BLUE])
+        for indent in (False, True):
+            for engine in serpent.Serializer.engines:
+                expected = serpent.dumps(data, indent=indent, engine=engine)
+                for memo_size in (1, 2, 1000):
+                    self.assertEqual(expected, serpent.dumps(data, indent=indent, engine=engine, memo_size=memo_size))
+                self.assertEqual(expected, b"".join(serpent.iter_dumps(data, indent=indent, chunk_size=10, memo_size=1000)))
+
+    def testReuse(self):
+        guid = CountingUUID(int=1)
+        records = [{"id": guid} for _ in range(100)]
+        serpent.dumps(records)
+        self.assertEqual(100, CountingUUID.conversions)
+        for engine in serpent.Serializer.engines:
+            CountingUUID.conversions = 0
+            serpent.dumps(records, engine=engine, memo_size=10)
+            self.assertEqual(1, CountingUUID.conversions)
+            CountingUUID.conversions = 0
+            serpent.dumps([guid] * 100, engine=engine, memo_size=10)
+            self.assertEqual(1, CountingUUID.conversions)
+
+    def testSizeLimit(self):
+        guids = [CountingUUID(int=1), CountingUUID(int=2)]
+        records = [{"id": guids[i % 2]} for i in range(100)]
+        serpent.dumps(records, memo_size=1)
+        self.assertEqual(1 + 50, CountingUUID.conversions)
+
+    def testMemoPerCall(self):
+        serializer = serpent.Serializer(memo_size=10)
+        guid = CountingUUID(int=1)
+        serializer.serialize({"id": guid})
+        serializer.serialize({"id": guid})
+        self.assertEqual(2, CountingUUID.conversions)
+        self.assertEqual({}, serializer._memo)
+
+    def testMemoPerMessage(self):
+        guid = CountingUUID(int=1)
+        for engine in serpent.Serializer.engines:
+            CountingUUID.conversions = 0
+            serpent.dumps_many([[guid], [guid], [guid]], engine=engine, memo_size=10)
+            self.assertEqual(3, CountingUUID.conversions)
+            CountingUUID.conversions = 0
+            serializer = serpent.Serializer(memo_size=10)
+            serializer.serialize_many([{"id": guid}, {"id": guid}, {"id": guid}])
+            self.assertEqual(3, CountingUUID.conversions)
+
+
+class TestDumpsMany(unittest.TestCase):
+    def testIdenticalOutput(self):
+        shared = [1, 2, 3]
+        messages = [{"id": uuid.UUID(int=i), "shared": shared, "text": "message %d \u20ac" % i} for i in range(20)]
+        messages += [42, "text", b"bytes", shared, shared, Cycle(), [], {}]
+        for indent in (False, True):
+            for engine in serpent.Serializer.engines:
+                for memo_size in (0, 10):
+                    expected = [serpent.dumps(m, indent=indent, engine=engine, memo_size=memo_size) for m in messages]
+                    self.assertEqual(expected, serpent.dumps_many(messages, indent=indent, engine=engine, memo_size=memo_size))
+                    self.assertEqual(expected, serpent.dumps_many(iter(messages), indent=indent, engine=engine, memo_size=memo_size))
+        self.assertEqual([], serpent.dumps_many([]))
+
+    def testBuffer(self):
+        messages = ["one", {"two": 2}, "\u20ac" * 3]
+        buffer = bytearray(b"xyz")
+        offsets = serpent.dumps_many(messages, buffer=buffer)
+        self.assertEqual(3, len(offsets))
+        self.assertEqual(3, offsets[0][0])
+        self.assertEqual(len(buffer), offsets[-1][1])
+        for (start, end), message in zip(offsets, messages):
+            self.assertEqual(serpent.dumps(message), buffer[start:end])
+            self.assertEqual(message, serpent.loads(memoryview(buffer)[start:end]))
+
+    def testSerializerReuse(self):
+        serializer = serpent.Serializer(memo_size=10)
+        guid = CountingUUID(int=1)
+        CountingUUID.conversions = 0
+        self.assertEqual(serializer.serialize_many([[guid, guid], [guid]]), serializer.serialize_many([[guid, guid], [guid]]))
+        self.assertEqual(4, CountingUUID.conversions)
+        self.assertEqual(serpent.dumps("x"), serializer.serialize("x"))
+
+    def testErrors(self):
+        cyclic = [1]
+        cyclic.append(cyclic)
+        with self.assertRaises(ValueError):
+            serpent.dumps_many([1, cyclic, 3])
+        serializer = serpent.Serializer()
+        with self.assertRaises(ValueError):
+            serializer.serialize_many([cyclic])
+        self.assertEqual([serpent.dumps([1, 2])], serializer.serialize_many([[1, 2]]))
+
+
+class TestParallel(unittest.TestCase):
+    def setUp(self):
+        # with the spawn start method the registry is pickled, other tests may have left local functions in it
+        serpent._reset_special_classes_registry()
+
+    def parallel_dumps(self, obj, workers=2, mp_context=None, **kwargs):
+        serializer = serpent.Serializer(**kwargs)
+        serializer.parallel_threshold = 10
+        return serializer.serialize_parallel(obj, workers, mp_context)
+
+    def testIdenticalOutput(self):
+        records = [{"id": uuid.UUID(int=i), "name": "record \u20ac%d" % i, "values": [i, i * 1.5, None],
+                    "when": datetime.date(2020, 1, 1 + i % 28), "nested": {"set": {i, -i}}} for i in range(50)]
+        data = [records, tuple(records), {"key%d" % i: record for i, record in enumerate(records)},
+                {i: str(i) for i in range(30, 0, -1)}, list(range(100)), [Cycle() for _ in range(20)]]
+        contexts = [None] + [multiprocessing.get_context(method) for method in ("fork", "spawn")
+                             if method in multiprocessing.get_all_start_methods()]
+        for indent in (False, True):
+            for engine in serpent.Serializer.engines:
+                for obj in data:
+                    expected = serpent.dumps(obj, indent=indent, engine=engine)
+                    for context in contexts:
+                        self.assertEqual(expected, self.parallel_dumps(obj, mp_context=context, indent=indent, engine=engine))
+        self.assertEqual(serpent.dumps(records), serpent.dumps(records, workers=2))
+
+    def testDefaultStartMethod(self):
+        context = multiprocessing.get_context()
+        with unittest.mock.patch("multiprocessing.get_context", return_value=context) as get_context:
+            self.assertEqual(serpent.dumps(list(range(20))), self.parallel_dumps(list(range(20))))
+        get_context.assert_called_once_with()
+
+    def testRegisteredClasses(self):
+        serpent.register_class(BaseClass, lambda obj, serializer, stream, level: stream.append("'base'"))
+        try:
+            ser = self.parallel_dumps([SubClass()] * 20)
+            self.assertEqual(["base"] * 20, serpent.loads(ser))
+        finally:
+            serpent.unregister_class(BaseClass)
+
+    def testSerialFallback(self):
+        with unittest.mock.patch("concurrent.futures.ProcessPoolExecutor") as pool:
+            for obj in ([1, 2, 3], list(range(9)), 42, "text", set(range(20)), collections.OrderedDict.fromkeys(range(20))):
+                self.assertEqual(serpent.dumps(obj), self.parallel_dumps(obj))
+            self.assertEqual(serpent.dumps(list(range(20))), self.parallel_dumps(list(range(20)), workers=1))
+            self.assertEqual(serpent.dumps(list(range(20))), serpent.dumps(list(range(20)), workers=2))
+            pool.assert_not_called()
+
+    def testErrors(self):
+        cyclic = [{} for _ in range(20)]
+        cyclic[15]["me"] = cyclic
+        with self.assertRaises(ValueError):
+            self.parallel_dumps(cyclic)
+        for indent in (False, True):
+            with self.assertRaises(TypeError):
+                self.parallel_dumps({uuid.UUID(int=i) if i == 10 else i: i for i in range(20)}, indent=indent)
+
+
+class TestParallelLoads(unittest.TestCase):
+    def setUp(self):
+        patcher = unittest.mock.patch("serpent._parallel_loads_threshold", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertParallel(self, data, parallel=True):
+        with unittest.mock.patch("concurrent.futures.ProcessPoolExecutor", wraps=concurrent.futures.ProcessPoolExecutor) as pool:
+            for engine in ("literal_eval", "native"):
+                expected = serpent.loads(data, engine)
+                result = serpent.loads(data, engine, workers=2)
+                self.assertEqual(expected, result)
+                self.assertIs(type(expected), type(result))
+                if type(expected) is dict:
+                    self.assertEqual(list(expected.items()), list(result.items()))
+            self.assertEqual(parallel, pool.called)
+
+    def testContainers(self):
+        records = [{"id": uuid.UUID(int=i), "name": "record, [%d]" % i, "values": (i, i * 1.5, None, b"\x00")}
+                   for i in range(50)]
+        for indent in (False, True):
+            self.assertParallel(serpent.dumps(records, indent=indent))
+            self.assertParallel(serpent.dumps(tuple(records), indent=indent))
+            self.assertParallel(serpent.dumps(set(range(100)), indent=indent))
+            self.assertParallel(serpent.dumps({"key %d" % i: record for i, record in enumerate(records)}, indent=indent))
+        self.assertParallel(b"# comment, [\n[1, 'a,]', # more }\n  '''x\n]''', \"\\\"\", (2, 3),\n]\n")
+
+    def testDefaultStartMethod(self):
+        spawn = multiprocessing.get_context("spawn")
+        with unittest.mock.patch("multiprocessing.get_context", return_value=spawn) as get_context:
+            self.assertParallel(serpent.dumps([{"id": i, "name": "record %d" % i} for i in range(50)]))
+        get_context.assert_called_with()
+        self.assertParallel(b"{1: 'a', 2: 'b', True: 'c', 3: 'd'}")
+        self.assertParallel(b"{1, 2, True, 1.0, 3}")
+        self.assertParallel(memoryview(b"[1, 2, 3]"))
+
+    def testSerialFallback(self):
+        self.assertParallel(b"42", parallel=False)
+        self.assertParallel(b"'text'", parallel=False)
+        self.assertParallel(b"[1]", parallel=False)
+        self.assertParallel(b"()", parallel=False)
+        self.assertParallel(b"{}", parallel=False)
+        self.assertParallel(b"(1) + 2j", parallel=False)
+        self.assertParallel(b"[1 # comment\n, 2]", parallel=False)
+        self.assertParallel(b"[1, \\\n 2]", parallel=False)
+        with unittest.mock.patch("serpent._parallel_loads_threshold", 100):
+            self.assertParallel(b"[1, 2, 3]", parallel=False)
+
+    def testErrors(self):
+        for data in (b"[1, 2, x]", b"[1, 2, 3", b"[1, 2] 3", b"[1, 2, '\x00']", b"[1, 2, ((((]", b"[1, 2, {[]: 3}]",
+                     b"[1, 2, 3)", b"[1, , 2]", b"[1, # comment\n, 2]", b"[, 1, 2]", b"[1, 2,,]", b"{1: 2, 3}", b"\n [1, 2]", b"[1, 2]\n  ",
+                     b"[1, 2\\, 3]", b"[1, 2, '''x]", b"'x' [1, 2]"):
+            for engine in ("literal_eval", "native"):
+                with self.assertRaises(Exception) as serial:
+                    serpent.loads(data, engine)
+                with self.assertRaises(type(serial.exception)):
+                    serpent.loads(data, engine, workers=2)
+
+
+class TestCanonical(unittest.TestCase):
+    def variants(self, obj):
+        for indent in (False, True):
+            for engine in serpent.Serializer.engines:
+                yield serpent.dumps(obj, indent=indent, engine=engine, canonical=True)
+
+    def testInsertionOrder(self):
+        keys = ["b", 3, "a", 1.5, (2, "x"), (1, 2), False, -7, 2 + 1j, (None, 1)]
+        d1 = {key: i for i, key in enumerate(keys)}
+        d2 = {key: d1[key] for key in reversed(keys)}
+        s1 = set(keys)
+        s2 = set(reversed(keys))
+        for obj1, obj2 in ((d1, d2), (s1, s2), ({"outer": [d1, s1]}, {"outer": [d2, s2]})):
+            self.assertEqual(list(self.variants(obj1)), list(self.variants(obj2)))
+        self.assertEqual(d1, serpent.loads(serpent.dumps(d2, canonical=True)))
+        self.assertNotEqual(serpent.dumps(d1), serpent.dumps(d2))
+
+    def testOrder(self):
+        self.assertEqual(b"{'a':2,'b':1}", strip_header(serpent.dumps({"b": 1, "a": 2}, canonical=True)))
+        self.assertEqual(b"{-1,2,10}", strip_header(serpent.dumps({10, 2, -1}, canonical=True)))
+        # by type first, then by value
+        self.assertEqual(b"{False:0,1.5:0,1:0,2:0,'a':0,(1,2):0,(1,'x'):0}",
+                         strip_header(serpent.dumps({2: 0, "a": 0, (1, 2): 0, 1: 0, 1.5: 0, (1, "x"): 0, False: 0}, canonical=True)))
+        nan = float("nan")
+        self.assertEqual(b"{-1.5,2.5,{'__class__':'float','value':'nan'}}",
+                         strip_header(serpent.dumps({nan, 2.5, -1.5}, canonical=True)))
+
+    def testEnumsAndDecimals(self):
+        class Color(enum.Enum):
+            RED = 2
+            BLUE = 1
+        self.assertEqual(b"{1,2}", strip_header(serpent.dumps({Color.RED, Color.BLUE}, canonical=True)))
+        data = {decimal.Decimal("10"), decimal.Decimal("9"), decimal.Decimal("NaN")}
+        self.assertEqual(b"{'9','10','NaN'}", strip_header(serpent.dumps(data, canonical=True)))
+
+    def testOtherOutput(self):
+        data = {"list": [3, 1, 2], "set": {3, 1, 2}, "tuple": (3, 1, 2), "class": Cycle()}
+        self.assertEqual(serpent.dumps(data, indent=True), serpent.dumps(data, indent=True, canonical=True))
+        self.assertEqual(serpent.loads(serpent.dumps(data)), serpent.loads(serpent.dumps(data, canonical=True)))
+        big = {str(i): i for i in range(30, 0, -1)}
+        serializer = serpent.Serializer(canonical=True)
+        serializer.parallel_threshold = 10
+        self.assertEqual(serpent.dumps(big, canonical=True), serializer.serialize_parallel(big, 2))
+        self.assertEqual(serpent.dumps(big, canonical=True), b"".join(serpent.iter_dumps(big, chunk_size=7, canonical=True)))
+
+
+class TestTrusted(unittest.TestCase):
+    def testIdenticalOutput(self):
+        shared = [1, "two", {"three": 3.0}]
+        something = Something("name", 42)
+        data = {"list": [shared, shared, (shared, {4, 5, (6, 7)})], "class": Cycle(), "something": something,
+                "nested": [[[{"x": [None, b"bytes"]}]]], 8: frozenset(), (9, 10): uuid.UUID(int=11)}
+        for indent in (False, True):
+            for engine in serpent.Serializer.engines:
+                expected = serpent.dumps(data, indent=indent, engine=engine)
+                self.assertEqual(expected, serpent.dumps(data, indent=indent, engine=engine, trusted=True))
+        self.assertEqual(serpent.dumps(data), b"".join(serpent.iter_dumps(data, chunk_size=10, trusted=True)))
+        self.assertEqual(serpent.dumps_many([data, shared]), serpent.dumps_many([data, shared], trusted=True))
+
+    def testCycles(self):
+        lst = [1, 2]
+        lst.append(lst)
+        dct = {"x": 1}
+        dct["d"] = dct
+        obj = Cycle()
+        obj.make_cycle(obj)
+        for data in (lst, dct, obj):
+            for engine in serpent.Serializer.engines:
+                with self.assertRaises(ValueError) as x:
+                    serpent.dumps(data, engine=engine, trusted=True)
+                self.assertIn("too deep", str(x.exception))
+
+    def testMaxLevel(self):
+        array = ["level1", ["level2", ["level3", ["level4"]]]]
+        for engine in serpent.Serializer.engines:
+            ser = serpent.Serializer(engine=engine, trusted=True)
+            ser.maximum_level = 4
+            ser.serialize(array)
+            ser.maximum_level = 2
+            with self.assertRaises(ValueError):
+                ser.serialize(array)
+
+    def testKeysNotChecked(self):
+        data = {uuid.UUID(int=1): 1}
+        with self.assertRaises(TypeError):
+            serpent.dumps(data)
+        for engine in serpent.Serializer.engines:
+            self.assertIn(b"{'00000000-0000-0000-0000-000000000001':1}", serpent.dumps(data, engine=engine, trusted=True))
+
+
+class TestMaxBytes(unittest.TestCase):
+    def testLimit(self):
+        data = {"list": [[x, "item %d" % x, {"x": x * 1.5}] for x in range(500)], "text": u"€" * 1000, "class": Cycle()}
+        for indent in (False, True):
+            for engine in serpent.Serializer.engines:
+                expected = serpent.dumps(data, indent=indent, engine=engine)
+                size = len(expected)
+                self.assertEqual(expected, serpent.dumps(data, indent=indent, engine=engine, max_bytes=size))
+                self.assertEqual([expected], serpent.dumps_many([data], indent=indent, engine=engine, max_bytes=size))
+                with self.assertRaises(serpent.OutputTooLargeError):
+                    serpent.dumps(data, indent=indent, engine=engine, max_bytes=size - 1)
+                with self.assertRaises(serpent.OutputTooLargeError):
+                    serpent.dumps_many([None, data], indent=indent, engine=engine, max_bytes=size - 1)
+            self.assertEqual(expected, b"".join(serpent.iter_dumps(data, indent=indent, chunk_size=100, max_bytes=size)))
+            with self.assertRaises(serpent.OutputTooLargeError):
+                list(serpent.iter_dumps(data, indent=indent, chunk_size=100, max_bytes=size - 1))
+            buffer = bytearray()
+            self.assertEqual(size, serpent.dump_into(data, buffer, indent=indent, max_bytes=size))
+            with self.assertRaises(serpent.OutputTooLargeError):
+                serpent.dump_into(data, buffer, indent=indent, max_bytes=size - 1)
+            self.assertEqual(expected, buffer)
+        self.assertTrue(issubclass(serpent.OutputTooLargeError, ValueError))
+
+    def testEarlyAbort(self):
+        CountingState.count = 0
+        with self.assertRaises(serpent.OutputTooLargeError) as x:
+            serpent.dumps([CountingState() for _ in range(100000)], max_bytes=1000)
+        self.assertEqual("serialized output exceeds max_bytes=1000", str(x.exception))
+        self.assertLess(CountingState.count, 1000)
+        CountingState.count = 0
+        with self.assertRaises(serpent.OutputTooLargeError):
+            serpent.dump_into([CountingState() for _ in range(100000)], bytearray(), max_bytes=1000)
+        self.assertLess(CountingState.count, 1000)
+
+    def testLargeSequence(self):
+        # the elements of large sequences of a simple type are written in bulk, but in batches when there's a limit
+        for data in ([list(range(5000))], tuple(x * 0.5 for x in range(5000)) + (float("inf"),), [uuid.UUID(int=1)] * 5000):
+            for indent in (False, True):
+                expected = serpent.dumps(data, indent=indent)
+                self.assertEqual(expected, serpent.dumps(data, indent=indent, max_bytes=len(expected)))
+                with self.assertRaises(serpent.OutputTooLargeError):
+                    serpent.dumps(data, indent=indent, max_bytes=len(expected) - 1)
+        import tracemalloc
+        data = list(range(1000000))
+        tracemalloc.start()
+        try:
+            with self.assertRaises(serpent.OutputTooLargeError):
+                serpent.dumps(data, max_bytes=100)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 1000000)     # the whole output would be almost 7 Mb
+
+    def testParallel(self):
+        data = ["item %d" % x for x in range(100)]
+        serializer = serpent.Serializer(max_bytes=len(serpent.dumps(data)))
+        serializer.parallel_threshold = 10
+        self.assertEqual(serpent.dumps(data), serializer.serialize_parallel(data, 2))
+        serializer.max_bytes -= 1
+        with self.assertRaises(serpent.OutputTooLargeError):
+            serializer.serialize_parallel(data, 2)
+        serializer.max_bytes = 100
+        with self.assertRaises(serpent.OutputTooLargeError):
+            serializer.serialize_parallel(data, 2)
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.data = {"records": [{"name": "record %d" % i, "values": [i, i * 1.5], "class": Class1()} for i in range(300)],
+                     "unicode": u"€" * 100, "bytes": b"\x00\x01" * 100}
+
+    def testRoundtrip(self):
+        for compress in ("zlib", "lzma"):
+            for indent in (False, True):
+                plain = serpent.dumps(self.data, indent=indent)
+                compressed = serpent.dumps(self.data, indent=indent, compress=compress)
+                self.assertTrue(compressed.startswith(b"\x00serpent\x00"))
+                self.assertLess(len(compressed), len(plain) // 4)
+                self.assertEqual(serpent.loads(plain), serpent.loads(compressed))
+                self.assertEqual(serpent.loads(plain), serpent.loads(compressed, "native"))
+                self.assertEqual(serpent.loads(plain), serpent.loads(memoryview(compressed)))
+                streamed = b"".join(serpent.iter_dumps(self.data, indent=indent, chunk_size=100, compress=compress))
+                self.assertEqual(plain, serpent._decompress(streamed, None, None))
+                buffer = bytearray()
+                serpent.dump_into(self.data, buffer, indent=indent, chunk_size=100, compress=compress)
+                self.assertEqual(plain, serpent._decompress(buffer, None, None))
+                self.assertEqual(list(serpent.loads(plain)["records"]),
+                                 list(serpent.iterload(io.BytesIO(serpent.dumps(serpent.loads(plain)["records"], compress=compress)),
+                                                       chunk_size=5)))
+            messages = serpent.dumps_many([self.data, None], compress=compress)
+            self.assertEqual([serpent.loads(serpent.dumps(self.data)), None], [serpent.loads(m) for m in messages])
+
+    def testMaxDecompressedSize(self):
+        data = ["x" * 100000, "y" * 100000]
+        size = len(serpent.dumps(data))
+        for compress in ("zlib", "lzma"):
+            compressed = serpent.dumps(data, compress=compress)
+            self.assertEqual(data, serpent.loads(compressed, max_decompressed_size=size))
+            self.assertEqual(data, serpent.loads(compressed, max_decompressed_size=None))
+            self.assertEqual(data, list(serpent.iterload(io.BytesIO(compressed), chunk_size=100, max_decompressed_size=size)))
+            loaders = [lambda limit: serpent.loads(compressed, max_decompressed_size=limit),
+                       lambda limit: serpent.load(io.BytesIO(compressed), max_decompressed_size=limit),
+                       lambda limit: serpent.extract(compressed, [1], max_decompressed_size=limit),
+                       lambda limit: list(serpent.iterload(io.BytesIO(compressed), chunk_size=100, max_decompressed_size=limit)),
+                       lambda limit: serpent.IncrementalDecoder(max_decompressed_size=limit).feed(compressed)]
+            for load in loaders:
+                with self.assertRaises(ValueError) as x:
+                    load(size - 1)
+                self.assertIn("max_decompressed_size", str(x.exception))
+            stream = io.BytesIO()
+            serpent.FrameWriter(stream, serializer=serpent.Serializer(compress=compress)).write(data)
+            stream.seek(0)
+            with self.assertRaises(ValueError):
+                serpent.FrameReader(stream, max_size=size - 1).read()
+
+    def testDecompressionBomb(self):
+        import tracemalloc
+        import zlib
+        compressor = zlib.compressobj()
+        chunks = [b"\x00serpent\x00z", compressor.compress(b"'")]
+        chunks += [compressor.compress(b"x" * (1 << 20)) for _ in range(100)]
+        bomb = b"".join(chunks + [compressor.compress(b"'"), compressor.flush()])
+        self.assertLess(len(bomb), 200000)
+        with self.assertRaises(ValueError):
+            serpent.loads(bomb)     # the default limit is 64 Mb
+        tracemalloc.start()
+        try:
+            with self.assertRaises(ValueError):
+                serpent.loads(bomb, max_decompressed_size=1000000)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 3000000)     # it decompresses to 100 Mb
+
+    def testFile(self):
+        with tempfile.TemporaryFile() as outf:
+            serpent.dump(self.data, outf, chunk_size=100, compress="zlib")
+            outf.seek(0)
+            self.assertEqual(serpent.loads(serpent.dumps(self.data)), serpent.load(outf))
+
+    def testZdict(self):
+        samples = serpent.dumps_many([{"name": "sample %d" % i, "class": Class1()} for i in range(20)])
+        zdict = serpent.make_zdict(samples, 1000)
+        self.assertEqual(1000, len(zdict))
+        self.assertIn(b"'__class__':'Class1'", zdict)
+        message = {"name": "message", "class": Class1()}
+        compressed = serpent.dumps(message, compress="zlib", zdict=zdict)
+        self.assertLess(len(compressed), len(serpent.dumps(message, compress="zlib")) // 2)
+        self.assertEqual(serpent.loads(serpent.dumps(message)), serpent.loads(compressed, zdict=zdict))
+        for chunk_size in (1, 4, 1000):
+            self.assertEqual([1, 2, 3], list(serpent.iterload(io.BytesIO(serpent.dumps([1, 2, 3], compress="zlib", zdict=zdict)),
+                                                              chunk_size=chunk_size, zdict=zdict)))
+        with self.assertRaises(ValueError) as x:
+            serpent.loads(compressed)
+        self.assertIn("requires the zdict", str(x.exception))
+        with self.assertRaises(ValueError) as x:
+            serpent.loads(compressed, zdict=b"other")
+        self.assertIn("different zdict", str(x.exception))
+        self.assertEqual(b"", serpent.make_zdict([]))
+
+    def testErrors(self):
+        with self.assertRaises(ValueError):
+            serpent.dumps(1, compress="gzip")
+        with self.assertRaises(ValueError):
+            serpent.dumps(1, compress="lzma", zdict=b"dictionary")
+        with self.assertRaises(ValueError):
+            serpent.dumps(1, zdict=b"dictionary")
+        compressed = serpent.dumps(list(range(100)), compress="zlib")
+        for data in (compressed[:-5], compressed + b"more", compressed[:10] + b"x" * 20, b"\x00serpent\x00?data"):
+            with self.assertRaises(ValueError):
+                serpent.loads(data)
+            with self.assertRaises(ValueError):
+                list(serpent.iterload(io.BytesIO(data)))
+        with self.assertRaises(serpent.OutputTooLargeError):
+            serpent.dumps(list(range(100)), compress="zlib", max_bytes=100)
+
+
+class TestFraming(unittest.TestCase):
+    def setUp(self):
+        self.messages = [{"id": i, "name": "message %d" % i, "data": list(range(i % 50))} for i in range(200)]
+        self.messages.append("x" * 200000)      # larger than the buffer
+
+    def roundtrip(self, checksum, **reader_args):
+        stream = io.BytesIO()
+        writer = serpent.FrameWriter(stream, checksum=checksum)
+        writer.write(self.messages[0])
+        writer.write_many(self.messages[1:])
+        stream.seek(0)
+        return list(serpent.FrameReader(stream, **reader_args))
+
+    def testRoundtrip(self):
+        for checksum in (False, True):
+            self.assertEqual(self.messages, self.roundtrip(checksum))
+            self.assertEqual(self.messages, self.roundtrip(checksum, buffer_size=1, engine="native"))
+
+    def testSocket(self):
+        import socket
+        left, right = socket.socketpair()
+        with left, right:
+            writer = serpent.FrameWriter(left, checksum=True, serializer=serpent.Serializer(compress="zlib"))
+            reader = serpent.FrameReader(right, buffer_size=1000)
+            thread = threading.Thread(target=writer.write_many, args=(self.messages,))
+            thread.start()
+            received = [reader.read() for _ in self.messages]
+            thread.join()
+            left.shutdown(socket.SHUT_WR)
+            self.assertEqual(self.messages, received)
+            with self.assertRaises(EOFError):
+                reader.read()
+
+    def testBatchedWrites(self):
+        writes = []
+
+        class Target(object):
+            def write(self, data):
+                writes.append(bytes(data))
+
+        writer = serpent.FrameWriter(Target())
+        writer.write_many(self.messages)
+        writer.write_frames([serpent.dumps(1), b""])
+        self.assertEqual(2, len(writes))
+        reader = serpent.FrameReader(io.BytesIO(b"".join(writes)))
+        self.assertEqual(self.messages + [1], [reader.read() for _ in range(len(self.messages) + 1)])
+        with reader.read_frame() as payload:
+            self.assertEqual(b"", payload)
+        with self.assertRaises(EOFError):
+            reader.read()
+
+    def testCorruption(self):
+        stream = io.BytesIO()
+        serpent.FrameWriter(stream, checksum=True).write_many(["one", "two"])
+        data = stream.getvalue()
+        reader = serpent.FrameReader(io.BytesIO(data[:-1]))
+        self.assertEqual("one", reader.read())
+        with self.assertRaises(ValueError):
+            reader.read()
+        corrupted = bytearray(data)
+        corrupted[-2] ^= 1
+        reader = serpent.FrameReader(io.BytesIO(corrupted))
+        self.assertEqual("one", reader.read())
+        with self.assertRaises(ValueError) as x:
+            reader.read()
+        self.assertIn("checksum", str(x.exception))
+        with self.assertRaises(ValueError):
+            serpent.FrameReader(io.BytesIO(serpent.dumps("not framed"))).read()
+        with self.assertRaises(ValueError) as x:
+            serpent.FrameReader(io.BytesIO(data), max_size=10).read()
+        self.assertIn("too large", str(x.exception))
+
+
+class CollectingWriter(object):
+    def __init__(self):
+        self.data = bytearray()
+        self.drains = 0
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        self.drains += 1
+
+
+class TestAsync(unittest.TestCase):
+    def setUp(self):
+        self.data = {"records": [{"id": i, "name": "record %d" % i, "class": Class1()} for i in range(2000)]}
+
+    def testDump(self):
+        import asyncio
+        writer = CollectingWriter()
+        size = asyncio.run(serpent.dump_async(self.data, writer, chunk_size=1000))
+        self.assertEqual(serpent.dumps(self.data), writer.data)
+        self.assertEqual(len(writer.data), size)
+        self.assertEqual(-(-size // 1000), writer.drains)
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            writer = CollectingWriter()
+            with unittest.mock.patch.object(executor, "submit", wraps=executor.submit) as submit:
+                asyncio.run(serpent.dump_async(self.data, writer, chunk_size=1000, offload_threshold=5000, executor=executor))
+            self.assertEqual(serpent.dumps(self.data), writer.data)
+            self.assertGreater(submit.call_count, 10)
+
+    def testEventLoopRuns(self):
+        import asyncio
+
+        async def count_ticks(framed):
+            # the writer's drain() doesn't suspend, like a StreamWriter's when its buffer isn't full
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0)
+
+            ticking = asyncio.ensure_future(ticker())
+            await serpent.dump_async(self.data, CollectingWriter(), chunk_size=1000, framed=framed)
+            ticking.cancel()
+            return ticks
+
+        chunks = len(serpent.dumps(self.data)) // 1000
+        for framed in (False, True):
+            self.assertGreaterEqual(asyncio.run(count_ticks(framed)), chunks)
+
+    def testFramed(self):
+        import asyncio
+
+        async def write_frames(writer):
+            serializer = serpent.Serializer(compress="zlib")
+            await serpent.dump_async(self.data, writer, serializer, chunk_size=1000, framed=True, checksum=True)
+            await serpent.dump_async("second", writer, framed=True)
+
+        writer = CollectingWriter()
+        asyncio.run(write_frames(writer))
+        self.assertEqual([serpent.loads(serpent.dumps(self.data)), "second"], list(serpent.FrameReader(io.BytesIO(writer.data))))
+
+    def testSocket(self):
+        import asyncio
+        import socket
+        expected = serpent.loads(serpent.dumps(self.data))
+
+        async def exchange():
+            left, right = socket.socketpair()
+            _, writer = await asyncio.open_connection(sock=left)
+            reader, reader_writer = await asyncio.open_connection(sock=right)
+            # the messages don't fit in the socket buffers: writing only completes while they're being read
+            sending = asyncio.ensure_future(serpent.dump_async(self.data, writer, framed=True, checksum=True))
+            first = await serpent.load_async(reader, framed=True, offload_threshold=1000)
+            await sending
+            sending = asyncio.ensure_future(serpent.dump_async(self.data, writer, chunk_size=1000))
+            await sending
+            writer.close()
+            second = await serpent.load_async(reader, engine="native")
+            with self.assertRaises(EOFError):
+                await serpent.load_async(reader, framed=True)
+            reader_writer.close()
+            return first, second
+
+        self.assertEqual((expected, expected), asyncio.run(exchange()))
+
+    def testErrors(self):
+        import asyncio
+
+        async def load(data, **kwargs):
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            return await serpent.load_async(reader, **kwargs)
+
+        stream = io.BytesIO()
+        serpent.FrameWriter(stream, checksum=True).write([1, 2, 3])
+        frame = stream.getvalue()
+        self.assertEqual([1, 2, 3], asyncio.run(load(frame, framed=True)))
+        self.assertEqual([1, 2, 3], asyncio.run(load(serpent.dumps([1, 2, 3]))))
+        corrupted = bytearray(frame)
+        corrupted[-2] ^= 1
+        for data in (frame[:3], frame[:-1], bytes(corrupted), serpent.dumps([1, 2, 3])):
+            with self.assertRaises(ValueError):
+                asyncio.run(load(data, framed=True))
+        with self.assertRaises(ValueError):
+            asyncio.run(load(frame, framed=True, max_size=5))
+        with self.assertRaises(ValueError):
+            asyncio.run(load(frame, engine="bogus"))
+
+
+@unittest.skipUnless(numpy, "requires numpy")
+class TestNumpy(unittest.TestCase):
+    def testArrays(self):
+        arrays = [numpy.arange(5), numpy.arange(6, dtype=numpy.uint8).reshape(2, 3), numpy.arange(8).reshape(2, 2, 2),
+                  numpy.array([0.1, -1.5e300]), numpy.array([1.5, numpy.nan, numpy.inf]), numpy.array([True, False]),
+                  numpy.zeros((2, 0)), numpy.zeros(0), numpy.array(["a", "b"]), numpy.array([1 + 2j]),
+                  numpy.array([1, "two", None], dtype=object), numpy.float32([0.1, 0.2])]
+        for indent in (False, True):
+            for array_obj in arrays:
+                ser = serpent.dumps(array_obj, indent=indent)
+                self.assertEqual(serpent.dumps(array_obj.tolist(), indent=indent), ser)
+        self.assertEqual([[0, 1, 2], [3, 4, 5]], serpent.loads(serpent.dumps(numpy.arange(6).reshape(2, 3))))
+        arrays += [numpy.arange(5000), numpy.arange(6000.0).reshape(3, 20, 100), numpy.array([True, numpy.inf] * 3000),
+                   numpy.ma.masked_array([1, 2, 3], mask=[0, 1, 0])]
+        for indent in (False, True):
+            for array_obj in arrays:
+                ser = serpent.dumps(array_obj, indent=indent)
+                self.assertEqual(ser, b"".join(serpent.iter_dumps(array_obj, indent=indent, chunk_size=16)))
+        self.assertEqual([1.5, {"__class__": "float", "value": "nan"}, float("inf")],
+                         serpent.loads(serpent.dumps(numpy.array([1.5, numpy.nan, numpy.inf]))))
+        self.assertEqual(42, serpent.loads(serpent.dumps(numpy.array(42))))
+        masked = numpy.ma.masked_array([1, 2, 3], [0, 1, 0])
+        self.assertEqual([1, None, 3], serpent.loads(serpent.dumps(masked)))
+
+    def testScalars(self):
+        self.assertEqual(b"7", strip_header(serpent.dumps(numpy.int64(7))))
+        self.assertEqual(b"1.5", strip_header(serpent.dumps(numpy.float64(1.5))))
+        self.assertEqual(b"1e30000", strip_header(serpent.dumps(numpy.float64("inf"))))
+        self.assertEqual(b"True", strip_header(serpent.dumps(numpy.bool_(True))))
+        self.assertEqual(b"'text'", strip_header(serpent.dumps(numpy.str_("text"))))
+        self.assertEqual(b"(1.0+2.0j)", strip_header(serpent.dumps(numpy.complex64(1 + 2j))))
+        self.assertEqual(b"1.5", strip_header(serpent.dumps(numpy.longdouble(1.5))))
+        self.assertEqual(b"'2020-01-02'", strip_header(serpent.dumps(numpy.datetime64("2020-01-02"))))
+        data = {"values": [numpy.int32(1), numpy.int32(2)], numpy.int16(3): numpy.float32(0.5)}
+        self.assertEqual({"values": [1, 2], 3: 0.5}, serpent.loads(serpent.dumps(data)))
+        self.assertEqual({"values": [1, 2], 3: 0.5}, serpent.loads(serpent.dumps(data, engine="iterative")))
+
+    def testRegisteredClassWins(self):
+        serpent.register_class(numpy.ndarray, lambda obj, serializer, outputstream, indentlevel: outputstream.append("'array'"))
+        try:
+            self.assertEqual("array", serpent.loads(serpent.dumps(numpy.arange(3))))
+        finally:
+            serpent.unregister_class(numpy.ndarray)
+        self.assertEqual([0, 1, 2], serpent.loads(serpent.dumps(numpy.arange(3))))
+
+
 if __name__ == '__main__':
     unittest.main()